@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Front end latency per image of ImageSegmentor.process_image with the detector blocking the image it runs on vs
+running in the background (async_detection). The detector & tracker are replaced by simulated ones that sleep
+for their cost & return boxes at the true (moving) object positions, so the ImageSegmentor logic itself is what
+runs. Also reports how far the re-initialized tracks are from the objects when detections are applied.
+
+usage:  python async_detection_benchmark.py [--detect_ms 80] [--track_ms 15] [--fps 30] [--seconds 10] [--detection_period 1]
+"""
+import sys, os, time, argparse
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'front_end'))
+
+BOX_W, BOX_H = 60., 40.
+CLASS_ID = 80  # mslquad
+ARGS = None
+REINIT_ERRS = []  # distance from each re-initialized track to the nearest object [pix]
+
+
+def true_centers(t):
+    """ centers of 2 objects moving in circles (fast enough that the detector's lag matters) [pix] """
+    return np.array([[320 + 120 * np.cos(2 * t), 240 + 80 * np.sin(2 * t)],
+                     [320 + 120 * np.cos(2 * t + np.pi), 240 + 80 * np.sin(2 * t + np.pi)]])
+
+
+class SimDetector:
+    def __init__(self, sample_im, **kwargs):
+        pass
+
+    def detect(self, image):
+        time.sleep(ARGS.detect_ms / 1000)
+        centers = true_centers(image[0])  # (the image is just its time)
+        return np.array([[c[0] - BOX_W / 2, c[1] - BOX_H / 2, BOX_W, BOX_H, 1., 1., CLASS_ID] for c in centers])
+
+
+class SimTracker:
+    def __init__(self, sample_im, **kwargs):
+        pass
+
+    def reinit(self, new_box, image):
+        x, y, w, h = new_box[:4]
+        REINIT_ERRS.append(np.min(np.linalg.norm(true_centers(image[0]) - [x + w / 2, y + h / 2], axis=1)))
+        return {'target_pos': np.array([x + w / 2, y + h / 2]), 'target_sz': np.array([w, h]), 'score': 1.}
+
+    def track_batch(self, image, obj_states):
+        """ moves each track to the nearest true object (the tracker follows whatever it was initialized on) """
+        time.sleep(ARGS.track_ms / 1000)
+        centers = true_centers(image[0])
+        outputs = []
+        for obj_state in obj_states:
+            c = centers[np.argmin(np.sum((centers - obj_state['target_pos'])**2, axis=1))]
+            obj_state = dict(obj_state, target_pos=c)
+            corners = np.array([[c[0] - BOX_W / 2, c[1] - BOX_H / 2], [c[0] + BOX_W / 2, c[1] - BOX_H / 2],
+                                [c[0] + BOX_W / 2, c[1] + BOX_H / 2], [c[0] - BOX_W / 2, c[1] + BOX_H / 2]])
+            outputs.append((obj_state, corners.flatten(), None))
+        return outputs
+
+
+class SimUKF:
+    """ what ImageSegmentor reads from a ukf: the predicted measurement, its covariance & the covariance's factor """
+    def __init__(self, class_str):
+        self.class_str = class_str
+        self.S_obs = np.diag([400., 400., 100., 100., 0.1])
+        self.S_obs_chol = np.linalg.cholesky(self.S_obs)
+
+    def update(self, center):
+        self.obs_pred = (np.array([center[0], center[1], BOX_W, BOX_H, 0.]), self.S_obs, self.S_obs_chol, np.linalg.inv(self.S_obs_chol))
+
+
+# the image segmentor w/ the simulated detector & tracker
+from image_segmentor import ImageSegmentor
+from backends import register_detector, register_tracker
+register_detector('sim', __name__, 'SimDetector')
+register_tracker('sim', __name__, 'SimTracker')
+
+
+def run(b_async):
+    seg = ImageSegmentor(np.zeros(1), detector_name='sim', tracker_name='sim', detect_classes_ids=[CLASS_ID], detect_classes_names=['mslquad'],
+                         detection_period=ARGS.detection_period, async_detection=b_async, warm_up=False)
+    latencies, b_tracking = [], []
+    REINIT_ERRS.clear()
+    t_start = time.time()
+    for idx in range(int(ARGS.fps * ARGS.seconds)):
+        time.sleep(max(0., t_start + idx / ARGS.fps - time.time()))
+        t_img = time.time() - t_start
+        b_tracking.append(len(sum(seg.active_objects_ids_per_class.values(), [])) > 0)
+        tic = time.time()
+        output = seg.process_image(np.array([t_img]), t_img)
+        latencies.append(time.time() - tic)
+        if ARGS.verbose and latencies[-1] > 2 * ARGS.track_ms / 1000:
+            print("image {}: {:.1f} ms".format(idx, 1000 * latencies[-1]))
+        # (the filter's predicted measurement for the next image)
+        for obj_id in output:
+            if obj_id not in seg.ukf_dict:
+                seg.ukf_dict[obj_id] = SimUKF(output[obj_id][1])
+            seg.ukf_dict[obj_id].update(output[obj_id][0][0:2])
+    seg.stop_async_detection()
+    latencies = 1000 * np.array(latencies)[np.argmax(b_tracking):]  # (once something is tracked, before that there is nothing to do but detect)
+    print("{:<8s}: front end latency [ms]: mean {:.1f}, p99 {:.1f}, max {:.1f}. {} detections, tracks are {:.1f} pix "
+          "(max {:.1f}) from the objects when re-initialized".format('async' if b_async else 'blocking', np.mean(latencies),
+          np.percentile(latencies, 99), np.max(latencies), seg.num_detections, np.mean(REINIT_ERRS), np.max(REINIT_ERRS)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='blocking vs background detection')
+    parser.add_argument('--detect_ms', type=float, default=80.)
+    parser.add_argument('--track_ms', type=float, default=15.)
+    parser.add_argument('--fps', type=float, default=30.)
+    parser.add_argument('--seconds', type=float, default=10.)
+    parser.add_argument('--detection_period', type=float, default=1.)
+    parser.add_argument('--verbose', action='store_true')
+    ARGS = parser.parse_args()
+    run(False)
+    run(True)
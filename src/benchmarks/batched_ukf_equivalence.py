@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Checks BatchedUKF.step_ukfs against stepping each UKF on its own (UKF.step_ukf), for every class in
+params/category_params. Objects of all the classes are stepped together (so the batches mix classes, box sizes &
+constraints) & each frame only a random subset of them gets a measurement, so objects in the same batch have
+different dt & last_dt. The filters run free (not re-synced every step), so any difference in the order of the
+math shows up as a growing difference in the estimates.
+
+usage:  python batched_ukf_equivalence.py [--per_class 3] [--steps 60] [--dropout 0.3] [--tol 0]
+"""
+import sys, os, io, argparse, contextlib
+from copy import deepcopy
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from ukf import UKF, BatchedUKF
+from sr_ukf_comparison import PARAMS_DIR, bench_camera, box_verts, make_filter
+
+
+def make_objects(per_class, rng):
+    """ per_class UKFs of every class, w/ random boxes & starting states, all seen by the same camera """
+    class_strs = sorted(f[:-len('_ukf_params.yaml')] for f in os.listdir(PARAMS_DIR) if f.endswith('_ukf_params.yaml'))
+    camera = bench_camera()
+    ukfs = []
+    for class_str in class_strs:
+        for _ in range(per_class):
+            mu0 = np.zeros(13)
+            mu0[0:3] = [3 + 2 * rng.rand(), rng.rand() - 0.5, rng.rand() - 0.5]
+            mu0[3:6] = 0.2 * rng.randn(3)
+            q = np.array([1., 0., 0., 0.]) + 0.1 * rng.randn(4)
+            mu0[6:10] = q / np.linalg.norm(q)
+            mu0[10:13] = 0.2 * rng.randn(3)
+            ukf = make_filter(UKF, class_str, mu0, 0.)
+            ukf.camera = camera
+            ukf.bb_3d = box_verts(*(0.1 + 0.5 * rng.rand(3)))
+            ukf.obj_id = len(ukfs)
+            ukfs.append(ukf)
+    return ukfs
+
+
+def state_diff(ukfs_a, ukfs_b):
+    """ max abs difference per object of mu, sigma & the predicted measurement (& its covariance), after a step """
+    return np.array([max(np.max(np.abs(a.mu - b.mu)), np.max(np.abs(a.sigma - b.sigma)),
+                         np.max(np.abs(a.mu_obs - b.mu_obs)), np.max(np.abs(a.S_obs - b.S_obs)))
+                     for a, b in zip(ukfs_a, ukfs_b)])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='BatchedUKF vs per object UKF equivalence')
+    parser.add_argument('--per_class', type=int, default=3, help='objects of each class')
+    parser.add_argument('--steps', type=int, default=60)
+    parser.add_argument('--dropout', type=float, default=0.3, help='chance an object gets no measurement in a frame')
+    parser.add_argument('--tol', type=float, default=0., help='max allowed abs difference (the two should be identical)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+    serial_ukfs = make_objects(args.per_class, rng)
+    batched_ukfs = deepcopy(serial_ukfs)
+    batched = BatchedUKF()
+    tf_ego_w = np.eye(4)
+    max_diff = np.zeros(len(serial_ukfs))
+    num_stepped = np.zeros(len(serial_ukfs), dtype=int)
+    t = 0.
+    for _ in range(args.steps):
+        t += 0.033 + 0.01 * rng.rand()
+        inds = [n for n in range(len(serial_ukfs)) if rng.rand() > args.dropout]
+        meas = [serial_ukfs[n].predict_measurement(serial_ukfs[n].mu, tf_ego_w) + rng.randn(5) * [2., 2., 2., 2., 0.02]
+                for n in inds]
+        with contextlib.redirect_stdout(io.StringIO()):  # (the filters' verbose prints)
+            for n, z in zip(inds, meas):
+                serial_ukfs[n].step_ukf(z, tf_ego_w, t)
+            batched.step_ukfs([batched_ukfs[n] for n in inds], meas, tf_ego_w, t)
+        num_stepped[inds] += 1
+        if len(inds) > 0:
+            max_diff[inds] = np.maximum(max_diff[inds], state_diff([serial_ukfs[n] for n in inds],
+                                                                   [batched_ukfs[n] for n in inds]))
+
+    print("{} objects, {} frames ({} to {} steps per object)".format(len(serial_ukfs), args.steps,
+                                                                   np.min(num_stepped), np.max(num_stepped)))
+    print("max abs difference (mu, sigma, mu_obs, S_obs) per class:")
+    b_failed = False
+    for class_str in sorted(set(ukf.class_str for ukf in serial_ukfs)):
+        diff = max(d for d, ukf in zip(max_diff, serial_ukfs) if ukf.class_str == class_str)
+        b_failed |= diff > args.tol
+        print("  {:10s} {:.3e}{}".format(class_str, diff, '  <-- over tol' if diff > args.tol else ''))
+    if b_failed:
+        print("FAILED: batched & per object steps differ by more than {}".format(args.tol))
+        sys.exit(1)
+    print("PASSED")
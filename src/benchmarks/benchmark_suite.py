@@ -0,0 +1,457 @@
+#!/usr/bin/env python3
+"""
+Timing of the hot paths on fixed seed inputs, compared against a stored baseline (json) of earlier runs on the
+same machine (baselines/<hostname>.json, not committed: timings from one machine say nothing about another).
+--save_baseline runs the whole suite --runs times & stores each benchmark's median time per item (median over the
+runs of the median over the repeats) & its run to run spread (slowest run's median / the median - 1). Fails (exit
+code 1) if any benchmark's median is slower than its baseline by more than max(--tol, 2 x its spread), i.e. the
+tolerance is always above the noise measured on that machine. A benchmark over it is rerun (--confirm times) & only
+fails if all the reruns are over it too (load bursts on a shared machine don't last, a real slow down does).
+Benchmarks whose dependencies are missing (e.g. rosbag for rosbag_to_logs) are skipped & listed at the end, w/
+--require_all that fails the run too.
+
+    ukf_step_<class>            UKF.step_ukf (SRUKF if the class uses it) w/ each class' params, per step
+    predict_measurement         UKF.predict_measurement of one state
+    predict_measurements_sps    UKF.predict_measurements of all the sigma points
+    nearestPD                   of a 12 x 12 (covariance sized) indefinite matrix
+    average_quaternions         of the 25 sigma point quaternions, weighted
+    bb_corners_to_angled_bb     of 4 corners
+    raptor_logger_write         RaptorLogger.write_data_to_log, per row (est, gt & err)
+    raptor_logger_write_bin     same, w/ the binary log format
+    raptor_logger_write_async   same, w/ the async writer (spill policy), the caller's time only
+    raptor_logger_read          RaptorLogger.read_logs, per row
+    raptor_logger_read_bin      same, w/ the binary log format
+    raptor_logger_read_cols     RaptorLogger.read_err_logs of 4 columns of a text log w/ its sidecar (in a cache dir), per row
+    pose_metrics                PoseMetricTracker.update_all_metrics, per estimate
+    rosbag_to_logs              rosbags_to_logs (bag parsing & log conversion) of a simulated bag, per estimate
+    rosbag_to_logs_streaming    same, single pass w/ b_streaming
+    closest_inds_by_time        ros_utils.find_closest_inds_by_time of 1000 estimate stamps in 3000 mocap stamps, per query
+    backend_frame               FilterBank.step on a synthetic_scenario frame w/ 20 objects, per frame
+    instrumentation_span        an enabled (empty) instruments.span
+
+usage:  python benchmark_suite.py [--baseline baselines/<hostname>.json] [--save_baseline [--runs 5]] [--tol 0.25]
+            [--only regex] [--repeats 7] [--confirm 2] [--require_all]
+"""
+import sys, os, io, re, time, json, socket, platform, argparse, tempfile, contextlib
+from collections import OrderedDict
+from types import SimpleNamespace
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils_msl_raptor'))  # (for the modules that import their siblings directly)
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+BENCHMARKS = OrderedDict()  # name: fn() -> (seconds, number of items timed)
+
+
+def benchmark(name):
+    def register(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return register
+
+
+########## FILTER ##########
+def register_ukf_steps():
+    """ one benchmark per class in params/category_params """
+    params_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'params', 'category_params')  # (same as sr_ukf_comparison's, w/o importing the filter)
+    for f in sorted(os.listdir(params_dir)):
+        class_str = f.split('_')[0]
+        benchmark('ukf_step_' + class_str)(lambda class_str=class_str: ukf_steps(class_str))
+
+
+def ukf_steps(class_str, num_steps=100):
+    import yaml
+    from ukf import UKF, SRUKF
+    from sr_ukf_comparison import PARAMS_DIR, make_filter, record_inputs
+    with open(os.path.join(PARAMS_DIR, class_str + '_ukf_params.yaml')) as stream:
+        ukf_class = SRUKF if yaml.safe_load(stream).get('b_sqrt_ukf', False) else UKF
+    rec = record_inputs(class_str, num_steps, seed=0)
+    ukf = make_filter(ukf_class, class_str, rec['mu0'], rec['times'][0] - 0.033)
+    tic = time.perf_counter()
+    for t, z, tf_ego_w in zip(rec['times'], rec['meas'], rec['tf_ego_w']):
+        ukf.step_ukf(z, tf_ego_w, t)
+    return time.perf_counter() - tic, num_steps
+
+
+register_ukf_steps()
+
+
+def mslquad_filter_and_state():
+    from ukf import UKF
+    from sr_ukf_comparison import make_filter, record_inputs
+    rec = record_inputs('mslquad', 1, seed=0)
+    return make_filter(UKF, 'mslquad', rec['mu0'], 0.), rec['mu0']
+
+
+@benchmark('predict_measurement')
+def predict_measurement(reps=500):
+    ukf, state = mslquad_filter_and_state()
+    tf_ego_w = np.eye(4)
+    tic = time.perf_counter()
+    for _ in range(reps):
+        ukf.predict_measurement(state, tf_ego_w)
+    return time.perf_counter() - tic, reps
+
+
+@benchmark('predict_measurements_sps')
+def predict_measurements_sps(reps=200):
+    ukf, state = mslquad_filter_and_state()
+    sps = ukf.calc_sigma_points(state, ukf.sigma)
+    tf_ego_w = np.eye(4)
+    tic = time.perf_counter()
+    for _ in range(reps):
+        ukf.predict_measurements(sps, tf_ego_w)
+    return time.perf_counter() - tic, reps
+
+
+@benchmark('nearestPD')
+def nearest_pd(reps=200):
+    from utils_msl_raptor.ukf_utils import nearestPD
+    rng = np.random.RandomState(0)
+    mats = []
+    for _ in range(reps):
+        A = rng.randn(12, 12)
+        mats.append(A @ A.T - 2 * np.eye(12))  # (symmetric, w/ negative eigenvalues)
+    tic = time.perf_counter()
+    for A in mats:
+        nearestPD(A)
+    return time.perf_counter() - tic, reps
+
+
+@benchmark('average_quaternions')
+def average_quaternions_bench(reps=500):
+    from utils_msl_raptor.math_utils import average_quaternions
+    rng = np.random.RandomState(0)
+    Q = np.array([1., 0., 0., 0.]) + 0.05 * rng.randn(25, 4)
+    Q /= np.linalg.norm(Q, axis=1)[:, None]
+    w = np.full(25, 0.5 / 24)
+    w[0] = 0.5
+    tic = time.perf_counter()
+    for _ in range(reps):
+        average_quaternions(Q, w)
+    return time.perf_counter() - tic, reps
+
+
+@benchmark('bb_corners_to_angled_bb')
+def bb_corners_to_angled_bb_bench(reps=1000):
+    from utils_msl_raptor.ukf_utils import bb_corners_to_angled_bb
+    rng = np.random.RandomState(0)
+    ang = rng.uniform(-np.pi / 2, np.pi / 2, reps)
+    corners = [np.array([[np.cos(a), np.sin(a)], [-np.sin(a), np.cos(a)]]) @ np.array([[-30, -20], [30, -20], [30, 20], [-30, 20]]).T for a in ang]
+    corners = [c.T + [320, 240] for c in corners]
+    tic = time.perf_counter()
+    for c in corners:
+        bb_corners_to_angled_bb(c)
+    return time.perf_counter() - tic, reps
+
+
+@benchmark('backend_frame')
+def backend_frame(num_objs=20, num_frames=15):
+    from synthetic_scenario import SyntheticScenario, load_objects, make_camera, run_backend
+    with contextlib.redirect_stdout(io.StringIO()):
+        scenario = SyntheticScenario(num_objs, load_objects(), make_camera(), seed=0)
+    res = run_backend(scenario, num_frames, b_gate=False)  # (the first frame only initializes the filters & isn't timed)
+    return np.sum(res.step_times), len(res.step_times)
+
+
+@benchmark('instrumentation_span')
+def instrumentation_span(reps=20000):
+    from utils_msl_raptor.instrumentation import Instrumentation
+    instruments = Instrumentation(enabled=True)
+    tic = time.perf_counter()
+    for _ in range(reps):
+        with instruments.span('bench'):
+            pass
+    return time.perf_counter() - tic, reps
+
+
+########## LOGGING & POST PROCESSING ##########
+def log_row(rng, t):
+    return {'time': t, 'state_est': rng.randn(13), 'ego_state_est': rng.randn(13), 'corners_3d_est': rng.randn(24),
+            'proj_corners_est': rng.randn(16), 'abb': rng.randn(5), 'im_seg_mode': 2, 'state_gt': rng.randn(13),
+            'ego_state_gt': rng.randn(13), 'corners_3d_gt': rng.randn(24), 'proj_corners_gt': rng.randn(16),
+            'x_err': rng.randn(), 'y_err': rng.randn(), 'z_err': rng.randn(), 'ang_err': rng.randn(), 'pix_err': rng.randn(),
+            'add_err': rng.randn(), 'measurement_dist': rng.randn()}
+
+
+def write_logs(base_path, num_rows, log_format='txt'):
+    from raptor_logger import RaptorLogger
+    rng = np.random.RandomState(0)
+    rows = [log_row(rng, k / 30) for k in range(num_rows)]
+    logger = RaptorLogger(mode="write", names=['quad4'], base_path=base_path, log_format=log_format)
+    logger.write_params({'K': np.array([617., 617., 324., 241.]), 'tf_cam_ego': np.eye(4).flatten(), '3d_bb_dims': np.array([0.27, 0.27, 0.13, 0.4])})
+    tic = time.perf_counter()
+    for row in rows:
+        for mode in logger.modes:
+            logger.write_data_to_log(row, 'quad4', mode=mode)
+    logger.close_files()
+    return time.perf_counter() - tic
+
+
+@benchmark('raptor_logger_write')
+def raptor_logger_write(num_rows=300):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        return write_logs(os.path.join(tmp_dir, 'log'), num_rows), num_rows
+
+
+@benchmark('raptor_logger_read')
+def raptor_logger_read(num_rows=300, log_format='txt'):
+    from raptor_logger import RaptorLogger
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        base_path = os.path.join(tmp_dir, 'log')
+        write_logs(base_path, num_rows, log_format)
+        tic = time.perf_counter()
+        logger = RaptorLogger(mode="read", base_path=base_path)
+        logger.read_logs('quad4')
+        return time.perf_counter() - tic, num_rows
+
+
+@benchmark('raptor_logger_write_async')
+def raptor_logger_write_async(num_rows=300):
+    from raptor_logger import RaptorLogger, SPILL
+    rng = np.random.RandomState(0)
+    rows = [log_row(rng, k / 30) for k in range(num_rows)]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        logger = RaptorLogger(mode="write", names=['quad4'], base_path=os.path.join(tmp_dir, 'log'), b_async=True, overflow_policy=SPILL)
+        tic = time.perf_counter()
+        for row in rows:
+            for mode in logger.modes:
+                logger.write_data_to_log(row, 'quad4', mode=mode)
+        toc = time.perf_counter()  # (the time the caller spends, the writing itself happens in the background)
+        logger.close_files()
+        return toc - tic, num_rows
+
+
+@benchmark('raptor_logger_read_cols')
+def raptor_logger_read_cols(num_rows=300):
+    from raptor_logger import RaptorLogger
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        base_path = os.path.join(tmp_dir, 'log')
+        write_logs(base_path, num_rows)
+        logger = RaptorLogger(mode="read", base_path=base_path, sidecar_dir=os.path.join(tmp_dir, 'cache'))
+        logger.read_err_logs(base_path + '_quad4_err.log')  # (makes the sidecar)
+        tic = time.perf_counter()
+        logs = logger.read_err_logs(base_path + '_quad4_err.log', keys=['x_err', 'y_err', 'z_err', 'ang_err'])
+        np.sum([logs[key] for key in logs])
+        return time.perf_counter() - tic, num_rows
+
+
+@benchmark('raptor_logger_write_bin')
+def raptor_logger_write_bin(num_rows=300):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        return write_logs(os.path.join(tmp_dir, 'log'), num_rows, 'bin'), num_rows
+
+
+@benchmark('raptor_logger_read_bin')
+def raptor_logger_read_bin(num_rows=300):
+    return raptor_logger_read(num_rows, 'bin')
+
+
+def random_pose_pairs(rng, num):
+    """ (tf_w_cam, tf_cam_ado_gt, tf_cam_ado_pr) w/ the object a few meters in front of the camera """
+    from utils_msl_raptor.quat_utils import axang_to_quat, quat_to_rotm
+    pairs = []
+    for _ in range(num):
+        tfs = np.tile(np.eye(4), (3, 1, 1))
+        tfs[:, 0:3, 0:3] = quat_to_rotm(axang_to_quat(0.3 * rng.randn(3, 3)))
+        tfs[0, 0:3, 3] = rng.randn(3)
+        tfs[1, 0:3, 3] = [0., 0., 3.] + 0.5 * rng.randn(3)
+        tfs[2, 0:3, 3] = tfs[1, 0:3, 3] + 0.05 * rng.randn(3)
+        pairs.append(tfs)
+    return pairs
+
+
+@benchmark('pose_metrics')
+def pose_metrics(reps=300):
+    from pose_metrics import PoseMetricTracker
+    from sr_ukf_comparison import box_verts
+    rng = np.random.RandomState(0)
+    pairs = random_pose_pairs(rng, reps)
+    vertices = box_verts(0.27, 0.27, 0.13).T
+    K = np.array([[617.2744, 0., 324.1011], [0., 617.3357, 241.5791], [0., 0., 1.]])
+    metrics = PoseMetricTracker(px_thresh=5, prct_thresh=10, trans_thresh=0.05, ang_thresh=5, names=['quad4'], bb_3d_dict={'quad4': [0.27, 0.27, 0.13, 0.4]})
+    tic = time.perf_counter()
+    for tf_w_cam, tf_cam_ado_gt, tf_cam_ado_pr in pairs:
+        metrics.update_all_metrics(name='quad4', vertices=vertices, tf_w_cam=tf_w_cam, R_cam_ado_gt=tf_cam_ado_gt[0:3, 0:3], t_cam_ado_gt=tf_cam_ado_gt[0:3, 3:4],
+                                   R_cam_ado_pr=tf_cam_ado_pr[0:3, 0:3], t_cam_ado_pr=tf_cam_ado_pr[0:3, 3:4], K=K)
+    return time.perf_counter() - tic, reps
+
+
+class SimBag:
+    """ the messages of a recording of the node (est at 30 Hz, mocap at 100 Hz) w/ one mslquad (quad4) flying by """
+
+    def __init__(self, seconds=10., ns='/quad7'):
+        import rospy
+        from geometry_msgs.msg import PoseStamped
+        from sensor_msgs.msg import CameraInfo
+        from msl_raptor.msg import AngledBbox, AngledBboxes, TrackedObjects, TrackedObject
+        rng = np.random.RandomState(0)
+
+        def pose_stamped(t, pos):
+            msg = PoseStamped()
+            msg.header.stamp = rospy.Time.from_sec(t)
+            msg.pose.position.x, msg.pose.position.y, msg.pose.position.z = pos
+            msg.pose.orientation.w = 1.
+            return msg
+        t0 = 1000.
+        camera_info = CameraInfo()
+        camera_info.header.stamp = rospy.Time.from_sec(t0)
+        camera_info.K, camera_info.D, camera_info.width, camera_info.height = [617.2744, 0., 324.1011, 0., 617.3357, 241.5791, 0., 0., 1.], [], 640, 480
+        self.messages = [(ns + '/camera/camera_info', camera_info, camera_info.header.stamp)]
+        for t in t0 + np.arange(0, seconds, 0.01):
+            ado_pos = [3., np.sin(t - t0), 1.]
+            for topic, pos in [(ns + '/mavros/vision_pose/pose', [0., 0., 1.]), (ns + '/mavros/local_position/pose', [0., 0., 1.]), ('/quad4/mavros/vision_pose/pose', ado_pos)]:
+                msg = pose_stamped(t, pos)
+                self.messages.append((topic, msg, msg.header.stamp))
+        self.num_estimates = 0
+        for t in t0 + np.arange(0.005, seconds - 0.1, 1 / 30):
+            obj = TrackedObject()
+            obj.pose = pose_stamped(t, np.array([3., np.sin(t - t0), 1.]) + 0.05 * rng.randn(3))
+            obj.class_str = 'mslquad'
+            obj.id = 0
+            self.messages.append((ns + '/msl_raptor_state', TrackedObjects(tracked_objects=[obj]), obj.pose.header.stamp))
+            bb_msg, bb_list_msg = AngledBbox(), AngledBboxes()
+            bb_msg.header.stamp = bb_list_msg.header.stamp = obj.pose.header.stamp
+            bb_msg.x, bb_msg.y, bb_msg.width, bb_msg.height, bb_msg.angle, bb_msg.im_seg_mode, bb_msg.class_str = 320., 240., 60., 40., 0., 2, 'quad4'
+            bb_list_msg.boxes.append(bb_msg)
+            self.messages.append((ns + '/bb_data', bb_list_msg, obj.pose.header.stamp))
+            self.num_estimates += 1
+        self.messages.sort(key=lambda m: m[2].to_sec())
+
+    def read_messages(self, topics=None):
+        return iter(self.messages if topics is None else [m for m in self.messages if m[0] in topics])
+
+    def get_type_and_topic_info(self):
+        return SimpleNamespace(msg_types={}, topics={m[0]: None for m in self.messages})
+
+
+@benchmark('rosbag_to_logs')
+def rosbag_to_logs_bench(b_streaming=False):
+    from rosbag_to_logs import rosbags_to_logs
+    bag = SimBag()
+    with tempfile.TemporaryDirectory() as tmp_dir, contextlib.redirect_stdout(io.StringIO()):
+        tic = time.perf_counter()
+        rosbags_to_logs(rb_name='msl_raptor_output_from_bag_benchmark.bag', ado_yaml='all_obs', bag=bag, log_out_dir=tmp_dir, b_show_plots=False,
+                        b_streaming=b_streaming)
+        return time.perf_counter() - tic, bag.num_estimates
+
+
+@benchmark('rosbag_to_logs_streaming')
+def rosbag_to_logs_streaming():
+    return rosbag_to_logs_bench(b_streaming=True)
+
+
+@benchmark('closest_inds_by_time')
+def closest_inds_by_time(num_queries=1000):
+    from ros_utils import find_closest_inds_by_time
+    rng = np.random.RandomState(0)
+    stamps = np.sort(rng.uniform(0, 30, 3000))  # (100 Hz mocap)
+    queries = np.sort(rng.uniform(0, 30, num_queries))  # (30 Hz estimates)
+    tic = time.perf_counter()
+    find_closest_inds_by_time(queries, stamps)
+    return time.perf_counter() - tic, num_queries
+
+
+########## RUNNER ##########
+def run_benchmark(fn, repeats):
+    """ median & min [us] per item over repeats (after one untimed warm-up run) """
+    fn()
+    per_item = []
+    for _ in range(repeats):
+        seconds, num_items = fn()
+        per_item.append(1e6 * seconds / num_items)
+    return {'median_us': float(np.median(per_item)), 'min_us': float(np.min(per_item)), 'items': int(num_items)}
+
+
+def run_suite(only, repeats):
+    """ run_benchmark of each benchmark matching only (a regex, None: all). Returns the results by name & the names of the ones skipped """
+    results, skipped = OrderedDict(), OrderedDict()
+    for name, fn in BENCHMARKS.items():
+        if only is not None and not re.search(only, name):
+            continue
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):  # (the code under test prints)
+                results[name] = run_benchmark(fn, repeats)
+        except ImportError as e:
+            skipped[name] = str(e)
+    return results, skipped
+
+
+def combine_runs(runs):
+    """ one baseline entry per benchmark from several run_suite results: median of the medians, min & run to run spread """
+    combined = OrderedDict()
+    for name in runs[0]:
+        medians = [run[name]['median_us'] for run in runs]
+        median = float(np.median(medians))
+        combined[name] = {'median_us': median, 'min_us': min(run[name]['min_us'] for run in runs), 'spread': max(medians) / median - 1,
+                          'items': runs[0][name]['items'], 'runs': len(runs)}
+    return combined
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark the hot paths & compare to a stored baseline')
+    parser.add_argument('--baseline', default=os.path.join(BASELINE_DIR, socket.gethostname() + '.json'))
+    parser.add_argument('--save_baseline', action='store_true', help='store the median of --runs runs as the baseline (instead of comparing to it)')
+    parser.add_argument('--runs', type=int, default=5, help='runs of the whole suite for --save_baseline')
+    parser.add_argument('--tol', type=float, default=0.25, help='min allowed slow down (fraction of the baseline), raised to 2x the measured spread')
+    parser.add_argument('--only', default=None, help='only run the benchmarks whose name matches this regex')
+    parser.add_argument('--repeats', type=int, default=7)
+    parser.add_argument('--confirm', type=int, default=2, help='reruns of a benchmark over its tolerance, it only fails if they all are')
+    parser.add_argument('--require_all', action='store_true', help='fail if any benchmark was skipped (e.g. a broken import)')
+    args = parser.parse_args()
+
+    if args.save_baseline:
+        runs = []
+        for run_ind in range(args.runs):
+            results, skipped = run_suite(args.only, args.repeats)
+            runs.append(results)
+            print("run {}/{} done".format(run_ind + 1, args.runs))
+        results = combine_runs(runs)
+        for name, res in results.items():
+            print("{:<26s} {:>10.1f} us (min {:.1f}, {} items)  spread {:.0%}".format(name, res['median_us'], res['min_us'], res['items'], res['spread']))
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        meta = {'host': socket.gethostname(), 'platform': platform.platform(), 'python': platform.python_version(),
+                'numpy': np.__version__, 'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'repeats': args.repeats, 'runs': args.runs}
+        with open(args.baseline, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=2)
+        print("saved baseline to {}".format(args.baseline))
+    else:
+        baseline = None
+        if os.path.isfile(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)['results']
+        else:
+            print("no baseline at {} (make one w/ --save_baseline), only timing".format(args.baseline))
+        results, skipped = run_suite(args.only, args.repeats)
+        regressions = []
+        for name, res in results.items():
+            line = "{:<26s} {:>10.1f} us (min {:.1f}, {} items)".format(name, res['median_us'], res['min_us'], res['items'])
+            if baseline is not None and name in baseline:
+                ratio = res['median_us'] / baseline[name]['median_us']
+                tol = max(args.tol, 2 * baseline[name].get('spread', 0.))
+                line += "  {:.2f}x baseline (tol {:.0%})".format(ratio, tol)
+                num_reruns = 0
+                while ratio > 1 + tol and num_reruns < args.confirm:
+                    rerun, _ = run_suite('^{}$'.format(re.escape(name)), args.repeats)
+                    ratio = rerun[name]['median_us'] / baseline[name]['median_us']
+                    num_reruns += 1
+                    line += ", rerun {:.2f}x".format(ratio)
+                if ratio > 1 + tol:
+                    regressions.append(name)
+                    line += "  REGRESSED"
+            elif baseline is not None:
+                line += "  (not in baseline)"
+            print(line)
+
+    for name, err in skipped.items():
+        print("{:<26s} skipped ({})".format(name, err))
+    if len(skipped) > 0:
+        print("{} benchmarks skipped: {}".format(len(skipped), ', '.join(skipped)))
+    if not args.save_baseline and len(regressions) > 0:
+        print("FAILED: {} slower than the baseline by more than its tolerance".format(', '.join(regressions)))
+        sys.exit(1)
+    if args.require_all and len(skipped) > 0:
+        print("FAILED: skipped benchmarks w/ --require_all")
+        sys.exit(1)
+    if not args.save_baseline and baseline is not None:
+        print("PASSED")
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Matching detections to tracks on redetection: the previous ImageSegmentor.reinit_tracker loop (per detection, the
+nearest unmatched track by Mahalanobis distance, inverting S for every pair) vs utils_msl_raptor/data_association.py
+(one vectorized gated cost matrix w/ one cholesky factor per track, then the min total cost assignment).
+Objects are placed close together so a greedy match can take another detection's track. Reports the time per
+redetection & how many detections are matched to the wrong track. Also times gating candidate boxes against
+filters w/ S_obs inverted per pair vs the factor each filter publishes once per step (UKF.set_obs_pred, done in
+the filter's step so not timed here, & mahalanobis_dist_sq).
+
+usage:  python data_association_benchmark.py [--max_objs 48] [--trials 200]
+"""
+import sys, os, time, argparse
+import numpy as np
+import numpy.linalg as la
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils_msl_raptor.data_association import associate, mahalanobis_dist_sq
+from ukf import UKF
+
+CHI2_001 = 20.52  # (ImageSegmentor.chi2_001)
+
+
+def greedy_associate(meas, means, S):
+    """ the previous reinit_tracker matching (compute_mahalanobis_dist per pair) """
+    matches, matched = [], []
+    for i, z in enumerate(meas):
+        best, best_dist = None, CHI2_001
+        for j, (mu, cov) in enumerate(zip(means, S)):
+            if j in matched:
+                continue
+            diff = z - mu
+            dist = np.sqrt(diff @ la.inv(cov) @ diff)
+            if dist < best_dist:
+                best, best_dist = j, dist
+        if best is not None:
+            matched.append(best)
+            matches.append((i, best))
+    return matches
+
+
+def make_scene(num_objs, rng):
+    """ tracks' predicted [cx, cy, w, h, angle] & S, & detections of the same objects (in a random order) """
+    means = np.column_stack([rng.uniform(0, 640, num_objs), rng.uniform(0, 480, num_objs),
+                             rng.uniform(30, 80, num_objs), rng.uniform(30, 80, num_objs), np.zeros(num_objs)])
+    S = np.array([np.diag([rng.uniform(100, 900), rng.uniform(100, 900), 50., 50., 0.1]) for _ in range(num_objs)])
+    truth = rng.permutation(num_objs)  # detection i is of track truth[i]
+    meas = means[truth] + np.column_stack([rng.normal(0, 15, (num_objs, 2)), rng.normal(0, 4, (num_objs, 2)), np.zeros(num_objs)])
+    return meas, means, S, truth
+
+
+def gating_times(num_boxes, num_filters, rng, reps=50):
+    """ [ms] per step (new S_obs on every filter) to gate num_boxes against each of num_filters filters """
+    means = [make_scene(1, rng)[1][0] for _ in range(num_filters)]
+    boxes = np.array([means[0] + rng.normal(0, 5, 5) for _ in range(num_boxes)])
+    ukfs = [UKF.__new__(UKF) for _ in range(num_filters)]  # (only the published obs_pred is needed)
+    t_inv, t_cached = 0., 0.
+    for _ in range(reps):
+        for ukf, mu in zip(ukfs, means):
+            ukf.set_obs_pred(mu, np.diag(rng.uniform(50, 500, 5)))
+        tic = time.perf_counter()
+        ref = [[np.sqrt((b - ukf.mu_obs) @ la.inv(ukf.S_obs) @ (b - ukf.mu_obs)) for ukf in ukfs] for b in boxes]
+        t_inv += time.perf_counter() - tic
+        tic = time.perf_counter()
+        dist = np.sqrt(mahalanobis_dist_sq(boxes, ukfs))
+        t_cached += time.perf_counter() - tic
+        assert np.allclose(dist, ref)
+    return 1000 * t_inv / reps, 1000 * t_cached / reps
+
+
+def run(fn, scenes):
+    num_wrong, num_total = 0, 0
+    tic = time.perf_counter()
+    results = [fn(meas, means, S) for meas, means, S, _ in scenes]
+    elapsed = time.perf_counter() - tic
+    for matches, (_, _, _, truth) in zip(results, scenes):
+        num_wrong += sum(truth[i] != j for i, j in matches)
+        num_total += len(truth)
+    return 1000 * elapsed / len(scenes), num_wrong / num_total
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='greedy vs gated min cost matching of detections to tracks')
+    parser.add_argument('--max_objs', type=int, default=48)
+    parser.add_argument('--trials', type=int, default=200)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    num_objs = 3
+    while num_objs <= args.max_objs:
+        scenes = [make_scene(num_objs, rng) for _ in range(args.trials)]
+        greedy_ms, greedy_wrong = run(greedy_associate, scenes)
+        opt_ms, opt_wrong = run(lambda meas, means, S: associate(meas, means, S, CHI2_001**2)[0], scenes)
+        print("{:>3d} objects: greedy {:.3f} ms, {:.1%} wrong matches | gated assignment {:.3f} ms, {:.1%} wrong "
+              "matches".format(num_objs, greedy_ms, greedy_wrong, opt_ms, opt_wrong))
+        num_objs *= 2
+
+    for num_boxes, num_filters in [(1, 1), (10, 1), (10, 10), (40, 40)]:
+        inv_ms, cached_ms = gating_times(num_boxes, num_filters, rng)
+        print("gating {:>2d} box(es) x {:>2d} filter(s): S_obs inverted per pair {:.3f} ms | factor from the step {:.3f} ms".format(
+              num_boxes, num_filters, inv_ms, cached_ms))
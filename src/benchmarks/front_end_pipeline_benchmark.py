@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Throughput & latency of the pipelined front end (utils_msl_raptor/pipeline_utils.py) vs running all the stages
+in the image callback, with simulated stage costs. A camera publishes frames at a fixed rate, the stages sleep for
+their cost (the real work - cv2, the detector & tracker - mostly releases the GIL, like sleep does).
+
+usage:  python front_end_pipeline_benchmark.py [--fps 30] [--preprocess_ms 8] [--inference_ms 25] [--filter_ms 5] [--seconds 5]
+"""
+import sys, os, time, argparse, threading
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils_msl_raptor.pipeline_utils import RingBuffer, PipelineStage, DROP_OLDEST
+
+
+class Frame:
+    def __init__(self, idx):
+        self.idx = idx
+        self.stamps = {'capture': time.time()}
+
+
+def camera(fps, seconds, callback):
+    """ call callback with a new frame at fps (like a rospy subscriber with queue_size=1: frames arriving while
+    the callback is busy are dropped, except the latest one) """
+    pending = RingBuffer(1, DROP_OLDEST, name='ros queue')
+    def spin():
+        while True:
+            frame = pending.pop()
+            if frame is None:
+                break
+            callback(frame)
+    spinner = threading.Thread(target=spin, daemon=True)
+    spinner.start()
+    t_start = time.time()
+    for idx in range(int(fps * seconds)):
+        time.sleep(max(0., t_start + idx / fps - time.time()))
+        pending.push(Frame(idx))
+    pending.close()
+    spinner.join()
+    return pending.num_pushed
+
+
+def run(mode, args):
+    done = []
+    def work(name, cost_ms):
+        def fn(frame):
+            time.sleep(cost_ms / 1000)
+            frame.stamps[name] = time.time()
+            return frame
+        return fn
+    preprocess = work('preprocess', args.preprocess_ms)
+    inference = work('inference', args.inference_ms)
+    filter_step = work('filter', args.filter_ms)
+
+    if mode == 'callback':
+        def image_cb(frame):
+            done.append(filter_step(inference(preprocess(frame))))
+        num_frames = camera(args.fps, args.seconds, image_cb)
+        bufs, stages = [], []
+    else:
+        capture_buf = RingBuffer(2, DROP_OLDEST, name='capture -> preprocess')
+        preproc_buf = RingBuffer(1, DROP_OLDEST, name='preprocess -> inference')
+        result_buf = RingBuffer(1, DROP_OLDEST, name='inference -> filter')
+        bufs = [capture_buf, preproc_buf, result_buf]
+        stages = [PipelineStage('preprocess', preprocess, capture_buf, preproc_buf),
+                  PipelineStage('inference', inference, preproc_buf, result_buf),
+                  PipelineStage('filter', lambda frame: done.append(filter_step(frame)), result_buf)]
+        for stage in stages:
+            stage.start()
+        num_frames = camera(args.fps, args.seconds, capture_buf.push)
+        for stage in stages:
+            stage.stop()
+            stage.join()
+
+    latency = np.array([frame.stamps['filter'] - frame.stamps['capture'] for frame in done])
+    print("{:<9s}: {} of {} frames filtered ({:.1f} Hz), capture to filter latency [ms]: mean {:.1f}, max {:.1f}".format(
+        mode, len(done), num_frames, len(done) / args.seconds, 1000 * np.mean(latency), 1000 * np.max(latency)))
+    for obj in bufs + stages:
+        print("\t" + obj.stats_str())
+    return len(done) / args.seconds
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='pipelined vs in-callback front end')
+    parser.add_argument('--fps', type=float, default=30)
+    parser.add_argument('--preprocess_ms', type=float, default=8)
+    parser.add_argument('--inference_ms', type=float, default=25)
+    parser.add_argument('--filter_ms', type=float, default=5)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+    slowest = max(args.preprocess_ms, args.inference_ms, args.filter_ms)
+    print("stage costs [ms]: {} / {} / {}  ->  max rate in the callback {:.1f} Hz, pipelined {:.1f} Hz (camera {} Hz)".format(
+        args.preprocess_ms, args.inference_ms, args.filter_ms, 1000 / (args.preprocess_ms + args.inference_ms + args.filter_ms),
+        1000 / slowest, args.fps))
+    run('callback', args)
+    run('pipeline', args)
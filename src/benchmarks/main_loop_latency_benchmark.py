@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Capture to publish latency of the main loop polling for new images at a fixed rate (rospy.Rate) vs blocking on the
+front end's result buffer (event driven handoff, ROS.wait_for_frame). Frames arrive at a fixed rate with a small
+jitter & the front end & filter costs are simulated by sleeping.
+
+usage:  python main_loop_latency_benchmark.py [--fps 30] [--poll_hz 30] [--front_end_ms 20] [--filter_ms 5] [--seconds 5]
+"""
+import sys, os, time, argparse, threading
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils_msl_raptor.pipeline_utils import RingBuffer, DROP_OLDEST
+
+
+class Frame:
+    def __init__(self, idx):
+        self.idx = idx
+        self.stamps = {'capture': time.time()}
+
+
+def front_end(args, on_result, rng):
+    """ make frames at args.fps, each handed to on_result once its (simulated) front end processing is done """
+    t_start = time.time()
+    for idx in range(int(args.fps * args.seconds)):
+        time.sleep(max(0., t_start + (idx + 0.2 * rng.rand()) / args.fps - time.time()))
+        frame = Frame(idx)
+        time.sleep(args.front_end_ms / 1000)
+        on_result(frame)
+
+
+def run(mode, args):
+    rng = np.random.RandomState(0)
+    latency = []
+    b_done = threading.Event()
+
+    def filter_and_publish(frame):
+        time.sleep(args.filter_ms / 1000)
+        latency.append(time.time() - frame.stamps['capture'])
+
+    if mode == 'polling':
+        latest = [None]  # like ROS.latest_img_time / im_process_output, overwritten by the front end
+        def on_result(frame):
+            latest[0] = frame
+        def main_loop():
+            period = 1. / args.poll_hz
+            t_next = time.time()
+            prev_idx = -1
+            while not b_done.is_set():
+                frame = latest[0]
+                if frame is not None and frame.idx > prev_idx:
+                    prev_idx = frame.idx
+                    filter_and_publish(frame)
+                t_next += period  # rospy.Rate.sleep
+                time.sleep(max(0., t_next - time.time()))
+        result_buf = None
+    else:
+        result_buf = RingBuffer(1, DROP_OLDEST, name='inference -> filter')
+        on_result = result_buf.push
+        def main_loop():
+            while True:
+                frame = result_buf.pop(timeout=0.5)
+                if frame is None:
+                    if result_buf.b_closed:
+                        break
+                    continue
+                filter_and_publish(frame)
+
+    loop = threading.Thread(target=main_loop, daemon=True)
+    loop.start()
+    front_end(args, on_result, rng)
+    time.sleep(2. / args.fps)  # let the last frame through
+    b_done.set()
+    if result_buf is not None:
+        result_buf.close()
+    loop.join()
+
+    latency = 1000 * np.array(latency)
+    num_frames = int(args.fps * args.seconds)
+    print("{:<8s}: {} of {} frames published, capture to publish latency [ms]: mean {:.1f}, median {:.1f}, "
+          "p95 {:.1f}, max {:.1f}".format(mode, len(latency), num_frames, np.mean(latency), np.median(latency),
+                                          np.percentile(latency, 95), np.max(latency)))
+    return np.mean(latency)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='polling vs event driven main loop latency')
+    parser.add_argument('--fps', type=float, default=30.)
+    parser.add_argument('--poll_hz', type=float, default=30., help='rate of the polling main loop')
+    parser.add_argument('--front_end_ms', type=float, default=20.)
+    parser.add_argument('--filter_ms', type=float, default=5.)
+    parser.add_argument('--seconds', type=float, default=5.)
+    args = parser.parse_args()
+
+    polling_latency = run('polling', args)
+    event_latency = run('event', args)
+    print("mean latency reduced by {:.1f} ms".format(polling_latency - event_latency))
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Ego pose history: the old list buffer (shifted by slice assignment on every pose once full, nearest pose by time)
+vs PoseBuffer (utils_msl_raptor/pose_buffer.py, O(1) insert, lerp / slerp between the poses around the image time).
+An ego flying a circle while yawing is sampled at the mocap rate & looked up at camera image times.
+Reports the time per pose callback & per lookup, the pose error at the image times & checks slerp against scipy,
+then PoseBuffer's cost relative to the list buffer (& as a share of a frame at the image rate).
+
+usage:  python pose_buffer_benchmark.py [--pose_hz 200] [--img_hz 30] [--seconds 10] [--buffer_len 50]
+"""
+import sys, os, time, argparse
+from bisect import bisect_left
+import numpy as np
+import numpy.linalg as la
+from scipy.spatial.transform import Rotation as R, Slerp
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils_msl_raptor.pose_buffer import PoseBuffer
+from utils_msl_raptor.quat_utils import quat_to_rotm, quat_slerp
+
+
+def ego_pose(t):
+    """ [x, y, z, qw, qx, qy, qz]: 2 m radius circle at 1 rad/s, yawing at 1 rad/s & rocking in roll """
+    rot = R.from_euler('xyz', [0.2 * np.sin(3 * t), 0., t])
+    q_xyzw = rot.as_quat()
+    return np.array([2 * np.cos(t), 2 * np.sin(t), 1.5, q_xyzw[3], q_xyzw[0], q_xyzw[1], q_xyzw[2]])
+
+
+def tf_errors(tf, pose):
+    """ position error [m] & rotation error [deg] of a 4x4 tf vs a pose """
+    rot_err = tf[0:3, 0:3].T @ quat_to_rotm(pose[3:7])[0]
+    return la.norm(tf[0:3, 3] - pose[0:3]), np.degrees(np.arccos(np.clip((np.trace(rot_err) - 1) / 2, -1, 1)))
+
+
+class ListPoseBuffer:
+    """ the previous ros_interface ego pose buffer (lists of poses & times) """
+    def __init__(self, buffer_len):
+        self.buffer = ([], [])
+        self.buffer_len = buffer_len
+
+    def push(self, my_time, pose):
+        if len(self.buffer[0]) < self.buffer_len:
+            self.buffer[0].append(pose)
+            self.buffer[1].append(my_time)
+        else:
+            self.buffer[0][0:self.buffer_len] = self.buffer[0][1:self.buffer_len]
+            self.buffer[1][0:self.buffer_len] = self.buffer[1][1:self.buffer_len]
+            self.buffer[0][-1] = pose
+            self.buffer[1][-1] = my_time
+
+    def get_tfs(self, time_to_match):
+        """ find_closest_by_time + pose_to_tf """
+        time_list, message_list = self.buffer[1], self.buffer[0]
+        pos = bisect_left(time_list, time_to_match)
+        if pos == 0:
+            pose = message_list[0]
+        elif pos == len(time_list):
+            pose = message_list[-1]
+        elif time_list[pos] - time_to_match < time_to_match - time_list[pos - 1]:
+            pose = message_list[pos]
+        else:
+            pose = message_list[pos - 1]
+        tf = np.eye(4)
+        tf[0:3, 0:3] = quat_to_rotm(pose[3:7])
+        tf[0:3, 3] = pose[0:3]
+        return tf
+
+
+def run(buf, args, pose_times, poses, img_times):
+    push_time, lookup_time, errs = 0., 0., []
+    img_idx = 0
+    for t, pose in zip(pose_times, poses):
+        tic = time.perf_counter()
+        buf.push(t, pose)
+        push_time += time.perf_counter() - tic
+        while img_idx < len(img_times) and img_times[img_idx] <= t:  # the image arrives once the next pose has
+            tic = time.perf_counter()
+            tf = buf.get_tfs(img_times[img_idx])
+            lookup_time += time.perf_counter() - tic
+            errs.append(tf_errors(tf, ego_pose(img_times[img_idx])))
+            img_idx += 1
+    errs = np.array(errs)
+    return 1e6 * push_time / len(pose_times), 1e6 * lookup_time / len(errs), errs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='list vs numpy ring buffer (w/ interpolation) for the ego pose')
+    parser.add_argument('--pose_hz', type=float, default=200.)
+    parser.add_argument('--img_hz', type=float, default=30.)
+    parser.add_argument('--seconds', type=float, default=10.)
+    parser.add_argument('--buffer_len', type=int, default=50)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    pose_times = np.arange(0, args.seconds, 1 / args.pose_hz)
+    poses = [ego_pose(t).tolist() for t in pose_times]  # (like pose_msg_to_array)
+    img_times = np.arange(0.5, args.seconds - 0.5, 1 / args.img_hz) + rng.rand() / args.pose_hz  # not synced w/ the poses
+
+    # slerp vs scipy
+    q0, q1 = R.random(1000, random_state=1), R.random(1000, random_state=2)
+    alpha = rng.rand(1000)
+    ref = np.array([Slerp([0, 1], R.concatenate([a, b]))(s).as_matrix() for a, b, s in zip(q0, q1, alpha)])
+    to_wxyz = lambda rot: rot.as_quat()[:, [3, 0, 1, 2]]
+    print("max slerp difference from scipy (rotation matrix): {:.2e}".format(
+        np.max(np.abs(quat_to_rotm(quat_slerp(to_wxyz(q0), to_wxyz(q1), alpha)) - ref))))
+
+    results = []
+    for name, buf in [('list, nearest', ListPoseBuffer(args.buffer_len)), ('PoseBuffer, interp', PoseBuffer(args.buffer_len))]:
+        push_us, lookup_us, errs = run(buf, args, pose_times, poses, img_times)
+        results.append((push_us, lookup_us, np.mean(errs[:, 0])))
+        print("{:<18s}: pose callback {:.2f} us, lookup {:.2f} us, error at image time: pos mean {:.2e} (max {:.2e}) m, "
+              "rot mean {:.2e} (max {:.2e}) deg".format(name, push_us, lookup_us, np.mean(errs[:, 0]), np.max(errs[:, 0]),
+                                                          np.mean(errs[:, 1]), np.max(errs[:, 1])))
+    (list_push, list_lookup, list_err), (push, lookup, err) = results
+    frame_us = (push - list_push) * args.pose_hz / args.img_hz + lookup - list_lookup  # (the pushes between 2 images & a lookup)
+    print("PoseBuffer vs list: pose callback {:.1f}x, lookup {:.1f}x, position error {:.0f}x smaller, extra {:.2f}% of "
+          "a {:g} Hz frame".format(push / list_push, lookup / list_lookup, list_err / err, 1e-4 * frame_us * args.img_hz, args.img_hz))
+
+    buf = PoseBuffer(args.buffer_len)
+    for t, pose in zip(pose_times[-args.buffer_len:], poses[-args.buffer_len:]):
+        buf.push(t, pose)
+    query = np.linspace(pose_times[-args.buffer_len], pose_times[-1], 30)
+    tic = time.perf_counter()
+    for _ in range(100):
+        buf.get_tfs(query)
+    print("batched lookup of {} times: {:.2f} us".format(len(query), 1e6 * (time.perf_counter() - tic) / 100))
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Checks the numpy quaternion kernels (utils_msl_raptor/quat_utils.py) against the scipy Rotation based
+versions they replaced, on random quaternions & edge cases (tiny angles, angles near pi, negative scalars,
+gimbal lock), and times both.
+
+usage:  python quat_parity.py [--n 1000] [--tol 1e-12]
+"""
+import sys, os, time, argparse, warnings
+import numpy as np
+import numpy.linalg as la
+from scipy.spatial.transform import Rotation as R
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils_msl_raptor import quat_utils as qu
+
+
+####### previous (scipy Rotation based) versions #######
+def ref_enforce_quat_format(quat):
+    quat = quat.reshape(-1,4)
+    unit_quat = quat / la.norm(quat,axis=1).reshape(-1,1)
+    s = np.sign(unit_quat[:,0])
+    s = ( s== 0) * 1 + s
+    unit_quat *= s.reshape(-1,1)
+    return unit_quat
+
+
+def ref_axang_to_quat(axang):
+    axang = axang.reshape(-1,3)
+    return ref_enforce_quat_format(np.roll(R.from_rotvec(axang).as_quat(),1,axis=1))
+
+
+def ref_quat_to_axang(quat):
+    return R.from_quat(np.roll(quat,3,axis=1)).as_rotvec()
+
+
+def ref_quat_inv(q):
+    q_inv = np.array(q, copy=True)
+    if q_inv[0] > 0:
+        q_inv[1:4] *= -1
+    else:
+        q_inv[0] *= -1
+    return q_inv
+
+
+def ref_quat_mul(q, r):
+    q = q.reshape(-1,4)
+    r = r.reshape(-1,4)
+    vec = np.array([np.multiply(q[:,0],r[:,1]),np.multiply(q[:,0],r[:,2]),np.multiply(q[:,0],r[:,3])]).T + np.array([np.multiply(r[:,0],q[:,1]),np.multiply(r[:,0],q[:,2]),np.multiply(r[:,0],q[:,3])]).T + np.array([np.multiply(q[:,2],r[:,3])-np.multiply(q[:,3],r[:,2]),np.multiply(q[:,3],r[:,1])-np.multiply(q[:,1],r[:,3]),np.multiply(q[:,1],r[:,2])-np.multiply(q[:,2],r[:,1])] ).T
+    scalar = (np.multiply(q[:,0] ,r[:,0]) - np.sum(np.multiply(q[:,1:],r[:,1:]),axis=1)).reshape(-1,1)
+    return ref_enforce_quat_format(np.concatenate((scalar,vec),axis=1))
+
+
+def ref_quat_to_ang(q, b_to_degrees=False):
+    unit_multiplier = 180 / np.pi if b_to_degrees else 1
+    return R.from_quat(np.roll(q,3,axis=1)).as_euler('XYZ') * unit_multiplier
+
+
+def ref_ang_to_quat(angs):
+    return np.roll(R.from_euler('XYZ',angs).as_quat(),1,axis=1)
+
+
+def ref_quat_to_rotm(quat):
+    return R.from_quat(np.roll(np.reshape(quat, (-1, 4)),3,axis=1)).as_matrix()
+
+
+def ref_rotm_to_quat(rotm):
+    return np.roll(R.from_matrix(rotm).as_quat(), 1, axis=-1)
+
+
+####### test inputs #######
+def make_quats(n, rng):
+    q = rng.randn(n, 4)
+    q *= rng.choice([0.5, 1., 2.], size=(n, 1))  # not all unit length
+    axes = rng.randn(6, 3)
+    axes /= la.norm(axes, axis=1)[:, None]
+    angs = np.array([0., 1e-9, 1e-5, 1e-3, np.pi - 1e-6, np.pi])
+    edge = np.hstack((np.cos(angs / 2)[:, None], np.sin(angs / 2)[:, None] * axes))
+    edge = np.vstack((edge, -edge, np.eye(4), -np.eye(4)))
+    return np.vstack((q, edge))
+
+
+def make_angs(n, rng):
+    angs = rng.uniform(-np.pi, np.pi, size=(n, 3))
+    angs[:, 1] /= 2  # middle angle in [-pi/2, pi/2]
+    lock = rng.uniform(-np.pi, np.pi, size=(4, 3))
+    lock[:, 1] = [np.pi/2, -np.pi/2, np.pi/2 - 1e-4, -np.pi/2 + 1e-4]
+    return np.vstack((angs, lock))
+
+
+def compare(name, new, ref, tol, errs):
+    err = np.max(np.abs(np.asarray(new) - np.asarray(ref)))
+    errs[name] = err
+    print("{:<22s} max abs difference = {:.2e} {}".format(name, err, '' if err <= tol else '  <-- FAILED'))
+
+
+def time_fn(fn, *args, reps=20):
+    fn(*args)
+    tic = time.perf_counter()
+    for _ in range(reps):
+        fn(*args)
+    return (time.perf_counter() - tic) / reps
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='numpy quaternion kernels vs scipy Rotation')
+    parser.add_argument('--n', type=int, default=1000)
+    parser.add_argument('--tol', type=float, default=1e-12)
+    args = parser.parse_args()
+    rng = np.random.RandomState(0)
+    q = make_quats(args.n, rng)
+    r = make_quats(args.n, rng)
+    axang = rng.randn(q.shape[0], 3) * rng.choice([1e-10, 1e-4, 1., 3.], size=(q.shape[0], 1))
+    angs = make_angs(args.n, rng)
+    rotm = ref_quat_to_rotm(q)
+    unit_q = ref_enforce_quat_format(q)
+    errs = {}
+
+    compare('enforce_quat_format', qu.enforce_quat_format(q), ref_enforce_quat_format(q), args.tol, errs)
+    compare('quat_mul', qu.quat_mul(q, r), ref_quat_mul(q, r), args.tol, errs)
+    compare('quat_inv', qu.quat_inv(q), np.array([ref_quat_inv(qi) for qi in q]), args.tol, errs)
+    compare('quat_inv (single)', qu.quat_inv(q[1]), ref_quat_inv(q[1]), args.tol, errs)
+    compare('axang_to_quat', qu.axang_to_quat(axang), ref_axang_to_quat(axang), args.tol, errs)
+    compare('quat_to_axang', qu.quat_to_axang(q), ref_quat_to_axang(q), args.tol, errs)
+    compare('quat_to_rotm', qu.quat_to_rotm(q), rotm, args.tol, errs)
+    compare('rotm_to_quat', qu.rotm_to_quat(rotm), ref_rotm_to_quat(rotm), args.tol, errs)
+    compare('rotm_to_quat (single)', qu.rotm_to_quat(rotm[1]), ref_rotm_to_quat(rotm[1]), args.tol, errs)
+    compare('ang_to_quat', qu.ang_to_quat(angs), ref_ang_to_quat(angs), args.tol, errs)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')  # scipy warns about the gimbal lock cases
+        ref_angs = ref_quat_to_ang(unit_q, b_to_degrees=True)
+    # at gimbal lock only the sum / difference of the 1st & 3rd angles is defined, so compare the rotations
+    compare('quat_to_ang', qu.quat_to_rotm(qu.ang_to_quat(np.radians(qu.quat_to_ang(unit_q, b_to_degrees=True)))),
+            ref_quat_to_rotm(ref_ang_to_quat(np.radians(ref_angs))), args.tol, errs)
+    # away from gimbal lock compare the angles directly (wrapped, since +/-pi are the same angle)
+    b_free = np.abs(rotm[:, 0, 2]) < 1 - 1e-6
+    ang_diff = qu.quat_to_ang(q[b_free]) - ref_quat_to_ang(q[b_free])
+    compare('quat_to_ang (no lock)', np.angle(np.exp(1j * ang_diff)), 0, args.tol, errs)
+
+    # out= buffers give the same answer
+    buf = np.empty((q.shape[0], 4))
+    qu.quat_mul(q, r, out=buf)
+    compare('quat_mul (out=)', buf, ref_quat_mul(q, r), args.tol, errs)
+
+    print("\ntimes for {} quaternions [ms]:   numpy / scipy".format(q.shape[0]))
+    for name, new, ref, fn_args in [('quat_mul', qu.quat_mul, ref_quat_mul, (q, r)),
+                                    ('axang_to_quat', qu.axang_to_quat, ref_axang_to_quat, (axang,)),
+                                    ('quat_to_axang', qu.quat_to_axang, ref_quat_to_axang, (q,)),
+                                    ('quat_to_rotm', qu.quat_to_rotm, ref_quat_to_rotm, (q,)),
+                                    ('rotm_to_quat', qu.rotm_to_quat, ref_rotm_to_quat, (rotm,))]:
+        print("{:<22s} {:8.4f} / {:8.4f}".format(name, 1000 * time_fn(new, *fn_args), 1000 * time_fn(ref, *fn_args)))
+    print("single quat_mul [us]:  {:.2f} / {:.2f}".format(1e6 * time_fn(qu.quat_mul, q[0], r[0], reps=2000),
+                                                        1e6 * time_fn(ref_quat_mul, q[0], r[0], reps=2000)))
+
+    tol_fail = [k for k, v in errs.items() if v > args.tol]
+    if tol_fail:
+        print("FAILED: {}".format(tol_fail))
+        sys.exit(1)
+    print("PASSED")
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+SiamMask tracking time per image for a growing number of objects: one siamese_track per object (track) vs one
+batched forward pass for all of them (track_batch), & the largest difference between their outputs.
+Needs the SiamMask submodule & weights (run in the docker image, see docker/*/pose_estimation/Dockerfile).
+
+usage:  python siammask_batch_benchmark.py [--max_objs 6] [--frames 30]
+"""
+import sys, os, time, argparse
+import numpy as np
+import cv2
+FRONT_END_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'front_end')
+sys.path.append(FRONT_END_DIR)
+from tracker import SiammaskTracker
+
+
+def make_scene(num_objs, rng, im_width=640, im_height=480):
+    """ textured background w/ num_objs distinct boxes, returns the image & the boxes (x, y, w, h) """
+    im = cv2.GaussianBlur(rng.randint(0, 256, (im_height, im_width, 3)).astype(np.uint8), (9, 9), 0)
+    boxes = []
+    for i in range(num_objs):
+        w, h = rng.randint(40, 90, 2)
+        x = 20 + (i % 3) * 200 + rng.randint(0, 60)
+        y = 40 + (i // 3) * 220 + rng.randint(0, 60)
+        cv2.rectangle(im, (x, y), (x + w, y + h), tuple(int(c) for c in rng.randint(0, 256, 3)), -1)
+        cv2.circle(im, (x + w // 2, y + h // 2), min(w, h) // 4, tuple(int(c) for c in rng.randint(0, 256, 3)), -1)
+        boxes.append((x, y, w, h))
+    return im, boxes
+
+
+def run(tracker, frames, obj_states, b_batch):
+    step_times = []
+    for im in frames:
+        tic = time.perf_counter()
+        if b_batch:
+            outputs = tracker.track_batch(im, obj_states)
+        else:
+            outputs = [tracker.track(im, obj_state) for obj_state in obj_states]
+        step_times.append(time.perf_counter() - tic)
+        obj_states = [out[0] for out in outputs]
+    return outputs, 1000 * np.median(step_times)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='per object vs batched SiamMask tracking')
+    parser.add_argument('--max_objs', type=int, default=6)
+    parser.add_argument('--frames', type=int, default=30)
+    parser.add_argument('--use_trt', action='store_true')
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    im, boxes = make_scene(args.max_objs, rng)
+    tracker = SiammaskTracker(im, base_dir=FRONT_END_DIR + '/', use_tensorrt=args.use_trt)
+    # objects drift a few pixels per frame
+    frames = [np.roll(im, (k, 2 * k), axis=(0, 1)) for k in range(args.frames)]
+
+    for num_objs in range(1, args.max_objs + 1):
+        init_states = [tracker.reinit(np.array(box), im) for box in boxes[:num_objs]]
+        serial_out, serial_ms = run(tracker, frames, init_states, False)
+        batch_out, batch_ms = run(tracker, frames, init_states, True)
+        pos_diff = max(np.max(np.abs(s[0]['target_pos'] - b[0]['target_pos'])) for s, b in zip(serial_out, batch_out))
+        poly_diff = max(np.max(np.abs(s[1] - b[1])) for s, b in zip(serial_out, batch_out))
+        print("{} object(s): per object {:.1f} ms, batched {:.1f} ms per image. Max difference after {} images: "
+              "position {:.2e} pix, polygon {:.2e} pix".format(num_objs, serial_ms, batch_ms, args.frames, pos_diff, poly_diff))
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Compares the square-root UKF (SRUKF) against the standard UKF on the same recorded inputs
+(measurements, ego poses & timestamps), checking the two estimates agree and timing each step.
+
+usage:  python sr_ukf_comparison.py [--class mslquad] [--steps 300] [--inputs rec.npz] [--save rec.npz]
+If no recording is given one is made by simulating an object and projecting it into the camera.
+"""
+import sys, os, time, argparse
+import yaml
+import numpy as np
+import numpy.linalg as la
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from ukf import UKF, SRUKF
+from utils_msl_raptor.ukf_utils import psd_sqrt, enforce_pos_def_sym_mat
+from utils_msl_raptor.math_utils import axang_to_quat, quat_mul, enforce_quat_format
+
+PARAMS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'params', 'category_params')
+
+
+class bench_camera:
+    """ minimal pinhole camera with the same interface the UKF uses (no distortion) """
+    def __init__(self):
+        self.K = np.array([[617.2744, 0., 324.1011], [0., 617.3357, 241.5791], [0., 0., 1.]])
+        self.new_camera_matrix = self.K
+        self.new_camera_matrix_inv = la.inv(self.K)
+        self.tf_cam_ego = np.eye(4)
+        self.tf_cam_ego[0:3, 0:3] = np.array([[0., -1., 0.], [0., 0., -1.], [1., 0., 0.]])  # x forward on the ego is z in the camera
+
+    def pnt3d_to_pix(self, pnt_c):
+        return self.pnts3d_to_pix(np.asarray(pnt_c))
+
+    def pnts3d_to_pix(self, pnts_c):
+        rc = pnts_c[..., 0:3] @ self.new_camera_matrix.T
+        return rc[..., 1::-1] / rc[..., 2:3]
+
+
+def box_verts(l, w, h):
+    l, w, h = l/2, w/2, h/2
+    return np.array([[l, w, h, 1.], [l, w, -h, 1.], [l, -w, -h, 1.], [l, -w, h, 1.],
+                     [-l, -w, h, 1.], [-l, -w, -h, 1.], [-l, w, -h, 1.], [-l, w, h, 1.]])
+
+
+def make_filter(ukf_class, class_str, mu0, init_time):
+    with open(os.path.join(PARAMS_DIR, class_str + '_ukf_params.yaml')) as stream:
+        ukf_prms = yaml.safe_load(stream)
+    ukf = ukf_class(camera=bench_camera(), bb_3d=box_verts(0.3, 0.3, 0.15), obj_width=0.3, obj_height=0.15,
+                    ukf_prms=ukf_prms, init_time=init_time, class_str=class_str)
+    ukf.init_filter_elements(mu0)
+    return ukf
+
+
+def record_inputs(class_str, num_steps, seed=0):
+    """ simulate an object drifting in front of a static ego & record noisy angled bb measurements of it """
+    rng = np.random.RandomState(seed)
+    truth = np.zeros(13)
+    truth[0:3] = [3., 0., 0.]
+    truth[3:6] = [0., 0.1, 0.05]
+    truth[6:10] = [1., 0., 0., 0.]
+    truth[10:13] = [0., 0., 0.3]
+    ukf = make_filter(UKF, class_str, truth, 0.)
+    times, meas = [], []
+    t = 0.
+    for _ in range(num_steps):
+        dt = 0.033 + 0.005 * rng.rand()
+        t += dt
+        truth[0:3] += dt * truth[3:6]
+        truth[6:10] = enforce_quat_format(quat_mul(axang_to_quat(dt * truth[10:13]), truth[6:10]))
+        times.append(t)
+        meas.append(ukf.predict_measurement(truth, np.eye(4)) + rng.randn(5) * [1., 1., 1., 1., 0.01])
+    mu0 = np.copy(truth)
+    mu0[0:3] = [3., 0., 0.]
+    mu0[6:10] = [1., 0., 0., 0.]
+    return {'class_str': class_str, 'mu0': mu0, 'times': np.array(times), 'meas': np.array(meas),
+            'tf_ego_w': np.tile(np.eye(4), (num_steps, 1, 1))}
+
+
+def sync_sr_ukf(sr_ukf, ukf):
+    """ copy the state of a UKF into a SRUKF (so one step of each can be compared from the same starting point) """
+    sr_ukf.mu = np.copy(ukf.mu)
+    sr_ukf.sigma = np.copy(ukf.sigma)
+    sr_ukf.sigma_sqrt = la.cholesky(enforce_pos_def_sym_mat(ukf.sigma))
+    sr_ukf.Q, sr_ukf.Q_sqrt = np.copy(ukf.Q), psd_sqrt(ukf.Q)
+    sr_ukf.R, sr_ukf.R_sqrt = np.copy(ukf.R), psd_sqrt(ukf.R)
+    sr_ukf.last_dt = ukf.last_dt
+    sr_ukf.itr_time_prev = ukf.itr_time_prev
+
+
+def run_lockstep(ukf, sr_ukf, rec):
+    """ step both filters from the same state every step, returns the relative mu & sigma differences per step """
+    mu_err, sigma_err = [], []
+    for t, z, tf_ego_w in zip(rec['times'], rec['meas'], rec['tf_ego_w']):
+        sync_sr_ukf(sr_ukf, ukf)
+        ukf.step_ukf(z, tf_ego_w, t)
+        sr_ukf.step_ukf(z, tf_ego_w, t)
+        mu_err.append(np.max(np.abs(ukf.mu - sr_ukf.mu)) / max(np.max(np.abs(ukf.mu)), 1))
+        sigma_err.append(np.max(np.abs(ukf.sigma - sr_ukf.sigma)) / np.max(np.abs(ukf.sigma)))
+    return np.array(mu_err), np.array(sigma_err)
+
+
+def run_filter(ukf, rec):
+    mus, sigmas, step_times = [], [], []
+    for t, z, tf_ego_w in zip(rec['times'], rec['meas'], rec['tf_ego_w']):
+        tic = time.perf_counter()
+        ukf.step_ukf(z, tf_ego_w, t)
+        step_times.append(time.perf_counter() - tic)
+        mus.append(np.copy(ukf.mu))
+        sigmas.append(np.copy(ukf.sigma))
+    return np.array(mus), np.array(sigmas), np.array(step_times)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='SRUKF vs UKF equivalence & timing')
+    parser.add_argument('--class', dest='class_str', default='mslquad')
+    parser.add_argument('--steps', type=int, default=300)
+    parser.add_argument('--inputs', default=None, help='npz recording to replay (from --save)')
+    parser.add_argument('--save', default=None, help='save the recording used to this npz file')
+    parser.add_argument('--tol', type=float, default=1e-5, help='max allowed relative difference per step')
+    args = parser.parse_args()
+
+    if args.inputs is not None:
+        rec = dict(np.load(args.inputs))
+        rec['class_str'] = str(rec['class_str'])
+    else:
+        rec = record_inputs(args.class_str, args.steps)
+    if args.save is not None:
+        np.savez(args.save, **rec)
+
+    t0 = rec['times'][0] - 0.033
+    print("{} steps of class '{}'".format(len(rec['times']), rec['class_str']))
+
+    # equivalence: one step of each filter from the same state. The filters are not compared over the whole run
+    # since the covariance is close to singular & tiny rounding differences grow over many steps
+    ukf = make_filter(UKF, rec['class_str'], rec['mu0'], t0)
+    ukf.b_sig_pnts_from_cols = True  # same sigma points as the SRUKF
+    sr_ukf = make_filter(SRUKF, rec['class_str'], rec['mu0'], t0)
+    mu_err, sigma_err = run_lockstep(ukf, sr_ukf, rec)
+    print("max relative difference per step: mu = {:.3e}, sigma = {:.3e}".format(np.max(mu_err), np.max(sigma_err)))
+
+    # timing (and how far apart the free running estimates end up)
+    ukf = make_filter(UKF, rec['class_str'], rec['mu0'], t0)
+    ukf.b_sig_pnts_from_cols = True  # same sigma points as the SRUKF
+    sr_ukf = make_filter(SRUKF, rec['class_str'], rec['mu0'], t0)
+    mu, sigma, ukf_times = run_filter(ukf, rec)
+    sr_mu, sr_sigma, sr_times = run_filter(sr_ukf, rec)
+    print("free running max position difference: {:.3e} m".format(np.max(np.abs(mu[:, 0:3] - sr_mu[:, 0:3]))))
+    print("step time [ms]: UKF = {:.3f} (median {:.3f}), SRUKF = {:.3f} (median {:.3f})".format(
+        1000 * np.mean(ukf_times), 1000 * np.median(ukf_times), 1000 * np.mean(sr_times), 1000 * np.median(sr_times)))
+    print("UKF covariance repairs: {}".format(ukf.pd_repair_counts))
+    print("SRUKF covariance repairs: {}, downdate fallbacks: {} / {}".format(sr_ukf.pd_repair_counts,
+                                                                            sr_ukf.num_downdate_fallbacks, sr_ukf.num_downdates))
+    if max(np.max(mu_err), np.max(sigma_err)) > args.tol:
+        print("FAILED: filters differ by more than {}".format(args.tol))
+        sys.exit(1)
+    print("PASSED")
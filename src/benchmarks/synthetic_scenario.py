@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Synthetic multi-object scenes for load testing the back end without the front end. Objects (w/ the 3d vertex sets
+of params/all_obs.yaml, see get_object_sizes_from_yaml) move along configurable trajectories in front of the ego's
+camera (params/quad7.yaml extrinsics) & are measured as the angled bb of their projected vertices
+(verts_to_angled_bb_batch) w/ noise, random dropouts, occlusion by nearer objects & the image edges.
+
+Each frame is what the front end would hand the back end ({obj_id: (abb, class_str, valid)}), so a scene drives
+FilterBank (UKF.step_ukf / BatchedUKF.step_ukfs) & the redetection gating (data_association.associate_ukfs) as the
+node does. Run as a script this is the back end load test: time per frame for 1 to 500 objects.
+
+usage:  python synthetic_scenario.py [--num_objs 1 10 50 100 250 500] [--frames 60] [--fps 30] [--trajectory mixed]
+            [--object_used_file objects_used.txt] [--dropout 0.05] [--b_batch_ukf 1] [--seed 0]
+"""
+import sys, os, io, time, argparse, contextlib
+from collections import namedtuple
+from types import SimpleNamespace
+import yaml
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from camera import camera, calc_tf_cam_ego
+from filter_bank import FilterBank
+from utils_msl_raptor.ros_utils import get_object_sizes_from_yaml
+from utils_msl_raptor.ukf_utils import pose_to_3d_bb_proj_batch, verts_to_angled_bb_batch
+from utils_msl_raptor.quat_utils import axang_to_quat, quat_to_rotm
+from utils_msl_raptor.data_association import associate_ukfs
+
+PARAMS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'params')
+CHI2_001 = 20.52  # (ImageSegmentor.chi2_001)
+TRAJECTORIES = ('static', 'linear', 'circle', 'mixed')
+
+# one frame of a scene. meas is the front end output for the visible objects, truth the N x 4 x 4 tf_w_ado of every
+# object & visible / occluded N bools (occluded objects are not visible, neither are dropped ones)
+Frame = namedtuple('Frame', ['time', 'tf_w_ego', 'meas', 'truth', 'visible', 'occluded'])
+
+
+def load_category_params_from(category_params_dir):
+    """ load_category_params, from a given directory """
+    params = {}
+    for f in sorted(os.listdir(category_params_dir)):
+        with open(os.path.join(category_params_dir, f)) as stream:
+            params[f.split('_')[0]] = yaml.safe_load(stream)
+    return params
+
+
+def make_camera(ego_yaml='quad7', width=640, height=480):
+    """ undistorted pinhole camera (the intrinsics of our realsense) w/ the ego's camera extrinsics """
+    with open(os.path.join(PARAMS_DIR, ego_yaml + '.yaml')) as stream:
+        ego_prms = yaml.safe_load(stream)
+    camera_info = SimpleNamespace(K=[617.2744, 0., 324.1011, 0., 617.3357, 241.5791, 0., 0., 1.], D=[], width=width, height=height)
+    return camera(camera_info, calc_tf_cam_ego(ego_prms['t_cam_ego'], ego_prms['R_cam_ego'], ego_prms['dx'], ego_prms['dy'], ego_prms['dz']))
+
+
+def load_objects(object_used_file='objects_used.txt'):
+    """ the object models (as the node loads them): category params & get_object_sizes_from_yaml's outputs """
+    category_params = load_category_params_from(os.path.join(PARAMS_DIR, 'category_params'))
+    bb_3d, obj_width, obj_height, classes_names, _, _, connected_inds = \
+        get_object_sizes_from_yaml(os.path.join(PARAMS_DIR, 'all_obs.yaml'), os.path.join(PARAMS_DIR, 'objects_used', object_used_file),
+                                   os.path.join(PARAMS_DIR, 'classes.names'), category_params)
+    return SimpleNamespace(category_params=category_params, bb_3d=bb_3d, obj_width=obj_width, obj_height=obj_height,
+                           classes=classes_names, connected_inds=connected_inds)
+
+
+class SyntheticScenario:
+    def __init__(self, num_objs, objects, cam, trajectory='mixed', seed=0, depth_range=(2., 8.), speed=0.3,
+                 noise_sigma=(2., 2., 2., 2., 0.02), dropout=0.05, occlusion_thresh=0.5, ego_velocity=(0., 0., 0.), im_width=640, im_height=480):
+        """
+        num_objs objects, classes taken in turn from objects.classes (see load_objects), placed at random in the
+        camera's view between depth_range [m] (along the ego's x axis) & moving along their trajectory:
+            static: fixed pose
+            linear: constant velocity (up to speed [m/s]) & yaw rate
+            circle: circle (radius up to 0.5 m, speed up to speed) in the horizontal plane
+            mixed:  each object gets one of the above at random
+        noise_sigma: measurement noise std dev on [cx, cy, w, h, angle] ([pix] & [rad])
+        dropout: probability of an object's measurement missing on a frame (e.g. a failed track)
+        occlusion_thresh: an object is occluded when more than this fraction of its (axis aligned) box is behind a
+            nearer object's box
+        ego_velocity: [m/s] the ego moves at this (world frame) velocity from the origin, looking along x
+        objects partly outside the im_width x im_height image are not seen
+        """
+        if trajectory not in TRAJECTORIES:
+            raise RuntimeError("trajectory {} not implemented (options: {})".format(trajectory, ', '.join(TRAJECTORIES)))
+        rng = np.random.RandomState(seed)
+        self.rng = np.random.RandomState(seed + 1)  # (measurement noise, so the trajectories don't depend on the frames made)
+        self.num_objs = num_objs
+        self.objects = objects
+        self.camera = cam
+        self.noise_sigma = np.asarray(noise_sigma, dtype=float)
+        self.dropout = dropout
+        self.occlusion_thresh = occlusion_thresh
+        self.ego_velocity = np.asarray(ego_velocity, dtype=float)
+        self.im_width = im_width
+        self.im_height = im_height
+        self.class_strs = [objects.classes[i % len(objects.classes)] for i in range(num_objs)]
+
+        # starting positions spread over the view (ego frame: x forward, y left, z up), in front of the ego at the origin
+        depth = rng.uniform(*depth_range, num_objs)
+        fov_y, fov_z = 0.8 * cam.fov_lim_per_depth  # (tan of the half fov, keep a margin to the image edges)
+        self.center = np.column_stack([depth, depth * rng.uniform(-fov_y, fov_y, num_objs), depth * rng.uniform(-fov_z, fov_z, num_objs)])
+        kinds = rng.choice(TRAJECTORIES[:3], num_objs) if trajectory == 'mixed' else np.full(num_objs, trajectory)
+        heading = rng.uniform(-np.pi, np.pi, num_objs)
+        self.velocity = np.where((kinds == 'linear')[:, None], speed * rng.uniform(0, 1, (num_objs, 1)) * np.column_stack([np.cos(heading), np.sin(heading), np.zeros(num_objs)]), 0.)
+        self.radius = np.where(kinds == 'circle', rng.uniform(0.1, 0.5, num_objs), 0.)
+        self.omega = np.where(kinds == 'circle', speed * rng.uniform(0.5, 1, num_objs) / np.maximum(self.radius, 1e-9) * rng.choice([-1, 1], num_objs), 0.)
+        self.phase = rng.uniform(-np.pi, np.pi, num_objs)
+        # (the classes whose filters keep yaw at 0 don't yaw)
+        b_yaw = np.array([not objects.category_params[c]['b_enforce_0_yaw'] for c in self.class_strs])
+        self.yaw0 = np.where(b_yaw, rng.uniform(-np.pi, np.pi, num_objs), 0.)
+        self.yaw_rate = np.where(b_yaw & (kinds != 'static'), rng.uniform(-0.5, 0.5, num_objs), 0.)
+
+
+    def ego_pose(self, t):
+        tf_w_ego = np.eye(4)
+        tf_w_ego[0:3, 3] = self.ego_velocity * t
+        return tf_w_ego
+
+
+    def object_poses(self, t):
+        """ N x 4 x 4 tf_w_ado of every object at time t """
+        ang = self.omega * t + self.phase
+        tf_w_ados = np.zeros((self.num_objs, 4, 4))
+        tf_w_ados[:, 0:3, 3] = self.center + self.velocity * t + self.radius[:, None] * np.column_stack([np.cos(ang) - np.cos(self.phase), np.sin(ang) - np.sin(self.phase), np.zeros(self.num_objs)])
+        tf_w_ados[:, 0:3, 0:3] = quat_to_rotm(axang_to_quat(np.column_stack([np.zeros((self.num_objs, 2)), self.yaw0 + self.yaw_rate * t])))
+        tf_w_ados[:, 3, 3] = 1
+        return tf_w_ados
+
+
+    def measure(self, tf_w_ados, tf_w_ego):
+        """ noise free angled bbs (N x 5), axis aligned extents (N x 4: col min, row min, col max, row max) & depths [m] """
+        abbs, extents, depths = np.zeros((self.num_objs, 5)), np.zeros((self.num_objs, 4)), np.zeros(self.num_objs)
+        tf_cam_w = self.camera.tf_cam_ego @ np.linalg.inv(tf_w_ego)
+        for class_str in self.objects.classes:
+            inds = np.array([i for i, c in enumerate(self.class_strs) if c == class_str], dtype=int)
+            if len(inds) == 0:
+                continue
+            verts_rc = pose_to_3d_bb_proj_batch(tf_w_ados[inds], tf_w_ego, self.objects.bb_3d[class_str], self.camera)
+            verts_xy = verts_rc[:, :, ::-1]
+            abbs[inds] = verts_to_angled_bb_batch(verts_xy)
+            extents[inds] = np.concatenate([np.min(verts_xy, axis=1), np.max(verts_xy, axis=1)], axis=1)
+            depths[inds] = (tf_w_ados[inds, :, 3] @ tf_cam_w.T)[:, 2]
+        return abbs, extents, depths
+
+
+    def occluded(self, extents, depths):
+        """ N bools, more than occlusion_thresh of the object's box is covered by a single nearer object's box """
+        overlap_w = np.minimum(extents[:, None, 2], extents[None, :, 2]) - np.maximum(extents[:, None, 0], extents[None, :, 0])
+        overlap_h = np.minimum(extents[:, None, 3], extents[None, :, 3]) - np.maximum(extents[:, None, 1], extents[None, :, 1])
+        overlap = np.maximum(overlap_w, 0) * np.maximum(overlap_h, 0)  # [i, j]: area of i's box also in j's
+        area = (extents[:, 2] - extents[:, 0]) * (extents[:, 3] - extents[:, 1])
+        b_nearer = depths[None, :] < depths[:, None]  # [i, j]: j is in front of i
+        return np.any(b_nearer & (overlap > self.occlusion_thresh * area[:, None]), axis=1)
+
+
+    def frame(self, t):
+        tf_w_ego = self.ego_pose(t)
+        truth = self.object_poses(t)
+        abbs, extents, depths = self.measure(truth, tf_w_ego)
+        in_view = (depths > 0.3) & np.all(extents[:, 0:2] >= 0, axis=1) & (extents[:, 2] < self.im_width) & (extents[:, 3] < self.im_height)
+        occluded = in_view & self.occluded(extents, np.where(in_view, depths, np.inf))
+        visible = in_view & ~occluded & (self.rng.uniform(size=self.num_objs) >= self.dropout)
+        abbs += self.rng.normal(size=abbs.shape) * self.noise_sigma
+        meas = {obj_id: (abbs[obj_id], self.class_strs[obj_id], True) for obj_id in np.flatnonzero(visible)}
+        return Frame(t, tf_w_ego, meas, truth, visible, occluded)
+
+
+    def frames(self, num_frames, fps=30., t0=0.):
+        for k in range(num_frames):
+            yield self.frame(t0 + k / fps)
+
+
+def gate_frame(frame, filter_bank):
+    """
+    gate (& assign) the frame's measurements against the filters of the same class, like a redetection
+    (ImageSegmentor.reinit_tracker). Returns the number of measurements gated & how many were matched to their own filter
+    """
+    num_meas, num_correct = 0, 0
+    for class_str in set(c for _, c, _ in frame.meas.values()):
+        meas_ids = [obj_id for obj_id, (_, c, _) in frame.meas.items() if c == class_str]
+        ukf_ids = [obj_id for obj_id, ukf in filter_bank.ukf_dict.items() if ukf.class_str == class_str and hasattr(ukf, 'obs_pred')]
+        if len(ukf_ids) == 0:
+            continue
+        matches, _, _ = associate_ukfs(np.array([frame.meas[obj_id][0] for obj_id in meas_ids]), [filter_bank.ukf_dict[obj_id] for obj_id in ukf_ids], CHI2_001**2)
+        num_meas += len(meas_ids)
+        num_correct += sum(meas_ids[i] == ukf_ids[j] for i, j in matches)
+    return num_meas, num_correct
+
+
+def run_backend(scenario, num_frames, fps=30., b_batch_ukf=True, b_gate=True, verbose=False):
+    """
+    step a FilterBank (& the gating) through num_frames of scenario. The first frame only initializes the filters of
+    the objects seen (as in the node). Returns the per frame back end & gating times [s] & stats
+    """
+    filter_bank = FilterBank(scenario.camera, scenario.objects.bb_3d, scenario.objects.obj_width, scenario.objects.obj_height,
+                             scenario.objects.category_params, scenario.objects.connected_inds, b_batch_ukf=b_batch_ukf)
+    step_times, gate_times = [], []
+    num_meas, num_gated, num_correct, num_occluded = 0, 0, 0, 0
+    for k, frame in enumerate(scenario.frames(num_frames, fps)):
+        num_meas += len(frame.meas)
+        num_occluded += np.sum(frame.occluded)
+        if b_gate and k > 1:  # (once filters have predicted measurements)
+            tic = time.perf_counter()
+            n, c = gate_frame(frame, filter_bank)
+            gate_times.append(time.perf_counter() - tic)
+            num_gated += n
+            num_correct += c
+        with contextlib.redirect_stdout(sys.stdout if verbose else io.StringIO()):  # (new objects are printed)
+            tic = time.perf_counter()
+            filter_bank.step(frame.meas, frame.tf_w_ego, frame.time)
+            if k > 0:
+                step_times.append(time.perf_counter() - tic)
+    pos_err = [np.linalg.norm(ukf.mu[0:3] - frame.truth[obj_id, 0:3, 3]) for obj_id, ukf in filter_bank.ukf_dict.items()]
+    return SimpleNamespace(step_times=np.array(step_times), gate_times=np.array(gate_times), meas_per_frame=num_meas / num_frames,
+                           occluded_per_frame=num_occluded / num_frames, gate_accuracy=num_correct / max(num_gated, 1),
+                           median_pos_err=np.median(pos_err) if len(pos_err) > 0 else np.nan, filter_bank=filter_bank)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='back end load test on synthetic multi-object scenes')
+    parser.add_argument('--num_objs', type=int, nargs='+', default=[1, 10, 50, 100, 250, 500])
+    parser.add_argument('--frames', type=int, default=60)
+    parser.add_argument('--fps', type=float, default=30.)
+    parser.add_argument('--trajectory', default='mixed', choices=TRAJECTORIES)
+    parser.add_argument('--object_used_file', default='objects_used.txt', help='in params/objects_used/')
+    parser.add_argument('--dropout', type=float, default=0.05)
+    parser.add_argument('--occlusion_thresh', type=float, default=0.5)
+    parser.add_argument('--b_batch_ukf', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()):  # (get_object_sizes_from_yaml prints the objects)
+        objects = load_objects(args.object_used_file)
+    cam = make_camera()
+    print("classes {}, {} frames at {} fps, {} trajectories, batched ukf = {}".format(objects.classes, args.frames, args.fps, args.trajectory, bool(args.b_batch_ukf)))
+    for num_objs in args.num_objs:
+        scenario = SyntheticScenario(num_objs, objects, cam, trajectory=args.trajectory, seed=args.seed, dropout=args.dropout, occlusion_thresh=args.occlusion_thresh)
+        res = run_backend(scenario, args.frames, args.fps, b_batch_ukf=args.b_batch_ukf)
+        print("{:>3d} objects ({:.1f} measured & {:.1f} occluded per frame): back end {:.2f} ms/frame (p95 {:.2f}, {:.3f} ms/object), "
+              "gating {:.2f} ms/frame ({:.1%} matched to their own filter), median position error {:.3f} m".format(
+              num_objs, res.meas_per_frame, res.occluded_per_frame, 1000 * np.mean(res.step_times), 1000 * np.percentile(res.step_times, 95),
+              1000 * np.mean(res.step_times) / max(res.meas_per_frame, 1), 1000 * np.mean(res.gate_times) if len(res.gate_times) else 0.,
+              res.gate_accuracy, res.median_pos_err))
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Measures the UKF methods that index the non-quaternion parts of the state & covariance w/ slices & reuse the
+filter's w_arr (calc_sigma_points_from_sqrt, calc_state_mean_and_deviations, calc_cross_correlation), against the
+same methods building the index lists from np.arange (& w_arr in calc_cross_correlation) on every call, as before.
+
+Each method is timed on the inputs it got in a real run (best of many repeats, the two versions interleaved so
+both see the same machine load) & its heap use is measured w/ tracemalloc (numpy reports its array allocations to
+it): the peak above what was allocated before the call. The whole step's latency is reported too, for context only
+(the methods are a small part of the step, so the difference there is within the run to run noise).
+PASSED needs identical filter outputs, & each method faster w/o using more heap than the index list version.
+
+usage:  python ukf_index_slices_benchmark.py [--class mslquad] [--steps 300] [--repeats 15]
+"""
+import sys, os, io, time, timeit, argparse, tracemalloc, contextlib
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from ukf import UKF
+from utils_msl_raptor.math_utils import axang_to_quat, quat_to_axang, quat_inv, quat_mul, average_quaternions
+from sr_ukf_comparison import make_filter, record_inputs
+
+METHODS = ['calc_sigma_points_from_sqrt', 'calc_state_mean_and_deviations', 'calc_cross_correlation']
+
+
+class IndexListUKF(UKF):
+    """ the UKF w/ its index lists (& w_arr) rebuilt on every call (reference for the benchmark) """
+
+    def calc_sigma_points_from_sqrt(self, mu, sigma_sqrt):
+        sps = np.zeros((self.dim_state, 2 * self.dim_sig + 1))
+        sps[:, 0] = mu
+        sig_step_p = self.sig_pnt_multiplier * sigma_sqrt
+        sig_step_m = -sig_step_p
+        sig_step_all = np.stack((sig_step_p,sig_step_m),2).reshape(self.dim_sig,-1)
+        idx_mu_not_q = list(np.arange(6)) + list(np.arange(10,13))
+        idx_sigma_not_q = list(np.arange(6)) + list(np.arange(9,12))
+
+        sps[idx_mu_not_q,1:] = mu[idx_mu_not_q].reshape(-1,1) + sig_step_all[idx_sigma_not_q,:]
+        if self.b_enforce_0_yaw:
+            sig_step_all[8, :] = 0
+        if self.b_enforce_z:
+            sig_step_all[2, :] = self.bb_3d[0,2]
+
+        q_perturb = axang_to_quat(sig_step_all[6:9, :].T)
+        quat_mul(q_perturb, mu[6:10], out=sps[6:10, 1:].T)
+        return sps
+
+    def calc_state_mean_and_deviations(self, sps):
+        mu_bar = self.w0 * sps[:, 0] + self.wi*np.sum(sps[:, 1:], 1)
+        mu_bar[6:10], ei_vec_set = average_quaternions(sps[6:10, :].T, self.w_arr)
+
+        idx_mu_not_q = list(np.arange(6)) + list(np.arange(10,13))
+        idx_sigma_not_q = list(np.arange(6)) + list(np.arange(9,12))
+
+        Wprime = np.zeros((self.dim_sig, sps.shape[1]))
+
+        Wprime[idx_sigma_not_q, :] = sps[idx_mu_not_q, :] - mu_bar[idx_mu_not_q].reshape(-1,1)
+        Wprime[6:9, :] = ei_vec_set
+        return mu_bar, Wprime
+
+    def calc_cross_correlation(self, sps, mu_bar, z_hat, pred_meas):
+        dim_covar = self.sigma.shape[0]
+        num_sps = sps.shape[1]
+
+        quat_ave_inv = quat_inv(mu_bar[6:10])
+        Wprime = np.zeros((dim_covar, num_sps))
+
+        idx_mu_not_q = list(np.arange(6)) + list(np.arange(10,13))
+        idx_sigma_not_q = list(np.arange(6)) + list(np.arange(9,12))
+
+        Wprime[idx_sigma_not_q, :]= sps[idx_mu_not_q, :] - mu_bar[idx_mu_not_q].reshape(-1,1)
+        q = sps[6:10, :]
+        q_diff = quat_mul(q.T, quat_ave_inv)
+        quat_to_axang(q_diff, out=Wprime[6:9, :].T)
+
+        w_arr = np.ones(num_sps)*self.wi
+        w_arr[0] = self.w0
+        pred_dev = np.subtract(pred_meas, z_hat[:, None], order='C')
+        sigma_xz = (w_arr * Wprime) @ pred_dev.T
+
+        return sigma_xz
+
+
+def record_method_inputs(ukf, inputs):
+    """ steps the filter & returns the arguments each of METHODS was first called w/ (after the first step) """
+    method_args = {}
+    for name in METHODS:
+        method = getattr(ukf, name)
+        def record(*args, name=name, method=method):
+            if ukf.itr > 0:
+                method_args.setdefault(name, tuple(np.copy(a) for a in args))
+            return method(*args)
+        setattr(ukf, name, record)
+    for t, z, tf_ego_w in inputs:
+        ukf.step_ukf(z, tf_ego_w, t)
+    for name in METHODS:
+        delattr(ukf, name)
+    return method_args
+
+
+def call_heap(fn):
+    """ peak heap [bytes] above what was allocated before calling fn """
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak - before
+
+
+def best_call_times(fns, num_repeats, number=200):
+    """ best time [s] per call of each fn, the fns are timed in turn so they see the same machine load """
+    best = np.full(len(fns), np.inf)
+    for _ in range(num_repeats):
+        for i, fn in enumerate(fns):
+            best[i] = min(best[i], timeit.timeit(fn, number=number) / number)
+    return best
+
+
+def step_times(ukfs, inputs):
+    """ per step latency [s] of each filter, the filters are stepped in turn on the same inputs """
+    times = np.zeros((len(ukfs), len(inputs)))
+    for n, (t, z, tf_ego_w) in enumerate(inputs):
+        for i, ukf in enumerate(ukfs):
+            tic = time.perf_counter()
+            ukf.step_ukf(z, tf_ego_w, t)
+            times[i, n] = time.perf_counter() - tic
+    return times
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='UKF index slices vs index lists, latency & heap use')
+    parser.add_argument('--class', dest='class_str', default='mslquad')
+    parser.add_argument('--steps', type=int, default=300)
+    parser.add_argument('--repeats', type=int, default=15, help='timing repeats per method (the best is kept)')
+    args = parser.parse_args()
+
+    rec = record_inputs(args.class_str, args.steps)
+    inputs = list(zip(rec['times'], rec['meas'], rec['tf_ego_w']))
+    t0 = rec['times'][0] - 0.033
+    names = ['index lists', 'slices']
+    ukfs = [make_filter(ukf_class, args.class_str, rec['mu0'], t0) for ukf_class in [IndexListUKF, UKF]]
+
+    with contextlib.redirect_stdout(io.StringIO()):  # (the filters' verbose prints)
+        method_args = record_method_inputs(make_filter(UKF, args.class_str, rec['mu0'], t0), inputs[:10])
+        times = step_times(ukfs, inputs)
+
+    b_failed = False
+    print("per call, best of {} repeats [us] | peak heap [kB]:".format(args.repeats))
+    for name in METHODS:
+        fns = [lambda ukf=ukf: getattr(ukf, name)(*method_args[name]) for ukf in ukfs]
+        best = best_call_times(fns, args.repeats)
+        heap = [call_heap(fn) for fn in fns]
+        b_slower = best[1] >= best[0] or heap[1] > heap[0]
+        b_failed |= b_slower
+        print("  {:32s} {:7.1f} -> {:7.1f} | {:5.1f} -> {:5.1f}{}".format(name, 1e6 * best[0], 1e6 * best[1],
+              heap[0] / 1e3, heap[1] / 1e3, '  <-- not better' if b_slower else ''))
+
+    num_warmup = 10
+    print("whole step, median [ms] (for context, not checked):")
+    for name, t in zip(names, times):
+        print("  {:12s} {:.3f}".format(name, 1000 * np.median(t[num_warmup:])))
+
+    diff = max(np.max(np.abs(ukfs[0].mu - ukfs[1].mu)), np.max(np.abs(ukfs[0].sigma - ukfs[1].sigma)))
+    print("max difference in the final estimate: {:.3e}".format(diff))
+    if diff > 0:
+        print("FAILED: the slices changed the filter output")
+        sys.exit(1)
+    if b_failed:
+        print("FAILED: the slices are not faster (or use more heap) than the index lists")
+        sys.exit(1)
+    print("PASSED")
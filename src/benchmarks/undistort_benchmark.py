@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Time per image of cv2.undistort (recomputes the distortion map every call) vs the camera class's precomputed
+fixed point remap tables (utils_msl_raptor/image_utils.py), for the whole image & for only the regions around
+tracked objects (b_undistort_crops_only).
+Also checks the remapped image matches cv2.undistort.
+
+usage:  python undistort_benchmark.py [--num_objs 2] [--box_size 60] [--itrs 200]
+"""
+import sys, os, time, argparse
+import numpy as np
+import cv2
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils_msl_raptor.image_utils import init_undistort_maps, undistort_image, clip_roi
+
+# intrinsics & distortion from the camera calibration test (viz_tools/camera_cal_test.py)
+K = np.array([[483.50426183, 0., 318.29104565], [0., 483.89448247, 248.02496288], [0., 0., 1.]])
+DIST_COEFS = np.array([-0.40031982, 0.14257124, 0.00020686, 0.00030526, 0.])
+
+
+def time_per_call(fn, itrs):
+    fn()  # warm up
+    tic = time.perf_counter()
+    for _ in range(itrs):
+        fn()
+    return 1000 * (time.perf_counter() - tic) / itrs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='cv2.undistort vs precomputed remap tables')
+    parser.add_argument('--num_objs', type=int, default=2, help='number of tracked objects (crop regions)')
+    parser.add_argument('--box_size', type=float, default=60., help='side of each tracked object\'s box [pix]')
+    parser.add_argument('--itrs', type=int, default=200)
+    args = parser.parse_args()
+
+    im_width, im_height = 640, 480
+    new_camera_matrix, _ = cv2.getOptimalNewCameraMatrix(K, DIST_COEFS, (im_width, im_height), 0, (im_width, im_height))
+    maps = init_undistort_maps(K, DIST_COEFS, new_camera_matrix, im_width, im_height)
+    rng = np.random.RandomState(0)
+    image = cv2.GaussianBlur(rng.randint(0, 256, (im_height, im_width, 3)).astype(np.uint8), (5, 5), 0)
+
+    # same regions the tracker would read: the search window around each object + the front end's margin
+    half_size = np.sqrt(4 * args.box_size**2) * 255 / 127 / 2 + 20 + 1
+    centers = rng.rand(args.num_objs, 2) * [im_height, im_width]
+    rois = [(r - half_size, r + half_size, c - half_size, c + half_size) for r, c in centers]
+
+    ref = cv2.undistort(image, K, DIST_COEFS, None, new_camera_matrix)
+    full = undistort_image(image, maps)
+    crop = undistort_image(image, maps, rois)
+    crop_err = 0
+    for roi in rois:
+        r0, r1, c0, c1 = clip_roi(roi, im_width, im_height)
+        crop_err = max(crop_err, np.max(np.abs(crop[r0:r1, c0:c1].astype(int) - ref[r0:r1, c0:c1]), initial=0))
+    print("max pixel difference from cv2.undistort: full remap = {}, crop remap = {}".format(np.max(np.abs(full.astype(int) - ref)), crop_err))
+
+    t_undistort = time_per_call(lambda: cv2.undistort(image, K, DIST_COEFS, None, new_camera_matrix), args.itrs)
+    t_full = time_per_call(lambda: undistort_image(image, maps), args.itrs)
+    t_crop = time_per_call(lambda: undistort_image(image, maps, rois), args.itrs)
+    print("time per {}x{} image [ms]: cv2.undistort = {:.3f}, remap tables = {:.3f}, {} crop(s) of ~{:.0f} pix = {:.3f}".format(
+        im_width, im_height, t_undistort, t_full, args.num_objs, 2 * half_size, t_crop))
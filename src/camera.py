@@ -0,0 +1,116 @@
+####### CAMERA MODEL #######
+# IMPORTS
+# math
+import numpy as np
+import numpy.linalg as la
+import cv2
+# libs & utils
+from utils_msl_raptor.image_utils import init_undistort_maps, undistort_image
+
+
+def calc_tf_cam_ego(t_cam_ego, R_cam_ego, dx, dy, dz):
+    """ camera pose relative to the ego quad from its calibration & the manual correction angles (see params/quad7.yaml) """
+    tf_cam_ego = np.eye(4)
+    tf_cam_ego[0:3, 3] = np.asarray(t_cam_ego)
+    tf_cam_ego[0:3, 0:3] = np.reshape(R_cam_ego, (3, 3))
+    Angle_x = float(dx)
+    Angle_y = float(dy)
+    Angle_z = float(dz)
+    R_deltax = np.array([[ 1.             , 0.             , 0.              ],
+                            [ 0.             , np.cos(Angle_x),-np.sin(Angle_x) ],
+                            [ 0.             , np.sin(Angle_x), np.cos(Angle_x) ]])
+    R_deltay = np.array([[ np.cos(Angle_y), 0.             , np.sin(Angle_y) ],
+                            [ 0.             , 1.             , 0               ],
+                            [-np.sin(Angle_y), 0.             , np.cos(Angle_y) ]])
+    R_deltaz = np.array([[ np.cos(Angle_z),-np.sin(Angle_z), 0.              ],
+                            [ np.sin(Angle_z), np.cos(Angle_z), 0.              ],
+                            [ 0.             , 0.             , 1.              ]])
+    R_delta = R_deltax @ R_deltay @ R_deltaz
+    tf_cam_ego[0:3, 0:3] = np.matmul(R_delta, tf_cam_ego[0:3, 0:3])
+    return tf_cam_ego
+
+
+class camera:
+    def __init__(self, camera_info, tf_cam_ego):
+        """
+        camera_info: the camera info message (or anything w/ its K, D, width & height fields)
+        K: camera intrinsic matrix 
+        tf_cam_ego: camera pose relative to the ego_quad (fixed), see calc_tf_cam_ego
+        fov_horz/fov_vert: Angular field of view (IN RADIANS) for horizontal and vertical directions
+        fov_lim_per_depth: how the boundary of the fov (width, heigh) changes per depth
+        """
+        self.K = np.reshape(camera_info.K, (3, 3))
+        if len(camera_info.D) == 5:
+            self.dist_coefs = np.reshape(camera_info.D, (5,))
+            self.new_camera_matrix, _ = cv2.getOptimalNewCameraMatrix(self.K, self.dist_coefs, (camera_info.width, camera_info.height), 0, (camera_info.width, camera_info.height))
+            # undistortion lookup tables (fixed point), built once instead of by cv2.undistort on every image
+            self.undistort_maps = init_undistort_maps(self.K, self.dist_coefs, self.new_camera_matrix, camera_info.width, camera_info.height)
+        else:
+            self.dist_coefs = None
+            self.new_camera_matrix = self.K
+            self.undistort_maps = None
+
+        self.K_inv = la.inv(self.K)
+        self.new_camera_matrix_inv = la.inv(self.new_camera_matrix)
+        self.tf_cam_ego = tf_cam_ego
+        (self.fov_horz, self.fov_vert), self.fov_lim_per_depth = self.calc_fov()
+
+    def undistort(self, image, rois=None):
+        """
+        undistort the fisheye effect in the image (same result as cv2.undistort w/ the new camera matrix).
+        rois: optional list of (row_min, row_max, col_min, col_max) regions, if given only these are undistorted
+            and the rest of the returned image is left distorted
+        """
+        if self.undistort_maps is None:
+            return image
+        return undistort_image(image, self.undistort_maps, rois)
+
+    def b_is_pnt_in_fov(self, pnt_c, buffer=0):
+        """ 
+        - Use similar triangles to see if point (in camera frame!) is beyond limit of fov 
+        - buffer: an optional buffer region where if you are inside the fov by less than 
+            this the function returns false
+        """
+        if pnt_c[2] <= 0:
+            raise RuntimeError("Point is at or behind camera!")
+            return False
+        fov_lims = pnt_c[2] * self.fov_lim_per_depth - buffer
+        return np.all( np.abs(pnt_c[0:2]) < fov_lims )
+
+    def calc_fov(self):
+        """
+        - Find top, left point 1 meter along z axis in cam frame. the x and y values are 
+        half the width and height. Note: [x_tl, y_tl, 1 (= z_tl)] = inv(K) @ [0, 0, 1], 
+        which is just the first tow rows of the third col of inv(K).
+        - With these x and y, just use geometry (knowing z dist is 1) to get the angle 
+        spanning the x and y axis respectively.
+        - keeping the width and heigh of the point at 1m depth is useful for similar triangles
+        """
+        fov_lim_per_depth = -la.inv( self.new_camera_matrix )[0:2, 2] 
+        return 2 * np.arctan( fov_lim_per_depth ), fov_lim_per_depth
+
+    def pix_to_pnt3d(self, row, col):
+        """
+        input: assumes rc is [row, col]
+        output: pnt_c = [x, y, z] in camera frame
+        """
+        raise RuntimeError("FUNCTION NOT YET IMPLEMENTED")
+        return pnt_c
+
+    def pnt3d_to_pix(self, pnt_c):
+        """
+        input: assumes pnt in camera frame
+        output: [row, col] i.e. the projection of xyz onto camera plane
+        """
+        rc = self.new_camera_matrix @ np.reshape(pnt_c[0:3], 3, 1)
+        rc = np.array([rc[1], rc[0]]) / rc[2]
+        return rc
+
+    def pnts3d_to_pix(self, pnts_c):
+        """
+        vectorized version of pnt3d_to_pix
+        input: assumes pnts in camera frame, shape (..., 3) or (..., 4)
+        output: (..., 2) array of [row, col] i.e. the projections of xyz onto camera plane
+        """
+        rc = pnts_c[..., 0:3] @ self.new_camera_matrix.T
+        return rc[..., 1::-1] / rc[..., 2:3]
@@ -0,0 +1,103 @@
+####### FILTER BANK (BACK END) #######
+# One ukf per object the front end reports. Shared by the ros node (msl_raptor_main.py) & the offline replay (replay.py)
+# IMPORTS
+# math
+import numpy as np
+# custom modules
+from ukf import UKF, SRUKF, BatchedUKF
+# libs & utils
+from utils_msl_raptor.math_utils import inv_tf, quat_to_rotm
+from utils_msl_raptor.ukf_utils import state_to_tf, pose_to_3d_bb_proj
+from utils_msl_raptor.instrumentation import instruments
+
+
+class FilterBank:
+    def __init__(self, camera, bb_3d, obj_width, obj_height, category_params, connected_inds, b_batch_ukf=True, b_pub_3d_bb_proj=False,
+                 b_use_gt_pose_init=False, b_publish_gt_3d_projections=False, get_closest_gt_pose=None, verbose=False):
+        """
+        A ukf is made (& initialized from the object's box) the first time an object is reported & stepped w/ its
+        measurement on every image after.
+        get_closest_gt_pose: fn(class_str, position) -> ground truth pose [x,y,z,qw,qx,qy,qz] of the closest object of
+            that class, only needed w/ b_use_gt_pose_init or b_publish_gt_3d_projections
+        """
+        self.ukf_dict = {}  # key: object_id value: ukf object
+        self.batched_ukf = BatchedUKF(verbose=verbose)
+        self.camera = camera
+        self.bb_3d = bb_3d
+        self.obj_width = obj_width
+        self.obj_height = obj_height
+        self.category_params = category_params
+        self.connected_inds = connected_inds
+        self.b_batch_ukf = b_batch_ukf  # step all the ukfs together in one vectorized call (still linear in the number of objects, see BatchedUKF)
+        self.b_pub_3d_bb_proj = b_pub_3d_bb_proj
+        self.b_use_gt_pose_init = b_use_gt_pose_init
+        self.b_publish_gt_3d_projections = b_publish_gt_3d_projections
+        self.get_closest_gt_pose = get_closest_gt_pose
+        self.verbose = verbose
+
+
+    def step(self, processed_image, tf_w_ego, loop_time, tf_w_ego_gt=None):
+        """
+        processed_image: the front end output for the image at loop_time, {obj_id: (abb, class_str, valid)}
+        Returns the ids of the objects whose ukf was stepped (new objects only get their ukf initialized)
+        """
+        tf_ego_w = inv_tf(tf_w_ego)  # ego quad pose
+
+        # handle each object seen
+        obj_ids_tracked = []
+        for obj_id, (abb, class_str, valid) in processed_image.items():
+            if not obj_id in self.ukf_dict:  # New Object
+                print("new object (id = {}, type = {})".format(obj_id, class_str))
+                instruments.count('new_objects')
+                ukf_class = SRUKF if self.category_params[class_str].get('b_sqrt_ukf', False) else UKF
+                self.ukf_dict[obj_id] = ukf_class(camera=self.camera, bb_3d=self.bb_3d[class_str], obj_width=self.obj_width[class_str],obj_height=self.obj_height[class_str], ukf_prms=self.category_params[class_str], init_time=loop_time, class_str=class_str, obj_id=obj_id,verbose=self.verbose)
+                if self.b_use_gt_pose_init:
+                    approx_position,_ = self.ukf_dict[obj_id].approx_pose_from_bb(abb, tf_w_ego)
+                    gt_pose = self.get_closest_gt_pose(class_str,approx_position)
+                    self.ukf_dict[obj_id].reinit_filter_from_gt(gt_pose)
+                    # Avoid reusing GT to initialize pose TODO Currently limits gt to first object
+                    self.b_use_gt_pose_init = False
+                else:
+                    self.ukf_dict[obj_id].reinit_filter_approx(abb, tf_w_ego)
+                continue
+
+            obj_ids_tracked.append(obj_id)
+
+        # update ukfs
+        obj_ids_to_step = [obj_id for obj_id in obj_ids_tracked if self.ukf_dict[obj_id] is not None]
+        with instruments.span('ukf'):
+            if self.b_batch_ukf:
+                # square-root filters carry a different state, so they are always stepped on their own
+                obj_ids_to_batch = [obj_id for obj_id in obj_ids_to_step if not isinstance(self.ukf_dict[obj_id], SRUKF)]
+                if len(obj_ids_to_batch) < 2:
+                    obj_ids_to_batch = []  # (batching only pays off w/ several objects)
+                self.batched_ukf.step_ukfs([self.ukf_dict[obj_id] for obj_id in obj_ids_to_batch], [processed_image[obj_id][0] for obj_id in obj_ids_to_batch], tf_ego_w, loop_time)
+            else:
+                obj_ids_to_batch = []
+            for obj_id in obj_ids_to_step:
+                if obj_id not in obj_ids_to_batch:
+                    self.ukf_dict[obj_id].step_ukf(processed_image[obj_id][0], tf_ego_w, loop_time)
+        instruments.count('ukf_steps', len(obj_ids_to_step))
+
+        if self.b_pub_3d_bb_proj:
+            with instruments.span('3d_bb_proj'):
+                for obj_id in obj_ids_to_step:
+                    self.update_3d_bb_proj(self.ukf_dict[obj_id], tf_w_ego, tf_w_ego_gt)
+        return obj_ids_tracked
+
+
+    def update_3d_bb_proj(self, ukf, tf_w_ego, tf_w_ego_gt):
+        """ projection of the estimated (& optionally the ground truth) 3d bounding box into the image, for publishing """
+        class_str = ukf.class_str
+        tf_w_ado = state_to_tf(ukf.mu)
+        if self.b_publish_gt_3d_projections: # concatenate the gt projection
+            tf_w_ado_gt_array = self.get_closest_gt_pose(class_str, ukf.mu[0:3])
+            tf_w_ado_gt = np.eye(4)
+            tf_w_ado_gt[0:3, 3] = tf_w_ado_gt_array[0:3]
+            tf_w_ado_gt[0:3, 0:3] = quat_to_rotm(tf_w_ado_gt_array[3:7])
+            ukf.projected_3d_bb = np.vstack( (np.fliplr(pose_to_3d_bb_proj(tf_w_ado, tf_w_ego, ukf.bb_3d, ukf.camera)),
+                                              np.fliplr(pose_to_3d_bb_proj(tf_w_ado_gt, tf_w_ego_gt, ukf.bb_3d, ukf.camera)) ) )
+        else:
+            ukf.projected_3d_bb = np.fliplr(pose_to_3d_bb_proj(tf_w_ado, tf_w_ego, ukf.bb_3d, ukf.camera))
+        if class_str in self.connected_inds:
+            ukf.connected_inds = self.connected_inds[class_str]
@@ -0,0 +1,61 @@
+####### DETECTOR & TRACKER BACKENDS #######
+# The detectors & trackers ImageSegmentor can use, by name. A backend's module (and with it its heavy dependencies,
+# e.g. torch & yolov3, pycoral or SiamMask) is only imported when that backend is made, so a deployment only pays
+# for the stack it runs. New backends are added w/ register_detector / register_tracker.
+# IMPORTS
+import time, importlib
+from collections import namedtuple
+import numpy as np
+
+# module & class to import, & which of ImageSegmentor's backend options (see make_detector / make_tracker) its constructor takes
+Backend = namedtuple('Backend', ['module_name', 'class_name', 'option_names'])
+
+DETECTORS = {'yolov3': Backend('detector', 'YoloDetector', ('base_dir', 'classes_ids', 'cfg', 'weights')),
+             'edge_tpu_mobile_det': Backend('edge_tpu_detector', 'EdgeTPU', ('classes_ids',))}
+TRACKERS = {'siammask': Backend('tracker', 'SiammaskTracker', ('base_dir', 'use_tensorrt'))}
+
+
+def register_detector(name, module_name, class_name, option_names=()):
+    DETECTORS[name] = Backend(module_name, class_name, tuple(option_names))
+
+
+def register_tracker(name, module_name, class_name, option_names=()):
+    TRACKERS[name] = Backend(module_name, class_name, tuple(option_names))
+
+
+def make_backend(registry, kind, name, sample_im, options, startup_times):
+    """
+    import & construct the backend name of registry (kind is 'detector' or 'tracker', for messages), passing it
+    the options it takes. The import & model load times [s] are added to startup_times
+    """
+    if name not in registry:
+        raise RuntimeError("{} {} not implemented (options: {})".format(kind, name, ', '.join(sorted(registry))))
+    backend = registry[name]
+    tic = time.perf_counter()
+    backend_class = getattr(importlib.import_module(backend.module_name), backend.class_name)
+    startup_times[kind + ' import'] = time.perf_counter() - tic
+    tic = time.perf_counter()
+    obj = backend_class(sample_im, **{k: options[k] for k in backend.option_names})
+    startup_times[kind + ' load'] = time.perf_counter() - tic
+    return obj
+
+
+def warm_up_detector(detector, sample_im, startup_times):
+    """ run the first (slow: lazy allocations, cudnn autotuning...) inference before the first real image """
+    tic = time.perf_counter()
+    detector.detect(np.zeros_like(sample_im))  # (blank so nothing is detected)
+    startup_times['detector warm-up'] = time.perf_counter() - tic
+
+
+def warm_up_tracker(tracker, sample_im, startup_times):
+    tic = time.perf_counter()
+    h, w = sample_im.shape[:2]
+    obj_state = tracker.reinit(np.array([w / 4, h / 4, w / 2, h / 2]), sample_im)
+    tracker.track(sample_im, obj_state)
+    startup_times['tracker warm-up'] = time.perf_counter() - tic
+
+
+def startup_report_str(startup_times):
+    """ e.g. 'detector import 2.10 s, detector load 0.85 s, ... (total 4.02 s)' """
+    return ', '.join("{} {:.2f} s".format(k, v) for k, v in startup_times.items()) + \
+        " (total {:.2f} s)".format(sum(startup_times.values()))
@@ -0,0 +1,66 @@
+import os
+
+# sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + '/coral/python')
+from coral.tflite.python.examples.detection import detect as tpu_detect
+from pycoral.utils import edgetpu
+from pycoral.adapters import common
+import numpy as np
+from PIL import Image
+from PIL import ImageDraw
+
+
+# based on https://github.com/google-coral/tflite/blob/master/python/examples/detection/detect.py
+# max_instances_per_class can be a list with a number for each class, or a number applied to all classes
+# Returns (x,y,w,h, object_conf, class_conf, class)
+class EdgeTPU:
+    def __init__(self, sample_im, model_dir='/mounted_folder/models', model_name='ssdlite_mobiledet_coco_qat_postprocess_edgetpu.tflite', img_size=416, conf_thres=0.5, classes_ids=[80], max_instances_per_class=5):
+        # ssdlite_mobiledet_coco_qat_postprocess_edgetpu.tflite   |   ssd_mobilenet_v2_coco_quant_postprocess_edgetpu.tflite
+        self.img_size = img_size
+        self.conf_thres = conf_thres
+        self.classes_ids = classes_ids
+        # if isinstance(max_instances_per_class, int):
+        #     self.max_instances_per_class = [max_instances_per_class]*len(classes_ids)
+        # elif len(max_instances_per_class)== len(classes_ids):
+        #     self.max_instances_per_class = max_instances_per_class
+        # else:
+        #     raise NameError('Inconsistent max instances per class and classes ids')
+        self.classes_ids = classes_ids
+        
+        # Initialize the TF interpreter
+        model_file_path_and_name = os.path.join(model_dir, model_name)
+        self.interpreter = edgetpu.make_interpreter(model_file_path_and_name)
+        self.interpreter.allocate_tensors()
+        self.size = common.input_size(self.interpreter)
+
+        
+
+        # self.label_file = os.path.join(model_dir, 'coco_labels.txt')
+        # image_file = os.path.join(script_dir, 'parrot.jpg')
+
+    def detect(self, img0):
+        # Image needs to be PIL?
+        print("in EDGE detector function")
+        image_PIL = Image.fromarray(img0) # PIL format
+        # image_PIL = Image.open("/mounted_folder/images/img_484.png")
+        # scale = tpu_detect.set_input(self.interpreter, image_PIL.size, lambda size: image_PIL.resize(size, Image.ANTIALIAS))
+        def tmp_func(size):
+            return image_PIL.resize(size, Image.ANTIALIAS)
+        scale = tpu_detect.set_input(self.interpreter, image_PIL.size, tmp_func)
+        objs = tpu_detect.get_output(self.interpreter, self.conf_thres, scale)
+
+        # same rows as the yolo detector: x1, y1, x2, y2, object conf, class conf, class (the edge tpu models only
+        # give 1 score, it is used for both). The boxes are already scaled to img0
+        det = [[o.bbox.xmin, o.bbox.ymin, o.bbox.xmax, o.bbox.ymax, o.score, o.score, o.id] for o in objs if o.id in self.classes_ids]
+
+        if len(det) == 0:
+            print('No objects detected')
+            return np.array([])
+        det = np.array(det, dtype=float)
+
+
+        # Reformat det to x,y,w,h (x and y are top left corner's position)
+
+        det[:,2] = det[:,2] - det[:,0]
+        det[:,3] = det[:,3] - det[:,1]
+        return det
+
@@ -1,35 +1,43 @@
-from detector import YoloDetector
-from detector import EdgeTPU
-from tracker import SiammaskTracker
-import sys, os, time
+import sys, os, time, traceback
+from collections import OrderedDict
 import numpy as np
 import math
 import numpy.linalg as la
 from utils_msl_raptor.ukf_utils import bb_corners_to_angled_bb
 from utils_msl_raptor.ukf_utils import condensed_to_square
+from utils_msl_raptor.pipeline_utils import RingBuffer, PipelineStage, DROP_OLDEST
+from utils_msl_raptor.data_association import associate_ukfs
+from utils_msl_raptor.instrumentation import instruments
 from scipy.spatial.distance import pdist,squareform
+from backends import DETECTORS, TRACKERS, make_backend, warm_up_detector, warm_up_tracker
 class TrackedObject:
     def __init__(self, object_id, class_str):
         self.id = object_id
         self.class_str = class_str
         self.latest_tracked_state = None
 
+class DetectionJob:
+    # an image sent to the background detector, with where each tracked object was in it
+    def __init__(self, image, time, track_positions):
+        self.image = image
+        self.time = time
+        self.track_positions = track_positions  # {obj_id: target_pos}
+        self.detections = None
+        self.stamps = {}
+
 class ImageSegmentor:
-    def __init__(self,sample_im,detector_name='yolov3',tracker_name='siammask', detect_classes_ids=[0,39,41,45,63,80], detect_classes_names = ['person','bottle','cup','bowl','laptop','mslquad'],use_trt=False, im_width=640, im_height=480, detection_period = 5,verbose=False, use_track_checks=True, use_gt_detect_bb=False, detector_cfg='yolov3/cfg/yolov3.cfg', detector_weights='yolov3/weights/yolov3.weights'):
+    def __init__(self,sample_im,detector_name='yolov3',tracker_name='siammask', detect_classes_ids=[0,39,41,45,63,80], detect_classes_names = ['person','bottle','cup','bowl','laptop','mslquad'],use_trt=False, im_width=640, im_height=480, detection_period = 5,verbose=False, use_track_checks=True, use_gt_detect_bb=False, detector_cfg='yolov3/cfg/yolov3.cfg', detector_weights='yolov3/weights/yolov3.weights', async_detection=False, warm_up=True):
         base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + '/front_end/'
         print('Using classes '+str(detect_classes_names))
-        if detector_name == 'yolov3':
-            self.detector = YoloDetector(sample_im, base_dir=base_dir, classes_ids=detect_classes_ids, cfg=detector_cfg, weights=detector_weights)
-        if detector_name == 'edge_tpu_mobile_det':
-            self.detector = EdgeTPU(sample_im, classes_ids=detect_classes_ids)
-        else:
-            raise RuntimeError("Detector chosen not implemented")
-
-        if tracker_name == 'siammask':
-            self.tracker = SiammaskTracker(sample_im,base_dir=base_dir, use_tensorrt=use_trt)
-        else:
-            raise RuntimeError("Tracker chosen not implemented")
-
+        # Only the chosen backends (& their dependencies) are imported, see backends.py
+        self.startup_times = OrderedDict()  # [s] per phase: import, model load & warm-up of the detector & tracker
+        backend_options = {'base_dir': base_dir, 'classes_ids': detect_classes_ids, 'cfg': detector_cfg, 'weights': detector_weights, 'use_tensorrt': use_trt}
+        self.detector = make_backend(DETECTORS, 'detector', detector_name, sample_im, backend_options, self.startup_times)
+        if warm_up:
+            warm_up_detector(self.detector, sample_im, self.startup_times)
+        self.tracker = make_backend(TRACKERS, 'tracker', tracker_name, sample_im, backend_options, self.startup_times)
+        if warm_up:
+            warm_up_tracker(self.tracker, sample_im, self.startup_times)
 
         self.class_id_to_str = dict(zip(detect_classes_ids, detect_classes_names))
         self.class_str_to_id = dict(zip(detect_classes_names,detect_classes_ids))
@@ -53,6 +61,7 @@ class ImageSegmentor:
 
         self.last_detection_time = None
         self.detection_period = detection_period
+        self.publish_track_snapshot()
 
         ####################################################################
 
@@ -88,6 +97,16 @@ class ImageSegmentor:
         
         self.num_detections = 0
 
+        # If async_detection, detections run on a worker thread while the tracker keeps processing images, & are
+        # applied to the tracks when they are ready (instead of blocking the image they were requested on)
+        self.async_detection = async_detection and not use_gt_detect_bb
+        self.b_detection_pending = False
+        if self.async_detection:
+            self.detect_buf = RingBuffer(1, DROP_OLDEST, name='detector input')
+            self.detections_buf = RingBuffer(1, DROP_OLDEST, name='detections')
+            self.detect_stage = PipelineStage('detect', self.run_detection_job, self.detect_buf, self.detections_buf)
+            self.detect_stage.start()
+
     def stop_tracking_lost_objects(self):
         # Remove objects that triggered detection and were not matched to new detections
         self.last_lost_objects = set(self.last_lost_objects)
@@ -104,6 +123,8 @@ class ImageSegmentor:
         The gt_boxes is an optional argument which is used when using ground-truth for the detected boxes
         gt_boxes format: list of tuples: [(x,y,w,h,class_conf,obj_conf,class_id),...] where x and y are top left corner positions.
         ''' 
+        if self.async_detection:
+            return self.process_image_async(image,time)
         if self.mode == self.DETECT:
             if self.use_gt_detect_bb:
                 if gt_boxes is None:
@@ -131,18 +152,112 @@ class ImageSegmentor:
                 self.check_periodic_detection(time)
             return self.track(image)
 
+    def track_rois(self,time,margin=0):
+        '''
+        Regions of the image the tracker will read if the next image (at the given time) is tracked, as a list of
+        (row_min, row_max, col_min, col_max). Returns None if the whole image is needed (i.e. a detection is due).
+        Called from the preprocess thread while process_image runs on another, so it only reads the last published
+        track_snapshot (never the tracked objects themselves)
+        '''
+        mode, last_detection_time, track_states = self.track_snapshot  # (read once)
+        if mode != self.TRACK or (self.use_track_checks and time - last_detection_time > self.detection_period):
+            return None
+        return [self.tracker.search_region(track_state, margin) for track_state in track_states]
+
+    def publish_track_snapshot(self):
+        '''
+        Swap in (as one tuple) what track_rois needs: the mode, the last detection time & the latest state of each
+        active object. The states are replaced (not changed) by the tracker, so the tuple never changes after this
+        '''
+        track_states = tuple(self.tracked_objects[obj_id].latest_tracked_state for obj_id in sum(self.active_objects_ids_per_class.values(),[]))
+        self.track_snapshot = (self.mode, self.last_detection_time, track_states)
+
+    def process_image_async(self,image,time):
+        '''
+        process_image when detecting in the background: when a detection is due the image is sent to the detector
+        & the objects keep being tracked. The detections are applied once they come back (on a later image).
+        Only waits for the detector when nothing is being tracked.
+        '''
+        if self.mode == self.DETECT and not self.b_detection_pending:
+            self.start_detection_job(image,time)
+        if self.b_detection_pending:
+            b_tracking = len(sum(self.active_objects_ids_per_class.values(),[])) > 0
+            job = self.detections_buf.pop(timeout=0 if b_tracking else None)
+            if job is not None:
+                self.apply_detection_job(job,image)
+        elif self.use_track_checks:
+            self.check_periodic_detection(time)
+        return self.track(image)
+
+    def start_detection_job(self,image,time):
+        track_positions = {obj_id: np.copy(self.tracked_objects[obj_id].latest_tracked_state['target_pos']) for obj_id in sum(self.active_objects_ids_per_class.values(),[])}
+        self.detect_buf.push(DetectionJob(image,time,track_positions))
+        self.b_detection_pending = True
+        self.last_detection_time = time
+        self.mode = self.TRACK  # keep tracking until the detections are back
+
+    def run_detection_job(self,job):
+        # (on the detector thread) always returns the job so the tracker doesn't wait on a detection that failed
+        try:
+            job.detections = self.detect(job.image)
+        except Exception:
+            print("Exception in background detection:")
+            traceback.print_exc()
+            job.detections = []
+        job.image = None
+        return job
+
+    def apply_detection_job(self,job,image):
+        self.b_detection_pending = False
+        bbs_no_angle = job.detections
+        if len(bbs_no_angle) == 0:
+            print("Did not detect object")
+            self.stop_tracking_lost_objects()
+            self.mode = self.DETECT
+            return
+        bbs_no_angle[:,2:4] += self.box_buffer
+        # the objects moved while the detector ran: shift each box by how much the track it landed on has moved since
+        for bb in bbs_no_angle:
+            center = bb[0:2] + bb[2:4]/2
+            best_dist = max(bb[2:4])/2
+            shift = None
+            for obj_id, det_pos in job.track_positions.items():
+                if obj_id not in sum(self.active_objects_ids_per_class.values(),[]):
+                    continue
+                dist = la.norm(center - det_pos)
+                if dist < best_dist:
+                    best_dist = dist
+                    shift = self.tracked_objects[obj_id].latest_tracked_state['target_pos'] - det_pos
+            if shift is not None:
+                bb[0:2] += shift
+        if self.verbose:
+            print("applying detections from {:.3f} s ago".format(time.time() - job.stamps['detect_done']))
+        self.reinit_tracker(bbs_no_angle,image)
+        self.mode = self.TRACK
+
+    def stop_async_detection(self):
+        if self.async_detection:
+            self.detect_stage.stop()
+
     def track(self,image):
+        # (every image ends here, so the snapshot for track_rois is published once per image)
         if self.use_track_checks:
-            return self.track_with_checks(image)
+            output = self.track_with_checks(image)
         else:
-            return self.track_without_checks(image)
+            output = self.track_without_checks(image)
+        self.publish_track_snapshot()
+        return output
 
     def track_without_checks(self,image):
         tic = time.time()
         output = {}
+        # Track all active objects together
+        active_obj_ids = sum(self.active_objects_ids_per_class.values(),[])
+        with instruments.span('track'):
+            track_outputs = self.tracker.track_batch(image,[self.tracked_objects[obj_id].latest_tracked_state for obj_id in active_obj_ids])
         # Go over each active tracked object
-        for obj_id in sum(self.active_objects_ids_per_class.values(),[]):
-            self.tracked_objects[obj_id].latest_tracked_state, abb, mask = self.tracker.track(image,self.tracked_objects[obj_id].latest_tracked_state)
+        for obj_id, (tracked_state, abb, mask) in zip(active_obj_ids, track_outputs):
+            self.tracked_objects[obj_id].latest_tracked_state = tracked_state
             abb = bb_corners_to_angled_bb(abb.reshape(-1,2))
             
             output[obj_id] = [abb,self.tracked_objects[obj_id].class_str, True]
@@ -158,16 +273,22 @@ class ImageSegmentor:
         prev_positions = []
         new_positions = []
         obj_ids = []
+        # Track all active objects together
+        active_obj_ids = sum(self.active_objects_ids_per_class.values(),[])
+        with instruments.span('track'):
+            track_outputs = self.tracker.track_batch(image,[self.tracked_objects[obj_id].latest_tracked_state for obj_id in active_obj_ids])
         # Go over each active tracked object
-        for obj_id in sum(self.active_objects_ids_per_class.values(),[]):
+        for obj_id, (tracked_state, abb, mask) in zip(active_obj_ids, track_outputs):
             prev_pos= self.tracked_objects[obj_id].latest_tracked_state['target_pos']
-            self.tracked_objects[obj_id].latest_tracked_state, abb, mask = self.tracker.track(image,self.tracked_objects[obj_id].latest_tracked_state)
+            self.tracked_objects[obj_id].latest_tracked_state = tracked_state
             abb = bb_corners_to_angled_bb(abb.reshape(-1,2))
             # Check if measurement valid if we have a state estimate
             if obj_id in self.ukf_dict:
-                valid = self.valid_tracking(self.ukf_dict[obj_id],abb,self.tracked_objects[obj_id].latest_tracked_state['score'],obj_id)
+                with instruments.span('gating'):
+                    valid = self.valid_tracking(self.ukf_dict[obj_id],abb,self.tracked_objects[obj_id].latest_tracked_state['score'],obj_id)
                 # If not valid we switch to detection
                 if not valid:
+                    instruments.count('track_rejections')
                     self.last_lost_objects.append(obj_id)
                     self.mode = self.DETECT
                     
@@ -208,48 +329,29 @@ class ImageSegmentor:
 
 
     def reinit_tracker(self,new_boxes,image):
-        new_active_objects_ids = []
-        for new_box in new_boxes:
-            class_str = self.class_id_to_str[new_box[-1]]
-            if class_str not in self.active_objects_ids_per_class or len(self.active_objects_ids_per_class[class_str]) == 0:
-                # No active objects of this class
+        # Match the new boxes to the active objects of the same class (min total Mahalanobis distance to the ukf
+        # predictions, gated), unmatched boxes are new objects
+        for class_id in np.unique([new_box[-1] for new_box in new_boxes]):
+            class_str = self.class_id_to_str[class_id]
+            class_boxes = [new_box for new_box in new_boxes if new_box[-1] == class_id]
+            if class_str not in self.active_objects_ids_per_class:
+                self.active_objects_ids_per_class[class_str] = []
+            # Only objects that already have a ukf prediction can be matched
+            candidate_ids = [id for id in self.active_objects_ids_per_class[class_str] if id in self.ukf_dict and hasattr(self.ukf_dict[id],'obs_pred')]
+            abbs = [np.concatenate([new_box[:4],[0]]) for new_box in class_boxes]
+            with instruments.span('gating'):
+                matches, unmatched_boxes, _ = associate_ukfs(abbs, [self.ukf_dict[id] for id in candidate_ids], self.chi2_001**2)  # (same gate as compute_mahalanobis_dist < chi2_001)
+
+            for box_idx, candidate_idx in matches:
+                obj_id = candidate_ids[candidate_idx]
+                # Previously tracked object was matched, if it triggered redetection we can keep it
+                if obj_id in self.last_lost_objects: self.last_lost_objects.remove(obj_id)
+                self.tracked_objects[obj_id].latest_tracked_state = self.tracker.reinit(class_boxes[box_idx],image)
+            for box_idx in unmatched_boxes:
+                # No object was matched, new object detected
                 obj_id = self.new_tracked_object(class_str)
-                self.active_objects_ids_per_class[class_str] = [obj_id]
-            else:
-                # There exist some active objects of this class, check if they match
-                best_t = self.chi2_001
-                obj_id = None
-                # Go through active candidate objects
-                for id in self.active_objects_ids_per_class[class_str]:
-                    # Make sure the candidate object isn't already matched to a new detection, and already has a ukf prediction
-                    if id in new_active_objects_ids or id not in self.ukf_dict:
-                        continue
-                    # Probabilistic check of if the measurement matches the ukf prediction
-                    abb = np.concatenate([new_box[:4],[0]])
-                    t = self.compute_mahalanobis_dist(self.ukf_dict[id],abb)
-                
-                    # Found an acceptable match
-                    if t < best_t:
-                        best_t = t
-                        obj_id = id
-
-                
-                if obj_id == None:
-                    # No object was matched, new object detected
-                    obj_id = self.new_tracked_object(class_str)
-                    if class_str in self.active_objects_ids_per_class:
-                        self.active_objects_ids_per_class[class_str].append(obj_id)
-                    else:
-                        self.active_objects_ids_per_class[class_str] = [obj_id]
-                else:
-                    # Previously tracked object was matched, if it triggered redetection we can keep it
-                    if obj_id in self.last_lost_objects: self.last_lost_objects.remove(obj_id)
-
-            # Get tracker initialization from the detected box
-            self.tracked_objects[obj_id].latest_tracked_state = self.tracker.reinit(new_box,image)
-
-            # Keep track of new objects to not consider them for association
-            new_active_objects_ids.append(obj_id)
+                self.active_objects_ids_per_class[class_str].append(obj_id)
+                self.tracked_objects[obj_id].latest_tracked_state = self.tracker.reinit(class_boxes[box_idx],image)
 
         # Remove objects that triggered detection and were not matched to new detections
         self.stop_tracking_lost_objects()
@@ -259,7 +361,9 @@ class ImageSegmentor:
     def detect(self,image):
         tic = time.time()
         print("calling general detection function")
-        detections = self.detector.detect(image)
+        with instruments.span('detect'):
+            detections = self.detector.detect(image)
+        instruments.count('detections')
         if len(detections) == 0:
             return detections
         valid_detections_ids = []
@@ -277,9 +381,12 @@ class ImageSegmentor:
     def compute_mahalanobis_dist(self,ukf,abb):
         # Check if new measurement is too far from distribution of previous measurement
         # Mahalanobis distance
-        if not hasattr(ukf,'mu_obs'):
+        if not hasattr(ukf,'obs_pred'):
+            return np.inf
+        mu_obs, _, _, S_obs_chol_inv = ukf.obs_pred  # (read once, factored by the ukf once per step)
+        if S_obs_chol_inv is None:  # S_obs not pos. def.
             return np.inf
-        return math.sqrt((abb-ukf.mu_obs)@ la.inv(ukf.S_obs) @ (abb-ukf.mu_obs).T)
+        return la.norm(S_obs_chol_inv @ (abb-mu_obs))
         
 
 
@@ -320,12 +427,13 @@ class ImageSegmentor:
             print('Object tracking score of '+str(score)+' - min '+str(self.track_min_score))
             return False
 
-        if not hasattr(ukf,'mu_obs'):
+        if not hasattr(ukf,'obs_pred'):
             return True
+        S_obs = ukf.obs_pred[1]
         # Check if row or column valid
         mu_x_l = abb[0] - abb[2]/2
         mu_x_r = abb[0] + abb[2]/2
-        sigma_x = math.sqrt(ukf.S_obs[0,0] + ukf.S_obs[2,2]/4)
+        sigma_x = math.sqrt(S_obs[0,0] + S_obs[2,2]/4)
         z_x_l = (0-mu_x_l)/sigma_x
         z_x_r = (self.im_width-mu_x_r)/sigma_x
 
@@ -335,7 +443,7 @@ class ImageSegmentor:
 
         mu_y_l = abb[1] - abb[3]/2
         mu_y_r = abb[1] + abb[3]/2
-        sigma_y = math.sqrt(ukf.S_obs[1,1]+ ukf.S_obs[3,3]/4)
+        sigma_y = math.sqrt(S_obs[1,1]+ S_obs[3,3]/4)
         z_y_l = (0-mu_y_l)/sigma_y
         z_y_r = (self.im_height-mu_y_r)/sigma_y
 
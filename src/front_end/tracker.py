@@ -1,5 +1,27 @@
 from SiamMask.tools.test import *
 
+
+class BatchSliceNet:
+    """
+    Stands in for the SiamMask net in siamese_track, returning one object's slice of a forward pass run on a batch
+    of search crops (so all of siamese_track's post processing is reused as is)
+    """
+    def __init__(self, net, idx, score, delta, mask, feature, corr_feature):
+        self.net = net
+        self.sl = slice(idx, idx + 1)
+        self.score, self.delta, self.mask = score[self.sl], delta[self.sl], mask[self.sl]
+        self.feature, self.corr_feature = feature, corr_feature
+
+    def track_mask(self, search):
+        return self.score, self.delta, self.mask
+
+    def track_refine(self, pos):
+        # the refinement head is run per object since it only takes one position for the whole batch
+        self.net.feature = [f[self.sl] for f in self.feature]
+        self.net.corr_feature = self.corr_feature[self.sl]
+        return self.net.track_refine(pos)
+
+
 class SiammaskTracker:
     def __init__(self,sample_im, base_dir='', x=0 ,y=0,w=10,h=10, use_tensorrt=False,fp16_mode=True,features_trt=True,rpn_trt=False,mask_trt=False,refine_trt=False):
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
@@ -22,10 +44,13 @@ class SiammaskTracker:
         target_pos = np.array([x + w / 2, y + h / 2])
         target_sz = np.array([w, h])
         self.state = siamese_init(sample_im, target_pos, target_sz, siammask, self.cfg['hp'], device=self.device)  # init tracker
+        self.state['zf'] = siammask.zf
+        self.use_tensorrt = use_tensorrt
         if use_tensorrt:
              self.state['net'].init_trt(fp16_mode,features_trt,rpn_trt,mask_trt,refine_trt, trt_weights_path='/root/msl_raptor_ws/src/msl_raptor/src/front_end/SiamMask/weights_trt')
 
-        self.keys_to_share = ['target_pos','target_sz','score','mask','ploygon']
+        # zf: template features of the object (the net only holds one template, so each object keeps its own)
+        self.keys_to_share = ['target_pos','target_sz','score','mask','ploygon','zf']
 
         self.states_each_object = []
         self.current_classes = []
@@ -35,6 +60,7 @@ class SiammaskTracker:
         masks = []
         with torch.no_grad():
             self.object_state_to_siammask_state(obj_state)
+            self.state['net'].zf = self.state['zf']
             self.state = siamese_track(self.state, im, mask_enable=True, refine_enable=True, device=self.device)  # track
             obj_state = self.siammask_state_to_object_state()
         locations.append(self.state['ploygon'].flatten())
@@ -49,12 +75,48 @@ class SiammaskTracker:
         target_pos = np.array([x + w / 2, y + h / 2])
         target_sz = np.array([w, h])
         self.state = siamese_init(im, target_pos, target_sz, self.state['net'], self.cfg['hp'], device=self.device)  # init tracker
+        self.state['zf'] = self.state['net'].zf
         self.state['score'] = None
         self.state['ploygon'] = None
         self.state['mask'] = None
         return self.siammask_state_to_object_state()
         
 
+    def track_batch(self,im,obj_states):
+        # track several objects w/ one forward pass of the backbone, rpn & mask heads on all of their search crops.
+        # Returns a list of what track returns for each object (same results as calling it on each)
+        if len(obj_states) <= 1 or self.use_tensorrt:  # (the tensorrt engines are built for a batch of 1)
+            return [self.track(im,obj_state) for obj_state in obj_states]
+        net = self.state['net']
+        p = self.state['p']
+        outputs = []
+        with torch.no_grad():
+            x_crops = [get_subwindow_tracking(im, obj_state['target_pos'], p.instance_size, round(self.search_size(obj_state)), self.state['avg_chans']) for obj_state in obj_states]
+            net.zf = torch.cat([obj_state['zf'] for obj_state in obj_states])
+            score, delta, mask = net.track_mask(torch.stack(x_crops).to(self.device))
+            feature, corr_feature = net.feature, net.corr_feature
+            for idx, obj_state in enumerate(obj_states):
+                self.object_state_to_siammask_state(obj_state)
+                self.state['net'] = BatchSliceNet(net, idx, score, delta, mask, feature, corr_feature)
+                self.state = siamese_track(self.state, im, mask_enable=True, refine_enable=True, device=self.device)  # (net calls return this object's slice)
+                self.state['net'] = net
+                outputs.append((self.siammask_state_to_object_state(), self.state['ploygon'].flatten(), self.state['mask'] > self.state['p'].seg_thr))
+        return outputs
+
+    def search_size(self,obj_state):
+        # side of the (square) search region siamese_track crops around the object [pix]
+        p = self.state['p']
+        target_sz = obj_state['target_sz']
+        wc_x = target_sz[0] + p.context_amount * sum(target_sz)
+        hc_x = target_sz[1] + p.context_amount * sum(target_sz)
+        return np.sqrt(wc_x * hc_x) * p.instance_size / p.exemplar_size
+
+    def search_region(self,obj_state,margin=0):
+        # region of the image siamese_track reads to track this object: (row_min, row_max, col_min, col_max)
+        target_pos = obj_state['target_pos']
+        half_size = round(self.search_size(obj_state)) / 2 + margin + 1
+        return (target_pos[1] - half_size, target_pos[1] + half_size, target_pos[0] - half_size, target_pos[0] + half_size)
+
     def object_state_to_siammask_state(self,object_state):
         for key in self.keys_to_share:
             self.state[key] = object_state[key]
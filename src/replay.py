@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Offline replay: runs the front end (ImageSegmentor) & the back end (FilterBank) on every image of a recorded bag (or
+of a directory of frames) in stamp order, as fast as they run, & writes an output bag w/ the same topics a recording
+of the node has, so it can be processed w/ rosbag_to_logs.py as is. No ROS master, node or rosbag play is needed.
+The ego poses are looked up (interpolated) at each image time, so a replay only depends on its inputs & options.
+
+With --b_realtime the node's frame dropping is emulated instead: while an image is being processed (for the time it
+took, times --compute_scale, or a fixed --frame_cost_ms) newer images only replace the one waiting (queue_size=1).
+
+A directory of frames has:
+    camera_info.yaml        K (9 values, row major), D (5 values, or [] if undistorted), width, height
+    ego_pose.csv            time, x, y, z, qw, qx, qy, qz per row (the ego's own pose estimate)
+    ego_pose_gt.csv         same, from mocap (optional, ego_pose.csv is used if missing)
+    ado_gt/<name>.csv       same, per object (optional, copied to the output for rosbag_to_logs' metrics)
+    images/<time>.png       (or .jpg) named by their stamp in seconds
+
+usage:  python replay.py <bag | frame directory> [--out_dir /mounted_folder/raptor_processed_bags] [--ns /quad7]
+            [--detector_name edge_tpu_mobile_det] [--detection_period 5] [--b_realtime] [--compute_scale 1]
+            [--frame_cost_ms 50] [--b_copy_images] [--max_images N] [--b_latency_stats]
+"""
+# IMPORTS
+# system
+import os, sys, time, glob, argparse
+from types import SimpleNamespace
+import yaml
+# math
+import numpy as np
+import cv2
+# ros (only the message & bag libraries)
+import rospy
+import rosbag
+from geometry_msgs.msg import PoseStamped
+from sensor_msgs.msg import CameraInfo
+from cv_bridge import CvBridge
+# custom modules
+from ros_interface import make_filter_state_msg, make_bb_msg
+from camera import camera, calc_tf_cam_ego
+from filter_bank import FilterBank
+# libs & utils
+from utils_msl_raptor.ros_utils import get_ros_time, pose_msg_to_array, update_running_average, get_object_sizes_from_yaml
+from utils_msl_raptor.ukf_utils import load_category_params
+from utils_msl_raptor.pose_buffer import PoseBuffer
+from utils_msl_raptor.instrumentation import instruments
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/front_end')
+from image_segmentor import ImageSegmentor
+
+PARAMS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'params')
+
+
+def make_pose_buffer(times, poses, name):
+    """ PoseBuffer holding all the poses (sorted by time) """
+    buf = PoseBuffer(max(len(times), 1), name=name)
+    for i in np.argsort(times, kind='stable'):
+        buf.push(times[i], poses[i])
+    return buf
+
+
+def make_pose_stamped_msg(t, pose):
+    """ pose: [x,y,z,qw,qx,qy,qz] """
+    msg = PoseStamped()
+    msg.header.stamp = rospy.Time.from_sec(t)
+    msg.header.frame_id = 'world'
+    msg.pose.position.x, msg.pose.position.y, msg.pose.position.z = pose[0:3]
+    msg.pose.orientation.w, msg.pose.orientation.x, msg.pose.orientation.y, msg.pose.orientation.z = pose[3:7]
+    return msg
+
+
+class BagSource:
+    """ images, ego poses & camera info from a bag recorded for the node (e.g. rosbag_for_post_process_*.bag) """
+
+    def __init__(self, bag_path, ns):
+        self.name = os.path.splitext(os.path.basename(bag_path))[0]
+        self.bag = rosbag.Bag(bag_path, 'r')
+        self.image_topic = ns + '/camera/image_raw'
+        self.output_topics = [ns + '/msl_raptor_state', ns + '/bb_data']  # (from an earlier run, not copied)
+        ego_topic, ego_gt_topic, camera_info_topic = ns + '/mavros/local_position/pose', ns + '/mavros/vision_pose/pose', ns + '/camera/camera_info'
+        self.camera_info = None
+        poses = {ego_topic: ([], []), ego_gt_topic: ([], [])}
+        for topic, msg, _ in self.bag.read_messages(topics=[ego_topic, ego_gt_topic, camera_info_topic]):
+            if topic == camera_info_topic:
+                if self.camera_info is None:
+                    self.camera_info = msg
+            else:
+                poses[topic][0].append(get_ros_time(msg))
+                poses[topic][1].append(pose_msg_to_array(msg.pose))
+        if self.camera_info is None or len(poses[ego_topic][0]) == 0:
+            raise RuntimeError("{} needs {} & {} messages!".format(bag_path, camera_info_topic, ego_topic))
+        if len(poses[ego_gt_topic][0]) == 0:
+            poses[ego_gt_topic] = poses[ego_topic]
+        self.ego_poses = make_pose_buffer(*poses[ego_topic], name='ego pose (ekf)')
+        self.ego_poses_gt = make_pose_buffer(*poses[ego_gt_topic], name='ego pose (mocap)')
+        self.bridge = CvBridge()
+
+
+    def images(self):
+        """ (stamp, handle for load_image) of each image, in the bag's order """
+        for _, msg, _ in self.bag.read_messages(topics=[self.image_topic]):
+            yield get_ros_time(msg), msg
+
+
+    def load_image(self, msg):
+        return self.bridge.imgmsg_to_cv2(msg, desired_encoding="bgr8")
+
+
+    def messages_to_copy(self, b_copy_images=False):
+        """ (topic, msg, bag time) of everything but the node's outputs (& the images unless b_copy_images) """
+        skip_topics = self.output_topics + ([] if b_copy_images else [self.image_topic])
+        topics = [topic for topic in self.bag.get_type_and_topic_info().topics if topic not in skip_topics]
+        for topic, msg, t in self.bag.read_messages(topics=topics):
+            yield topic, msg, t
+
+
+class FrameDirSource:
+    """ images, ego poses & camera info from a directory of frames & pose csv files (see the top of this file) """
+
+    def __init__(self, frame_dir, ns):
+        self.name = os.path.basename(os.path.normpath(frame_dir))
+        self.ns = ns
+        with open(os.path.join(frame_dir, 'camera_info.yaml')) as stream:
+            info = yaml.safe_load(stream)
+        self.camera_info = SimpleNamespace(K=[float(k) for k in info['K']], D=[float(d) for d in info.get('D') or []],
+                                           width=int(info['width']), height=int(info['height']))
+        self.ego_data = self.load_pose_csv(os.path.join(frame_dir, 'ego_pose.csv'))
+        gt_file = os.path.join(frame_dir, 'ego_pose_gt.csv')
+        self.ego_gt_data = self.load_pose_csv(gt_file) if os.path.isfile(gt_file) else self.ego_data
+        self.ado_gt_data = {os.path.splitext(os.path.basename(f))[0]: self.load_pose_csv(f) for f in sorted(glob.glob(os.path.join(frame_dir, 'ado_gt', '*.csv')))}
+        self.ego_poses = make_pose_buffer(self.ego_data[:, 0], self.ego_data[:, 1:8], name='ego pose (ekf)')
+        self.ego_poses_gt = make_pose_buffer(self.ego_gt_data[:, 0], self.ego_gt_data[:, 1:8], name='ego pose (mocap)')
+        image_files = glob.glob(os.path.join(frame_dir, 'images', '*.png')) + glob.glob(os.path.join(frame_dir, 'images', '*.jpg'))
+        self.image_files = sorted(image_files, key=lambda f: float(os.path.splitext(os.path.basename(f))[0]))
+
+
+    def load_pose_csv(self, file_name):
+        data = np.loadtxt(file_name, delimiter=',', ndmin=2)
+        if data.shape[1] != 8:
+            raise RuntimeError("{} should have 8 columns (time, x, y, z, qw, qx, qy, qz), it has {}".format(file_name, data.shape[1]))
+        return data
+
+
+    def images(self):
+        for f in self.image_files:
+            yield float(os.path.splitext(os.path.basename(f))[0]), f
+
+
+    def load_image(self, file_name):
+        return cv2.imread(file_name)
+
+
+    def messages_to_copy(self, b_copy_images=False):
+        """ the camera info & poses as the messages the node would have recorded """
+        camera_info = CameraInfo()
+        camera_info.header.stamp = rospy.Time.from_sec(self.ego_data[0, 0])
+        camera_info.K, camera_info.D = self.camera_info.K, self.camera_info.D
+        camera_info.width, camera_info.height = self.camera_info.width, self.camera_info.height
+        yield self.ns + '/camera/camera_info', camera_info, camera_info.header.stamp
+        topics_and_data = [(self.ns + '/mavros/local_position/pose', self.ego_data), (self.ns + '/mavros/vision_pose/pose', self.ego_gt_data)] + \
+                          [('/' + name + '/mavros/vision_pose/pose', data) for name, data in self.ado_gt_data.items()]
+        for topic, data in topics_and_data:
+            for row in data:
+                msg = make_pose_stamped_msg(row[0], row[1:8])
+                yield topic, msg, msg.header.stamp
+        if b_copy_images:
+            bridge = CvBridge()
+            for t, f in self.images():
+                msg = bridge.cv2_to_imgmsg(self.load_image(f), encoding="bgr8")
+                msg.header.stamp = rospy.Time.from_sec(t)
+                yield self.ns + '/camera/image_raw', msg, msg.header.stamp
+
+
+class Replay:
+    def __init__(self, source, my_camera, filter_bank, out_bag, ns, im_seg_kwargs, b_realtime=False, compute_scale=1., frame_cost=None, max_images=None):
+        """
+        frame_cost: if given, the time [s] each image takes w/ b_realtime (instead of the measured time * compute_scale),
+            which makes the dropped images the same on every run
+        """
+        self.source = source
+        self.camera = my_camera
+        self.filter_bank = filter_bank
+        self.out_bag = out_bag
+        self.ns = ns
+        self.im_seg_kwargs = im_seg_kwargs
+        self.im_seg = None
+        self.b_realtime = b_realtime
+        self.compute_scale = compute_scale
+        self.frame_cost = frame_cost
+        self.max_images = max_images
+
+        self.previous_image_time = None
+        self.num_images = 0
+        self.num_processed = 0
+        self.num_dropped = 0
+        self.num_out_of_order = 0
+        self.fe_ave_info = [0, 0]  # [running mean, num els]
+        self.be_ave_info = [0, 0]  # [running mean, num els]
+        self.first_image_time = None
+        self.last_image_time = None
+
+
+    def run(self):
+        tic = time.perf_counter()
+        busy_until = -np.inf  # [s] (image time) when the emulated node is done w/ its current image
+        waiting = None  # newest image that came in while busy
+        for img_time, handle in self.source.images():
+            if self.max_images is not None and self.num_images >= self.max_images:
+                break
+            self.num_images += 1
+            if self.first_image_time is None:
+                self.first_image_time = img_time
+            self.last_image_time = img_time
+            if self.im_seg is None:
+                self.im_seg = ImageSegmentor(self.source.load_image(handle), **self.im_seg_kwargs)
+                self.im_seg.ukf_dict = self.filter_bank.ukf_dict
+
+            if not self.b_realtime:
+                self.process_image(img_time, handle)
+                continue
+            if waiting is not None and img_time >= busy_until:
+                busy_until += self.process_image(*waiting)  # (started as soon as the previous one was done)
+                waiting = None
+            if img_time < busy_until:
+                if waiting is not None:
+                    self.num_dropped += 1
+                waiting = (img_time, handle)
+                continue
+            busy_until = img_time + self.process_image(img_time, handle)
+        if waiting is not None:
+            self.process_image(*waiting)
+        self.wall_time = time.perf_counter() - tic
+
+
+    def process_image(self, img_time, handle):
+        """ front end, back end & the outputs for one image (like the node's image callback & main loop). Returns its cost [s] """
+        tic = time.perf_counter()
+        with instruments.span('decode'):
+            image = self.source.load_image(handle)
+        with instruments.span('undistort'):
+            image = self.camera.undistort(image)
+        bb_method = self.im_seg.mode
+        processed_image = self.im_seg.process_image(image, img_time)
+        self.num_processed += 1
+        t_be_start = time.perf_counter()
+        self.fe_ave_info = update_running_average(self.fe_ave_info, t_be_start - tic)
+        instruments.record('front_end', t_be_start - tic)
+
+        if self.previous_image_time is not None and img_time <= self.previous_image_time:
+            self.num_out_of_order += 1  # older than the last image used
+        elif self.previous_image_time is None:
+            self.previous_image_time = img_time  # first image, need initial time so dt will be accurate
+        else:
+            self.previous_image_time = img_time
+            if len(processed_image) > 0:
+                obj_ids_tracked = self.filter_bank.step(processed_image, self.source.ego_poses.get_tfs(img_time), img_time, self.source.ego_poses_gt.get_tfs(img_time))
+                stamp = rospy.Time.from_sec(img_time)
+                with instruments.span('publish'):
+                    self.out_bag.write(self.ns + '/msl_raptor_state', make_filter_state_msg(obj_ids_tracked, self.filter_bank.ukf_dict, self.filter_bank.b_pub_3d_bb_proj), stamp)
+                    self.out_bag.write(self.ns + '/bb_data', make_bb_msg(processed_image, bb_method, img_time), stamp)
+                self.be_ave_info = update_running_average(self.be_ave_info, time.perf_counter() - t_be_start)
+                instruments.record('back_end', time.perf_counter() - t_be_start)
+
+        if self.frame_cost is not None:
+            return self.frame_cost
+        return self.compute_scale * (time.perf_counter() - tic)
+
+
+    def summary_str(self):
+        data_time = self.last_image_time - self.first_image_time if self.num_images > 1 else 0.
+        return ("replayed {:.1f} s of data in {:.1f} s ({:.1f}x real time): {} images, {} processed ({} dropped, {} out of order), "
+                "{:.1f} % detections\n\tAve front end time = {:.4f} s, Ave back end time = {:.4f} s").format(
+                data_time, self.wall_time, data_time / max(self.wall_time, 1e-9), self.num_images, self.num_processed, self.num_dropped,
+                self.num_out_of_order, 100 * self.im_seg.num_detections / max(self.num_processed, 1), self.fe_ave_info[0], self.be_ave_info[0])
+
+
+def run_replay(args):
+    source = BagSource(args.input, args.ns) if os.path.isfile(args.input) else FrameDirSource(args.input, args.ns)
+
+    category_params = load_category_params()  # Returns dict of params per class name
+    bb_3d, obj_width, obj_height, classes_names, classes_ids, objects_names_per_class, connected_inds = \
+        get_object_sizes_from_yaml(os.path.join(PARAMS_DIR, 'all_obs.yaml'), os.path.join(PARAMS_DIR, 'objects_used', args.object_used_file),
+                                   os.path.join(PARAMS_DIR, 'classes.names'), category_params)  # Parse objects used and associated configurations
+    with open(os.path.join(PARAMS_DIR, args.ego_yaml + '.yaml')) as stream:
+        ego_prms = yaml.safe_load(stream)
+    my_camera = camera(source.camera_info, calc_tf_cam_ego(ego_prms['t_cam_ego'], ego_prms['R_cam_ego'], ego_prms['dx'], ego_prms['dy'], ego_prms['dz']))
+    filter_bank = FilterBank(my_camera, bb_3d, obj_width, obj_height, category_params, connected_inds, b_batch_ukf=args.b_batch_ukf,
+                             b_pub_3d_bb_proj=args.b_pub_3d_bb_proj)
+    im_seg_kwargs = dict(detector_name=args.detector_name, use_trt=args.b_use_tensorrt, detection_period=args.detection_period,
+                         detect_classes_ids=classes_ids, detect_classes_names=classes_names, use_track_checks=not args.b_no_track_checks,
+                         detector_weights=args.detector_weights)
+
+    # (named like the node's recording of a bag, which is what rosbag_to_logs looks for)
+    out_path = os.path.join(args.out_dir, 'msl_raptor_output_from_bag_' + source.name + '.bag')
+    out_bag = rosbag.Bag(out_path, 'w')
+    instruments.enable(args.b_latency_stats)
+    try:
+        for topic, msg, t in source.messages_to_copy(args.b_copy_images):
+            out_bag.write(topic, msg, t)
+        replay = Replay(source, my_camera, filter_bank, out_bag, args.ns, im_seg_kwargs, b_realtime=args.b_realtime, compute_scale=args.compute_scale,
+                        frame_cost=None if args.frame_cost_ms is None else args.frame_cost_ms / 1000, max_images=args.max_images)
+        replay.run()
+    finally:
+        out_bag.close()
+    print(replay.summary_str())
+    if args.b_latency_stats:
+        print("latency stats:\n" + instruments.report_str())
+    print("wrote {}".format(out_path))
+    return replay
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='replay a bag (or a directory of frames) through msl-raptor without ros')
+    parser.add_argument('input', help='bag file or directory of frames')
+    parser.add_argument('--out_dir', default='/mounted_folder/raptor_processed_bags')
+    parser.add_argument('--ns', default='/quad7')
+    parser.add_argument('--ego_yaml', default='quad7', help='camera extrinsics (params/<ego_yaml>.yaml)')
+    parser.add_argument('--object_used_file', default='objects_used.txt', help='in params/objects_used/')
+    parser.add_argument('--detector_name', default='edge_tpu_mobile_det')
+    parser.add_argument('--detector_weights', default='yolov3/weights/yolov3.weights')
+    parser.add_argument('--detection_period', type=float, default=5.)
+    parser.add_argument('--b_use_tensorrt', action='store_true')
+    parser.add_argument('--b_no_track_checks', action='store_true')
+    parser.add_argument('--b_batch_ukf', type=int, default=1)
+    parser.add_argument('--b_pub_3d_bb_proj', action='store_true')
+    parser.add_argument('--b_realtime', action='store_true', help='drop the images the node would have dropped')
+    parser.add_argument('--compute_scale', type=float, default=1., help='w/ b_realtime, scale the measured processing times (e.g. for a slower computer)')
+    parser.add_argument('--frame_cost_ms', type=float, default=None, help='w/ b_realtime, fixed processing time per image instead of the measured one')
+    parser.add_argument('--b_copy_images', action='store_true', help='also copy the images to the output (rosbag_to_logs needs them to save images)')
+    parser.add_argument('--max_images', type=int, default=None)
+    parser.add_argument('--b_latency_stats', action='store_true', help='print the per stage latency percentiles (see utils_msl_raptor/instrumentation.py)')
+    np.set_printoptions(linewidth=160, suppress=True)  # format numpy so printing matrices is more clear
+    run_replay(parser.parse_args())
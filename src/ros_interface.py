@@ -2,6 +2,7 @@
 # system
 import sys, time
 import pdb
+from collections import namedtuple
 # math
 import numpy as np
 # ros
@@ -9,34 +10,129 @@ import rospy
 from geometry_msgs.msg import PoseStamped, Twist, Pose
 from msl_raptor.msg import AngledBbox,AngledBboxes,TrackedObjects,TrackedObject
 from sensor_msgs.msg import Image, CameraInfo
-from std_msgs.msg import Float32MultiArray, MultiArrayDimension
+from std_msgs.msg import Float32MultiArray, MultiArrayDimension, String
 import tf
 # libs & utils
 from utils_msl_raptor.ros_utils import *
 from utils_msl_raptor.ukf_utils import *
+from utils_msl_raptor.pipeline_utils import RingBuffer, PipelineStage, DROP_OLDEST
+from utils_msl_raptor.image_utils import rois_contain
+from utils_msl_raptor.pose_buffer import PoseBuffer
+from utils_msl_raptor.instrumentation import instruments
 from cv_bridge import CvBridge, CvBridgeError
 import cv2
 import random
 
+class ImageFrame:
+    """ an image moving through the front end, with the (wall clock) time it entered & left each stage in stamps """
+    def __init__(self, msg, img_time):
+        self.msg = msg
+        self.img_time = img_time  # timestamp of the image msg
+        self.image = None
+        self.tf_w_ego = None
+        self.tf_w_ego_gt = None
+        self.gt_bbs = None
+        self.bb_method = None
+        self.im_process_output = None
+        self.undistort_rois = None  # if only parts of the image were undistorted, the (row_min, row_max, col_min, col_max) of each
+        self.raw_image = None
+        self.stamps = {'capture': time.time()}
+
+
+# what the front end hands to the filter for each image. Built once the frame is fully processed & not changed
+# after (the arrays are made read only), so the main loop can use it while the front end works on the next image
+FrameResult = namedtuple('FrameResult', ['img_time', 'tf_w_ego', 'tf_w_ego_gt', 'bb_method', 'im_process_output', 'front_end_time', 'stamps'])
+
+
+def make_filter_state_msg(obj_ids, ukf_dict, b_pub_3d_bb_proj=False):
+    """ TrackedObjects message w/ the estimated pose of each object in obj_ids (the pose stamps are the image times) """
+    tracked_objects = []
+    for id in obj_ids:
+        obj = TrackedObject()
+        pose_msg = PoseStamped()
+        state_est = ukf_dict[id].mu
+        pose_msg.header.stamp = rospy.Time(ukf_dict[id].itr_time)
+        pose_msg.header.frame_id = 'world'
+        pose_msg.header.seq = np.uint32(ukf_dict[id].itr)
+        pose_msg.pose.position.x = state_est[0]
+        pose_msg.pose.position.y = state_est[1]
+        pose_msg.pose.position.z = state_est[2]
+        pose_msg.pose.orientation.w = state_est[6]
+        pose_msg.pose.orientation.x = state_est[7]
+        pose_msg.pose.orientation.y = state_est[8]
+        pose_msg.pose.orientation.z = state_est[9]
+
+        obj.pose = pose_msg
+        obj.class_str = ukf_dict[id].class_str
+
+        if b_pub_3d_bb_proj:
+            tmp = ukf_dict[id].projected_3d_bb
+            tmp = tmp.reshape((tmp.size, ))
+            obj.projected_3d_bb = tmp
+
+            if ukf_dict[id].connected_inds is not None:
+                tmp = ukf_dict[id].connected_inds
+                tmp = tmp.reshape((tmp.size, ))
+                obj.connected_inds = tmp
+        obj.id = id
+
+        tracked_objects.append(obj)
+
+    return TrackedObjects(tracked_objects=tracked_objects)
+
+
+def make_bb_msg(processed_image, bb_seg_mode, bb_ts):
+    """ AngledBboxes message w/ the front end's angled bounding box of each object """
+    bb_list_msg = AngledBboxes()
+    header_stamp = rospy.Time.from_sec(bb_ts)
+    bb_list_msg.header.stamp = header_stamp
+    for obj_id, (bb, class_str,valid) in processed_image.items():
+        bb_msg = AngledBbox()
+        bb_msg.header.stamp = header_stamp
+        bb_msg.header.frame_id = '{}'.format(obj_id)  # this is an int defining which object this is
+        bb_msg.x = bb[0]
+        bb_msg.y = bb[1]
+        bb_msg.width = bb[2]
+        bb_msg.height = bb[3]
+        bb_msg.angle = bb[4]
+        bb_msg.im_seg_mode = bb_seg_mode
+        bb_msg.class_str = class_str
+        bb_msg.id = obj_id
+
+        bb_list_msg.boxes.append(bb_msg)
+
+    return bb_list_msg
+
+
 class ros_interface:
 
-    def __init__(self, b_use_gt_bb=False,b_verbose=False,b_use_gt_pose_init=False,b_use_gt_detect_bb=False,b_pub_3d_bb_proj=False, b_publish_gt_3d_projections=False):
+    def __init__(self, b_use_gt_bb=False,b_verbose=False,b_use_gt_pose_init=False,b_use_gt_detect_bb=False,b_pub_3d_bb_proj=False, b_publish_gt_3d_projections=False, b_pipeline_front_end=True, b_undistort_crops_only=False):
         
         self.verbose = b_verbose
 
         # Parameters #############################
-        self.im_process_output = []  # what is accessed by the main function after an image is processed
+        self.result_buf = RingBuffer(1, DROP_OLDEST, name='inference -> filter')  # FrameResults for the main function
 
-        self.ego_pose_rosmesg_buffer = ([], [])
-        self.ego_pose_rosmesg_buffer_gt = ([], [])
-        self.ego_pose_rosmesg_buffer_len = 50
+        self.ego_pose_buffer_len = 50
+        self.ego_pose_buffer = PoseBuffer(self.ego_pose_buffer_len, name='ego pose (ekf)')
+        self.ego_pose_buffer_gt = PoseBuffer(self.ego_pose_buffer_len, name='ego pose (mocap)')
         self.ego_pose_gt_rosmsg = None
 
         self.im_seg = None  # object for parsing images into angled bounding boxes
         self.b_use_gt_bb = b_use_gt_bb  # toggle for debugging using ground truth bounding boxes
         self.latest_img_time = -1
-        self.front_end_time = None
+        self.tf_w_ego = None
         self.b_publish_gt_3d_projections = b_publish_gt_3d_projections
+        # if True the image callback only queues images & the front end runs as a pipeline of worker threads
+        # (capture -> preprocess -> inference -> filter), otherwise it all runs in the image callback
+        self.b_pipeline_front_end = b_pipeline_front_end
+        self.pipeline_bufs = [self.result_buf]
+        self.pipeline_stages = []
+        # if True only the regions of the image the tracker will look at are undistorted when tracking (the whole image
+        # is still undistorted for detections). Regions are padded by roi_margin pixels for motion between images
+        self.b_undistort_crops_only = b_undistort_crops_only
+        self.roi_margin = 20
+        self.num_crop_undistort_misses = 0
         ####################################################################
 
         self.ns = rospy.get_param('~ns')  # robot namespace
@@ -69,6 +165,9 @@ class ros_interface:
         rospy.Subscriber(self.ns + '/mavros/vision_pose/pose', PoseStamped, self.ego_pose_gt_cb, queue_size=10)  # optitrack pose
         self.state_pub = rospy.Publisher(self.ns + '/msl_raptor_state', TrackedObjects, queue_size=5)
         self.bb_data_pub = rospy.Publisher(self.ns + '/bb_data', AngledBboxes, queue_size=5)
+        self.latency_stats_pub = rospy.Publisher(self.ns + '/latency_stats', String, queue_size=1)  # json snapshots of the instruments
+        if self.b_pipeline_front_end:
+            self.start_front_end_pipeline()
 
         if self.b_publish_gt_3d_projections or self.b_use_gt_pose_init or self.b_use_gt_detect_bb:
             # Create dict to store pose for each object
@@ -84,75 +183,127 @@ class ros_interface:
     def ego_pose_gt_cb(self, msg):
         # self.ego_pose_gt_rosmsg = msg.pose
         """
-        Maintains a buffer of poses and times. The first element is the earliest. 
-        Stored in a way to interface with a quick method for finding closest match by time.
+        Adds the pose to a fixed size buffer of the latest poses, which can be interpolated at any time in its range.
         """
-        my_time = get_ros_time(msg)  # time in seconds
-
-        if len(self.ego_pose_rosmesg_buffer_gt[0]) < self.ego_pose_rosmesg_buffer_len:
-            self.ego_pose_rosmesg_buffer_gt[0].append(msg.pose)
-            self.ego_pose_rosmesg_buffer_gt[1].append(my_time)
-        else:
-            self.ego_pose_rosmesg_buffer_gt[0][0:self.ego_pose_rosmesg_buffer_len] = self.ego_pose_rosmesg_buffer_gt[0][1:self.ego_pose_rosmesg_buffer_len]
-            self.ego_pose_rosmesg_buffer_gt[1][0:self.ego_pose_rosmesg_buffer_len] = self.ego_pose_rosmesg_buffer_gt[1][1:self.ego_pose_rosmesg_buffer_len]
-            self.ego_pose_rosmesg_buffer_gt[0][-1] = msg.pose
-            self.ego_pose_rosmesg_buffer_gt[1][-1] = my_time
+        self.ego_pose_buffer_gt.push(get_ros_time(msg), pose_msg_to_array(msg.pose))
 
 
     def ego_pose_ekf_cb(self, msg):
         """
-        Maintains a buffer of poses and times. The first element is the earliest. 
-        Stored in a way to interface with a quick method for finding closest match by time.
+        Adds the pose to a fixed size buffer of the latest poses, which can be interpolated at any time in its range.
         """
-        my_time = get_ros_time(msg)  # time in seconds
+        self.ego_pose_buffer.push(get_ros_time(msg), pose_msg_to_array(msg.pose))
+
+
+    def start_front_end_pipeline(self):
+        """
+        capture (image_cb) -> preprocess (pose lookup, decode & undistort) -> inference (detect / track) -> filter
+        Each stage after capture is a worker thread. The buffers between them keep only the newest frames, so a
+        slow stage works on the latest image instead of a backlog.
+        """
+        self.capture_buf = RingBuffer(2, DROP_OLDEST, name='capture -> preprocess')
+        self.preproc_buf = RingBuffer(1, DROP_OLDEST, name='preprocess -> inference')
+        self.pipeline_bufs = [self.capture_buf, self.preproc_buf, self.result_buf]
+        self.pipeline_stages = [PipelineStage('preprocess', self.preprocess_frame, self.capture_buf, self.preproc_buf),
+                                PipelineStage('inference', self.infer_and_handoff_frame, self.preproc_buf)]
+        for stage in self.pipeline_stages:
+            stage.start()
+        rospy.on_shutdown(self.stop_front_end_pipeline)
+
 
-        if len(self.ego_pose_rosmesg_buffer[0]) < self.ego_pose_rosmesg_buffer_len:
-            self.ego_pose_rosmesg_buffer[0].append(msg.pose)
-            self.ego_pose_rosmesg_buffer[1].append(my_time)
-        else:
-            self.ego_pose_rosmesg_buffer[0][0:self.ego_pose_rosmesg_buffer_len] = self.ego_pose_rosmesg_buffer[0][1:self.ego_pose_rosmesg_buffer_len]
-            self.ego_pose_rosmesg_buffer[1][0:self.ego_pose_rosmesg_buffer_len] = self.ego_pose_rosmesg_buffer[1][1:self.ego_pose_rosmesg_buffer_len]
-            self.ego_pose_rosmesg_buffer[0][-1] = msg.pose
-            self.ego_pose_rosmesg_buffer[1][-1] = my_time
+    def stop_front_end_pipeline(self):
+        for stage in self.pipeline_stages:
+            stage.stop()
+        self.result_buf.close()
+
+
+    def wait_for_frame(self, timeout=None):
+        """ block until the front end hands over the next FrameResult. Returns None on timeout / shutdown """
+        return self.result_buf.pop(timeout)
+
+
+    def pipeline_stats_str(self):
+        return " | ".join([obj.stats_str() for obj in self.pipeline_bufs + self.pipeline_stages])
 
 
     def image_cb(self, msg):
         """
-        receive an image, process w/ NN, then set variables that the main function will access 
-        note: set the time variable at the end (this signals the program when new data has arrived)
+        receive an image, process w/ NN, then hand the result to the main function (see wait_for_frame)
+        With the pipelined front end this only queues the image for the preprocessing stage
         """
         tic = time.time()
-        my_time = get_ros_time(msg)   # timestamp in seconds of msg
+        frame = ImageFrame(msg, get_ros_time(msg))   # timestamp in seconds of msg
+        if instruments.enabled:
+            instruments.record('capture', rospy.get_time() - frame.img_time)  # image stamp to callback
+            instruments.count('images')
+        if self.b_pipeline_front_end:
+            self.capture_buf.push(frame)
+            return
 
         # if self.im_seg_mode == self.IGNORE:
         #     return
 
-        if len(self.ego_pose_rosmesg_buffer[0]) == 0:
+        if self.preprocess_frame(frame) is None:
             return # this happens if we are just starting
+        self.infer_and_handoff_frame(frame)
+        if self.verbose:
+            print("Image Callback time: {:.4f}".format(time.time() - tic))
 
-        t_fe_start = time.time()  # start timer for frontend
 
-        self.tf_w_ego = pose_to_tf(find_closest_by_time(my_time, self.ego_pose_rosmesg_buffer[1], self.ego_pose_rosmesg_buffer[0])[0])
-        self.tf_w_ego_gt = pose_to_tf(find_closest_by_time(my_time, self.ego_pose_rosmesg_buffer_gt[1], self.ego_pose_rosmesg_buffer_gt[0])[0])
+    def preprocess_frame(self, frame):
+        """ look up the ego pose at the image time, decode the image & undistort it """
+        if len(self.ego_pose_buffer) == 0:
+            return None # this happens if we are just starting
 
-        image = self.bridge.imgmsg_to_cv2(msg,desired_encoding="bgr8")
+        frame.stamps['fe_start'] = time.time()  # start timer for frontend
+        instruments.record('capture_wait', frame.stamps['fe_start'] - frame.stamps['capture'])
+        with instruments.span('pose_lookup'):
+            frame.tf_w_ego = self.ego_pose_buffer.get_tfs(frame.img_time)  # interpolated to the image time
+            frame.tf_w_ego_gt = self.ego_pose_buffer_gt.get_tfs(frame.img_time)
+
+        with instruments.span('decode'):
+            image = self.bridge.imgmsg_to_cv2(frame.msg,desired_encoding="bgr8")
+        frame.msg = None  # dont hold on to the raw image
         
         # undistort the fisheye effect in the image
         if self.camera is not None:
-            image = cv2.undistort(image, self.camera.K, self.camera.dist_coefs, None, self.camera.new_camera_matrix)
-        
-        self.latest_bb_method = self.im_seg.mode
+            if self.b_undistort_crops_only and self.im_seg is not None:
+                frame.undistort_rois = self.im_seg.track_rois(frame.img_time, self.roi_margin)
+                if frame.undistort_rois is not None:
+                    frame.raw_image = image  # in case the tracker needs more of the image by the time it runs
+            with instruments.span('undistort'):
+                image = self.camera.undistort(image, frame.undistort_rois)
+        frame.image = image
         if self.b_use_gt_detect_bb:
-            gt_bbs = self.get_gt_boxes()
-            self.im_process_output = self.im_seg.process_image(image,my_time,gt_bbs)
-        else:
-            self.im_process_output = self.im_seg.process_image(image,my_time)
-        self.front_end_time = time.time() - t_fe_start
+            frame.gt_bbs = self.get_gt_boxes(frame.tf_w_ego)
+        return frame
+
+
+    def infer_and_handoff_frame(self, frame):
+        """ run detection / tracking on a preprocessed frame & hand the result to the filter (main loop) """
+        if frame.undistort_rois is not None and not rois_contain(frame.undistort_rois, self.im_seg.track_rois(frame.img_time)):
+            # the tracker state changed since preprocessing (e.g. a detection is now due), undistort the whole image
+            with instruments.span('undistort'):
+                frame.image = self.camera.undistort(frame.raw_image)
+            self.num_crop_undistort_misses += 1
+        frame.raw_image = None
+        frame.bb_method = self.im_seg.mode
+        frame.im_process_output = self.im_seg.process_image(frame.image, frame.img_time, frame.gt_bbs)
+        frame.stamps['fe_done'] = time.time()
+        frame.image = None
+
+        front_end_time = frame.stamps['fe_done'] - frame.stamps['fe_start']
+        if self.b_pipeline_front_end:  # dont count the time spent waiting between stages
+            front_end_time -= frame.stamps['inference_start'] - frame.stamps['preprocess_done']
+        for tf_mat in (frame.tf_w_ego, frame.tf_w_ego_gt):
+            tf_mat.setflags(write=False)
+        self.tf_w_ego = frame.tf_w_ego
         self.num_imgs_processed += 1
-        self.latest_img_time = my_time  # DO THIS LAST
+        self.latest_img_time = frame.img_time
+        self.result_buf.push(FrameResult(frame.img_time, frame.tf_w_ego, frame.tf_w_ego_gt, frame.bb_method,
+                                         frame.im_process_output, front_end_time, dict(frame.stamps)))  # wakes the main function
         # self.img_seg_mode = self.IGNORE
-        if self.verbose:
-            print("Image Callback time: {:.4f}".format(time.time() - tic))
+        return frame
 
 
 
@@ -161,64 +312,18 @@ class ros_interface:
         Broadcast the estimated state of the filter. 
         State assumed to be a Nx1 numpy array of floats
         """
-        tracked_objects = []
-        for id in obj_ids:
-            obj = TrackedObject()
-            pose_msg = PoseStamped()
-            state_est = ukf_dict[id].mu
-            pose_msg.header.stamp = rospy.Time(ukf_dict[id].itr_time)
-            pose_msg.header.frame_id = 'world'
-            pose_msg.header.seq = np.uint32(ukf_dict[id].itr)
-            pose_msg.pose.position.x = state_est[0]
-            pose_msg.pose.position.y = state_est[1]
-            pose_msg.pose.position.z = state_est[2]
-            pose_msg.pose.orientation.w = state_est[6]
-            pose_msg.pose.orientation.x = state_est[7]
-            pose_msg.pose.orientation.y = state_est[8]
-            pose_msg.pose.orientation.z = state_est[9]
-
-            obj.pose = pose_msg
-            obj.class_str = ukf_dict[id].class_str
-
-            if self.b_pub_3d_bb_proj:
-                tmp = ukf_dict[id].projected_3d_bb
-                tmp = tmp.reshape((tmp.size, ))
-                obj.projected_3d_bb = tmp
-
-                if ukf_dict[id].connected_inds is not None:
-                    tmp = ukf_dict[id].connected_inds
-                    tmp = tmp.reshape((tmp.size, ))
-                    obj.connected_inds = tmp
-            obj.id = id
-
-            tracked_objects.append(obj)
-
-        self.state_pub.publish(tracked_objects)
+        self.state_pub.publish(make_filter_state_msg(obj_ids, ukf_dict, self.b_pub_3d_bb_proj))
 
 
     def publish_bb_msg(self,processed_image, bb_seg_mode, bb_ts):
         """
         publish custom message type for angled bounding box
         """
-        bb_list_msg = AngledBboxes()
-        header_stamp = rospy.Time.from_sec(bb_ts)
-        bb_list_msg.header.stamp = header_stamp
-        for obj_id, (bb, class_str,valid) in processed_image.items():
-            bb_msg = AngledBbox()
-            bb_msg.header.stamp = header_stamp
-            bb_msg.header.frame_id = '{}'.format(obj_id)  # this is an int defining which object this is
-            bb_msg.x = bb[0]
-            bb_msg.y = bb[1]
-            bb_msg.width = bb[2]
-            bb_msg.height = bb[3]
-            bb_msg.angle = bb[4]
-            bb_msg.im_seg_mode = bb_seg_mode
-            bb_msg.class_str = class_str
-            bb_msg.id = obj_id
-
-            bb_list_msg.boxes.append(bb_msg)
-
-        self.bb_data_pub.publish(bb_list_msg)
+        self.bb_data_pub.publish(make_bb_msg(processed_image, bb_seg_mode, bb_ts))
+
+    def publish_latency_stats(self, snapshot_str):
+        """ publish a json snapshot of the latency instruments (see instrumentation.StatsExporter) """
+        self.latency_stats_pub.publish(String(data=snapshot_str))
 
     def tracked_objects_poses_cb(self, msg, obj_name):
         self.latest_tracked_poses[obj_name] = msg.pose
@@ -239,14 +344,16 @@ class ros_interface:
         return pose
 
 
-    def get_gt_boxes(self):
+    def get_gt_boxes(self, tf_w_ego=None):
+        if tf_w_ego is None:
+            tf_w_ego = self.tf_w_ego
         gt_boxes = []
         for class_str, obj_names in self.objects_names_per_class.items():
             for obj_name in obj_names:
                 pose = pose_msg_to_array(self.latest_tracked_poses[obj_name])
                 tf_w_ado = quat_to_tf(pose[3:])
                 tf_w_ado[:3,3] = pose[:3]
-                proj_corners = pose_to_3d_bb_proj(tf_w_ado,self.tf_w_ego,self.bb_3d[class_str],self.camera)
+                proj_corners = pose_to_3d_bb_proj(tf_w_ado,tf_w_ego,self.bb_3d[class_str],self.camera)
                 (x,y,w,h) = corners_to_aligned_bb(proj_corners)
 
                 # Add 5% of size noise
@@ -13,6 +13,7 @@ import cv2
 # math
 import numpy as np
 import numpy.linalg as la
+from scipy.linalg import cho_solve
 
 import random
 # libs & utils
@@ -45,12 +46,15 @@ class UKF:
         self.b_enforce_z       = bool(self.ukf_prms['b_enforce_z'])
         self.b_enforce_0_pitch = bool(self.ukf_prms['b_enforce_0_pitch'])
         self.b_enforce_0_roll  = bool(self.ukf_prms['b_enforce_0_roll'])
+        self.b_sig_pnts_from_cols = bool(self.ukf_prms.get('b_sig_pnts_from_cols', False))  # spread the sigma points along the columns (not rows) of chol(sigma)
         kappa = float(self.ukf_prms['kappa'])
         self.w0 = kappa / (kappa + self.dim_sig)
         self.wi = 1 / (2 * (kappa + self.dim_sig))
         self.w_arr = np.ones((1+ 2 * self.dim_sig,)) * self.wi
         self.w_arr[0] = self.w0
         self.sig_pnt_multiplier = np.sqrt(self.dim_sig + kappa)
+        self.num_sps = 1 + 2 * self.dim_sig
+        self.pd_repair_counts = dict.fromkeys(PD_REPAIR_TIERS, 0)  # how often each tier of enforce_pos_def_sym_mat was needed
 
         self.init_filter_elements()
         
@@ -67,6 +71,57 @@ class UKF:
         
 
 
+    def set_obs_pred(self, mu_obs, S, S_chol=None, S_chol_inv=None):
+        """
+        Publish the step's predicted measurement & its covariance S_obs, w/ S_obs's lower cholesky factor & that
+        factor's inverse (None if S_obs is not pos. def.). These are computed here once per step & swapped in as one
+        tuple (self.obs_pred), so a reader on another thread (the front end's gating) that reads obs_pred once never
+        mixes the parts of two steps. S_chol & S_chol_inv can be passed in if already known
+        """
+        if S_chol is None:
+            try:
+                S_chol = la.cholesky(S)
+            except la.LinAlgError:
+                S_chol = None
+        if S_chol is not None and S_chol_inv is None:
+            S_chol_inv = la.inv(S_chol)
+        self.obs_pred = (mu_obs, S, S_chol, S_chol_inv)
+
+
+    @property
+    def mu_obs(self):
+        return self.obs_pred[0]
+
+
+    @property
+    def S_obs(self):
+        return self.obs_pred[1]
+
+
+    @property
+    def S_obs_chol(self):
+        """ lower cholesky factor of S_obs (raises la.LinAlgError if S_obs is not pos. def.) """
+        S_chol = self.obs_pred[2]
+        if S_chol is None:
+            raise la.LinAlgError("S_obs is not positive definite")
+        return S_chol
+
+
+    @property
+    def S_obs_chol_inv(self):
+        """ inverse of S_obs_chol, so the squared Mahalanobis distance of a measurement z is |S_obs_chol_inv @ (z - mu_obs)|^2 """
+        S_chol_inv = self.obs_pred[3]
+        if S_chol_inv is None:
+            raise la.LinAlgError("S_obs is not positive definite")
+        return S_chol_inv
+
+
+    @property
+    def S_obs_logdet(self):
+        """ log(det(S_obs)) from its cholesky factor """
+        return 2 * np.sum(np.log(np.diag(self.S_obs_chol)))
+
+
     def init_filter_elements(self, mu=None):
         self.last_dt = 0.03
         if self.ukf_prms is not None:
@@ -111,10 +166,10 @@ class UKF:
             dt = self.last_dt
         else:
             dt = self.itr_time - self.itr_time_prev
-        
+
         # line 2
         # Rescale noises based on dt
-        self.sigma = enforce_pos_def_sym_mat(self.sigma*(dt/self.last_dt))
+        sigma = enforce_pos_def_sym_mat(self.sigma*(dt/self.last_dt), counts=self.pd_repair_counts)  # (self.sigma is set at the end)
         self.Q = self.Q*(dt/self.last_dt)
         self.R = self.R*(dt/self.last_dt)
 
@@ -122,7 +177,7 @@ class UKF:
 
         b_outer_only = True
         tic0 = time.time()
-        sps = self.calc_sigma_points(self.mu, self.sigma)
+        sps = self.calc_sigma_points(self.mu, sigma)
         if not b_outer_only:
             print("calc sig pnts1: {:.4f}".format(time.time() - tic0))
 
@@ -150,17 +205,14 @@ class UKF:
         # lines 7-9
         if not b_outer_only:
             tic = time.time()
-        pred_meas = np.zeros((self.dim_meas, sps.shape[1]))
-        for sp_ind in range(sps.shape[1]):
-            pred_meas[:, sp_ind] = self.predict_measurement(sps_recalc[:, sp_ind], tf_ego_w, measurement=measurement)
+        pred_meas = self.predict_measurements(sps_recalc, tf_ego_w, measurement=measurement)
         if not b_outer_only:
             print("pred_meas: {:.4f}".format(time.time() - tic))
 
         if not b_outer_only:
             tic = time.time()
         z_hat, S, S_inv = self.extract_mean_and_cov_from_obs_sigma_points(pred_meas)
-        self.mu_obs = z_hat
-        self.S_obs = S
+        self.set_obs_pred(z_hat, S)
         if not b_outer_only:
             print("extract_mean_and_cov_from_OBS_sigma_points: {:.4f}".format(time.time() - tic))
 
@@ -191,15 +243,8 @@ class UKF:
 
     def update_state(self, z, mu_bar, sig_bar, S, S_inv, S_xz, z_hat):
         k = S_xz @ S_inv
-        innovation = k @ (z - z_hat)
-        if np.any(np.abs(innovation) > 2):
-            print("stop here")
-        mu_out = copy(mu_bar)
-        sigma_out = copy(sig_bar)
-        mu_out[0:6] += innovation[0:6]
-        mu_out[6:10] = enforce_quat_format(quat_mul(axang_to_quat(innovation[6:9]), mu_bar[6:10]))
-        mu_out[10:13] += innovation[9:12]
-
+        innovation = np.einsum('ij,j->i', k, z - z_hat)  # (not k @ ..., matrix-vector matmul rounds differently depending on the memory alignment)
+        mu_out = self.apply_innovation(mu_bar, innovation)
 
         # print("mu: {}".format(self.mu))
         # print("mu_out: {}".format(mu_out))
@@ -208,6 +253,19 @@ class UKF:
         # print("K: {}".format(k))
         # print("innovation: {}".format(innovation))
 
+        sigma_out = sig_bar - k @ S @ k.T
+        sigma_out = enforce_pos_def_sym_mat(sigma_out, counts=self.pd_repair_counts) # project sigma_out to pos. def. cone to avoid numeric issues
+
+        return mu_out, sigma_out
+
+
+    def apply_innovation(self, mu_bar, innovation):
+        """ add the (12 dim) innovation to the (13 dim) state & enforce the class's constraints """
+        mu_out = copy(mu_bar)
+        mu_out[0:6] += innovation[0:6]
+        mu_out[6:10] = enforce_quat_format(quat_mul(axang_to_quat(innovation[6:9]), mu_bar[6:10]))
+        mu_out[10:13] += innovation[9:12]
+
         if self.b_enforce_0_roll:
             mu_out[6:10] = remove_roll(mu_out[6:10])
         if self.b_enforce_0_pitch:
@@ -216,35 +274,22 @@ class UKF:
             mu_out[6:10] = remove_yaw(mu_out[6:10])
         if self.b_enforce_z:
             mu_out[2] = self.bb_3d[0,2]
-
-
-        sigma_out -=  k @ S @ k.T
-        sigma_out = enforce_pos_def_sym_mat(sigma_out) # project sigma_out to pos. def. cone to avoid numeric issues
-
-        return mu_out, sigma_out
+        return mu_out
 
 
     def calc_cross_correlation(self, sps, mu_bar, z_hat, pred_meas):
-        dim_covar = self.sigma.shape[0]
-        num_sps = sps.shape[1]
-        
         quat_ave_inv = quat_inv(mu_bar[6:10])
-        Wprime = np.zeros((dim_covar, num_sps))
-
-        idx_mu_not_q = list(np.arange(6)) + list(np.arange(10,13))
-        idx_sigma_not_q = list(np.arange(6)) + list(np.arange(9,12)) 
+        Wprime = np.zeros((self.dim_sig, self.num_sps))
 
-        Wprime[idx_sigma_not_q, :]= sps[idx_mu_not_q, :] - mu_bar[idx_mu_not_q].reshape(-1,1)
+        # slices [0:6] & [10:13] of the state line up w/ [0:6] & [9:12] of the covariance (all but the quaternion)
+        Wprime[0:6, :] = sps[0:6, :] - mu_bar[0:6, None]
+        Wprime[9:12, :] = sps[10:13, :] - mu_bar[10:13, None]
         q = sps[6:10, :]
         q_diff = quat_mul(q.T, quat_ave_inv)
-        axang_diff = quat_to_axang(q_diff)
-        Wprime[6:9, :] = axang_diff.T
-            
-        z_hat_2d = np.expand_dims(z_hat, axis=1)
+        quat_to_axang(q_diff, out=Wprime[6:9, :].T)
 
-        w_arr = np.ones(num_sps)*self.wi
-        w_arr[0] = self.w0
-        sigma_xz = w_arr * Wprime @ (pred_meas - z_hat_2d).T
+        pred_dev = np.subtract(pred_meas, z_hat[:, None], order='C')  # (pred_meas is a transposed view, C order so matmul rounds the same as the batched UKF)
+        sigma_xz = (self.w_arr * Wprime) @ pred_dev.T
 
         return sigma_xz
         
@@ -254,11 +299,11 @@ class UKF:
         z_hat = self.w0 * sps_meas[:, 0] + self.wi * np.sum(sps_meas[:, 1:], axis=1)
 
         # calculate covariance
-        z_hat_2d = np.expand_dims(z_hat, axis=1)
-        S = self.w_arr*(sps_meas - z_hat_2d) @ (sps_meas - z_hat_2d).T
+        pred_dev = np.subtract(sps_meas, z_hat[:, None], order='C')  # (see calc_cross_correlation)
+        S = (self.w_arr * pred_dev) @ pred_dev.T
 
         S += self.R  # add measurement noise
-        S = enforce_pos_def_sym_mat(S) # project S to pos. def. cone to avoid numeric issues
+        S = enforce_pos_def_sym_mat(S, counts=self.pd_repair_counts) # project S to pos. def. cone to avoid numeric issues
         S_inv = la.inv(S)
         return z_hat, S, S_inv
 
@@ -270,31 +315,35 @@ class UKF:
         bounding box seen by the ego drone 
         Pass in actual measurement to help resolve 90deg box rotation ambiguities 
         """
+        return self.predict_measurements(np.reshape(state, (self.dim_state, 1)), tf_ego_w, measurement)[:, 0]
 
-        # get relative transform from camera to quad
-        tf_w_ado = state_to_tf(state)
-        tf_cam_ado = self.camera.tf_cam_ego @ tf_ego_w @ tf_w_ado
 
-        # tranform 3d bounding box from quad frame to camera frame
-        bb_3d_cam = (tf_cam_ado @ self.bb_3d.T).T[:, 0:3]
+    def predict_measurements(self, states, tf_ego_w, measurement=None):
+        """
+        Vectorized predict_measurement for a 13 x n array of states (e.g. all the sigma points)
+        OUTPUT: 5 x n array of (col[x], row[y], width, height, angle[RADIANS])
+        """
+        tf_w_ados = states_to_tfs(states.T)
+        bb_rc = pose_to_3d_bb_proj_batch(tf_w_ados, inv_tf(tf_ego_w), self.bb_3d, self.camera)
+        output = verts_to_angled_bb_batch(bb_rc[:, :, ::-1], measurement)
+        return output.T
 
-        bb_rc_list = pose_to_3d_bb_proj(tf_w_ado, inv_tf(tf_ego_w), self.bb_3d, self.camera)
 
-        output = verts_to_angled_bb(np.fliplr(bb_rc_list), measurement)
-        return output
+    def calc_sigma_points(self, mu, sigma):
+        sigma_chol = la.cholesky(sigma)
+        return self.calc_sigma_points_from_sqrt(mu, sigma_chol if self.b_sig_pnts_from_cols else sigma_chol.T)
 
 
-    def calc_sigma_points(self, mu, sigma):
-        sps = np.zeros((self.dim_state, 2 * self.dim_sig + 1))
+    def calc_sigma_points_from_sqrt(self, mu, sigma_sqrt):
+        """ same as calc_sigma_points but the points are spread along the columns of sigma_sqrt """
+        sps = np.zeros((self.dim_state, self.num_sps))
         sps[:, 0] = mu
-        sig_step_p = self.sig_pnt_multiplier * la.cholesky(sigma).T
+        sig_step_p = self.sig_pnt_multiplier * sigma_sqrt
         sig_step_m = -sig_step_p
-        sig_step_all = np.stack((sig_step_p,sig_step_m),2).reshape(self.dim_sig,-1)
-        idx_mu_not_q = list(np.arange(6)) + list(np.arange(10,13))
-        idx_sigma_not_q = list(np.arange(6)) + list(np.arange(9,12)) 
+        sig_step_all = np.stack((sig_step_p,sig_step_m),2).reshape(self.dim_sig,-1)  # columns alternate +/- the scaled columns of sigma_sqrt
 
-
-        sps[idx_mu_not_q,1:] = mu[idx_mu_not_q].reshape(-1,1) + sig_step_all[idx_sigma_not_q,:]
+        sps[0:6, 1:] = mu[0:6, None] + sig_step_all[0:6, :]  # (see calc_cross_correlation for the slices)
+        sps[10:13, 1:] = mu[10:13, None] + sig_step_all[9:12, :]
         if self.b_enforce_0_yaw:
             sig_step_all[8, :] = 0
         if self.b_enforce_z:
@@ -302,7 +351,7 @@ class UKF:
 
         q_nom = mu[6:10]
         q_perturb = axang_to_quat(sig_step_all[6:9, :].T)
-        sps[6:10, 1:] = quat_mul(q_perturb, q_nom).T
+        quat_mul(q_perturb, q_nom, out=sps[6:10, 1:].T)
         return sps
     
     def propagate_dynamics(self, states, dt):
@@ -366,22 +415,25 @@ class UKF:
         return next_states
     
     def extract_mean_and_cov_from_state_sigma_points(self, sps):
+        mu_bar, Wprime = self.calc_state_mean_and_deviations(sps)
+
+        sig_bar = (self.w_arr * Wprime) @ Wprime.T
+        
+        sig_bar = enforce_pos_def_sym_mat(sig_bar + self.Q, counts=self.pd_repair_counts)  # add noise & project sig_bar to pos. def. cone to avoid numeric issues
+        return mu_bar, sig_bar
+
+
+    def calc_state_mean_and_deviations(self, sps):
+        """ weighted mean of the state sigma points and each point's deviation from it (12 x n, quat part as axis-angle) """
         mu_bar = self.w0 * sps[:, 0] + self.wi*np.sum(sps[:, 1:], 1)
         mu_bar[6:10], ei_vec_set = average_quaternions(sps[6:10, :].T, self.w_arr)
 
-        idx_mu_not_q = list(np.arange(6)) + list(np.arange(10,13))
-        idx_sigma_not_q = list(np.arange(6)) + list(np.arange(9,12)) 
-
-        Wprime = np.zeros((self.dim_sig, sps.shape[1]))
-        sig_bar = np.zeros((self.dim_sig, self.dim_sig))
+        Wprime = np.zeros((self.dim_sig, self.num_sps))
 
-        Wprime[idx_sigma_not_q, :] = sps[idx_mu_not_q, :] - mu_bar[idx_mu_not_q].reshape(-1,1)  # still need to overwrite the quat parts of this
+        Wprime[0:6, :] = sps[0:6, :] - mu_bar[0:6, None]  # (see calc_cross_correlation for the slices)
+        Wprime[9:12, :] = sps[10:13, :] - mu_bar[10:13, None]  # still need to overwrite the quat parts of this
         Wprime[6:9, :] = ei_vec_set
-
-        sig_bar = (self.w_arr * Wprime) @ Wprime.T
-        
-        sig_bar = enforce_pos_def_sym_mat(sig_bar + self.Q)  # add noise & project sig_bar to pos. def. cone to avoid numeric issues
-        return mu_bar, sig_bar
+        return mu_bar, Wprime
 
 
     def approx_pose_from_bb(self,bb,tf_w_ego):
@@ -428,3 +480,351 @@ class UKF:
         self.init_filter_elements(mu)
 
 
+
+
+class SRUKF(UKF):
+    """
+    Square-root version of the UKF. Instead of sigma it carries its lower triangular cholesky factor (sigma_sqrt),
+    which is updated with QR decompositions and rank 1 downdates. This means there are no per-step cholesky
+    factorizations and no projections back onto the pos. def. cone. Only if a downdate numerically loses pos.
+    definiteness is the full covariance repaired & re-factorized instead (counted in num_downdate_fallbacks, this
+    should stay at ~0 out of num_downdates). Turned on per class with b_sqrt_ukf in the category params yaml.
+    self.sigma is still kept up to date for anything reading it from outside the filter. The sigma points are always
+    spread along the columns of sigma_sqrt (as if b_sig_pnts_from_cols were set), so they are no longer the same as
+    the default UKF's.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.num_downdates = 0  # measurement updates done w/ rank 1 downdates
+        self.num_downdate_fallbacks = 0  # ... that fell back to repairing the full covariance
+        super().__init__(*args, **kwargs)
+        self.b_sig_pnts_from_cols = True  # (the only square root the filter carries)
+
+
+    def init_filter_elements(self, mu=None):
+        super().init_filter_elements(mu)
+        self.sigma_sqrt = la.cholesky(enforce_pos_def_sym_mat(self.sigma, counts=self.pd_repair_counts))
+        self.Q_sqrt = psd_sqrt(self.Q)  # the noise factors dont need to be triangular
+        self.R_sqrt = psd_sqrt(self.R)
+
+
+    def step_ukf(self, measurement, tf_ego_w, itr_time):
+        """
+        Square-root UKF iteration (same steps as UKF.step_ukf)
+        """
+        tic0 = time.time()
+        # Calculate dt based on current and previous iteration times
+        self.itr_time = itr_time
+        if self.itr_time == self.itr_time_prev: # first run through
+            dt = self.last_dt
+        else:
+            dt = self.itr_time - self.itr_time_prev
+        
+        # Rescale noises based on dt (the factors scale by the square root)
+        sqrt_scale = np.sqrt(dt/self.last_dt)
+        self.sigma_sqrt = self.sigma_sqrt*sqrt_scale
+        self.Q = self.Q*(dt/self.last_dt)
+        self.R = self.R*(dt/self.last_dt)
+        self.Q_sqrt = self.Q_sqrt*sqrt_scale
+        self.R_sqrt = self.R_sqrt*sqrt_scale
+        self.last_dt = dt  # store previous dt
+
+        sps = self.calc_sigma_points_from_sqrt(self.mu, self.sigma_sqrt)
+        sps_prop = self.propagate_dynamics(sps, dt)
+        mu_bar, Wprime = self.calc_state_mean_and_deviations(sps_prop)
+        sig_bar_sqrt = cov_sqrt_from_deviations(Wprime, self.w_arr, self.Q_sqrt)
+        sps_recalc = self.calc_sigma_points_from_sqrt(mu_bar, sig_bar_sqrt)
+
+        pred_meas = self.predict_measurements(sps_recalc, tf_ego_w, measurement=measurement)
+        z_hat = self.w0 * pred_meas[:, 0] + self.wi * np.sum(pred_meas[:, 1:], axis=1)
+        S_sqrt = cov_sqrt_from_deviations(pred_meas - z_hat.reshape(-1, 1), self.w_arr, self.R_sqrt)
+        S_xz = self.calc_cross_correlation(sps_recalc, mu_bar, z_hat, pred_meas)
+
+        mu_out, sigma_sqrt_out = self.update_state_sqrt(measurement, mu_bar, sig_bar_sqrt, S_sqrt, S_xz, z_hat)
+
+        self.set_obs_pred(z_hat, S_sqrt @ S_sqrt.T, S_chol=S_sqrt)  # (S_sqrt is already the cholesky factor)
+        self.mu = mu_out
+        self.sigma_sqrt = sigma_sqrt_out
+        self.sigma = sigma_sqrt_out @ sigma_sqrt_out.T
+
+        self.itr += 1
+        self.itr_time_prev = self.itr_time
+        if self.verbose:
+            print("TOTAL time (no prints): {:.4f}".format(time.time() - tic0))
+
+
+    def update_state_sqrt(self, z, mu_bar, sig_bar_sqrt, S_sqrt, S_xz, z_hat):
+        k = cho_solve((S_sqrt, True), S_xz.T).T  # S_xz @ inv(S)
+        innovation = k @ (z - z_hat)
+        mu_out = self.apply_innovation(mu_bar, innovation)
+
+        # sigma_out = sig_bar - k @ S @ k.T, i.e. one rank 1 downdate per column of k @ S_sqrt
+        U = k @ S_sqrt
+        sigma_sqrt_out = sig_bar_sqrt
+        self.num_downdates += 1
+        try:
+            for u in U.T:
+                sigma_sqrt_out = chol_rank1_update(sigma_sqrt_out, u, sign=-1)
+        except la.LinAlgError:
+            # numerically lost pos. definiteness, fall back to repairing the full covariance
+            self.num_downdate_fallbacks += 1
+            sigma_out = enforce_pos_def_sym_mat(sig_bar_sqrt @ sig_bar_sqrt.T - U @ U.T, counts=self.pd_repair_counts)
+            sigma_sqrt_out = la.cholesky(sigma_out)
+        return mu_out, sigma_sqrt_out
+
+
+
+
+class BatchedUKF:
+    """
+    Steps a set of UKF objects together in one vectorized call. Each UKF still owns its own state (mu, sigma, Q, R,
+    timing info) so the rest of the pipeline does not change, but the filter math is done on stacked arrays of
+    shape (N, ...) where N is the number of objects being stepped. The math is done in the same order (& w/ the same
+    memory layouts) as step_ukf, so the results are bit for bit the same as stepping each object on its own (checked
+    for every class by benchmarks/batched_ukf_equivalence.py).
+    This removes the per-object python overhead, not the per-object work: the step time still grows linearly w/ N,
+    just w/ a smaller slope. The measurement model (a cv2.minAreaRect per sigma point, see
+    min_area_rect_corners_batch) is the part that does not vectorize. W/ a single object it is slower than step_ukf.
+    """
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.dim_state = 13
+        self.dim_sig = 12  # covariance is 1 less dimension due to quaternion
+        self.dim_meas = 5  # angled bounding box: row, col, width, height, angle
+        self.num_sps = 2 * self.dim_sig + 1
+        self.idx_mu_not_q = np.array(list(np.arange(6)) + list(np.arange(10,13)))
+        self.idx_sigma_not_q = np.array(list(np.arange(6)) + list(np.arange(9,12)))
+
+
+    def step_ukfs(self, ukfs, measurements, tf_ego_w, itr_time):
+        """
+        UKF iteration following pseudo code from probablistic robotics, done for all ukfs at once
+        ukfs: list of N UKF objects, measurements: list of N angled bounding boxes (one per ukf)
+        """
+        if len(ukfs) == 0:
+            return
+        if any(isinstance(ukf, SRUKF) for ukf in ukfs):
+            raise RuntimeError("BatchedUKF cannot step SRUKF objects, step them with their own step_ukf")
+        tic0 = time.time()
+
+        # Stack the per-object parameters & state
+        w0 = np.array([ukf.w0 for ukf in ukfs])
+        wi = np.array([ukf.wi for ukf in ukfs])
+        w_arr = np.stack([ukf.w_arr for ukf in ukfs])
+        sig_pnt_multiplier = np.array([ukf.sig_pnt_multiplier for ukf in ukfs])
+        b_sig_pnts_from_cols = np.array([ukf.b_sig_pnts_from_cols for ukf in ukfs])
+        b_person = np.array([ukf.class_str.lower() == 'person' for ukf in ukfs])
+        b_enforce_0_rpy = np.array([[ukf.b_enforce_0_roll, ukf.b_enforce_0_pitch, ukf.b_enforce_0_yaw] for ukf in ukfs])
+        b_enforce_z = np.array([ukf.b_enforce_z for ukf in ukfs])
+        fixed_z = np.array([ukf.bb_3d[0,2] for ukf in ukfs])
+        mu = np.stack([ukf.mu for ukf in ukfs])
+        sigma = np.stack([ukf.sigma for ukf in ukfs])
+        Q = np.stack([ukf.Q for ukf in ukfs])
+        R = np.stack([ukf.R for ukf in ukfs])
+        z = np.stack(measurements)
+        pd_counts = [ukf.pd_repair_counts for ukf in ukfs]
+
+        # Calculate dt based on current and previous iteration times
+        last_dt = np.array([ukf.last_dt for ukf in ukfs])
+        itr_time_prev = np.array([ukf.itr_time_prev for ukf in ukfs])
+        dt = np.where(itr_time_prev == itr_time, last_dt, itr_time - itr_time_prev)  # last_dt is used on the first run through
+
+        # line 2
+        # Rescale noises based on dt
+        dt_scale = (dt / last_dt).reshape(-1, 1, 1)
+        sigma = enforce_pos_def_sym_mat_batch(sigma * dt_scale, counts=pd_counts)
+        Q = Q * dt_scale
+        R = R * dt_scale
+
+        sps = self.calc_sigma_points(mu, sigma, sig_pnt_multiplier, b_sig_pnts_from_cols, b_enforce_0_rpy[:, 2])
+
+        # line 3
+        sps_prop = self.propagate_dynamics(sps, dt, b_person, b_enforce_0_rpy)
+
+        # lines 4 & 5
+        mu_bar, sig_bar = self.extract_mean_and_cov_from_state_sigma_points(sps_prop, w0, wi, w_arr, Q, pd_counts)
+
+        # line 6
+        sps_recalc = self.calc_sigma_points(mu_bar, sig_bar, sig_pnt_multiplier, b_sig_pnts_from_cols, b_enforce_0_rpy[:, 2])
+
+        # lines 7-9
+        pred_meas = self.predict_measurements(ukfs, sps_recalc, tf_ego_w, z)
+
+        z_hat, S, S_inv = self.extract_mean_and_cov_from_obs_sigma_points(pred_meas, w0, wi, w_arr, R, pd_counts)
+
+        # line 10
+        S_xz = self.calc_cross_correlation(sps_recalc, mu_bar, z_hat, pred_meas, w_arr)
+
+        # lines 11-13
+        mu_out, sigma_out = self.update_state(z, mu_bar, sig_bar, S, S_inv, S_xz, z_hat, b_enforce_0_rpy, b_enforce_z, fixed_z, pd_counts)
+
+        # factor all the S_obs at once (if one is not pos. def. set_obs_pred factors them one at a time)
+        try:
+            S_chol = la.cholesky(S)
+            S_chol_inv = la.inv(S_chol)
+        except la.LinAlgError:
+            S_chol, S_chol_inv = [None] * len(ukfs), [None] * len(ukfs)
+
+        # Write the results back to each object
+        for n, ukf in enumerate(ukfs):
+            ukf.itr_time = itr_time
+            ukf.last_dt = dt[n]
+            ukf.Q = Q[n]
+            ukf.R = R[n]
+            ukf.set_obs_pred(z_hat[n], S[n], S_chol[n], S_chol_inv[n])
+            ukf.mu = mu_out[n]
+            ukf.sigma = sigma_out[n]
+            ukf.itr += 1
+            ukf.itr_time_prev = itr_time
+
+        if self.verbose:
+            print("TOTAL batched time for {} objects (no prints): {:.4f}".format(len(ukfs), time.time() - tic0))
+
+
+    def predict_measurements(self, ukfs, sps, tf_ego_w, measurements):
+        """
+        Predict the angled bb of every sigma point of every ukf. sps is N x 13 x M, output is N x 5 x M.
+        Objects that share a camera and have the same number of bounding box vertices are projected together
+        """
+        N, _, M = sps.shape
+        pred_meas = np.zeros((N, M, self.dim_meas))  # (returned as a N x 5 x M view, the same memory layout as UKF's)
+        groups = {}
+        for n, ukf in enumerate(ukfs):
+            groups.setdefault((id(ukf.camera), ukf.bb_3d.shape[0]), []).append(n)
+        for inds in groups.values():
+            camera = ukfs[inds[0]].camera
+            states = sps[inds].transpose(0, 2, 1).reshape(-1, self.dim_state)  # (len(inds) * M) x 13
+            verts = np.repeat(np.stack([ukfs[n].bb_3d for n in inds]), M, axis=0)
+            bb_rc = pose_to_3d_bb_proj_batch(states_to_tfs(states), inv_tf(tf_ego_w), verts, camera)
+            output = verts_to_angled_bb_batch(bb_rc[:, :, ::-1], np.repeat(measurements[inds], M, axis=0))
+            pred_meas[inds] = output.reshape(len(inds), M, self.dim_meas)
+        return np.swapaxes(pred_meas, 1, 2)
+
+
+    def update_state(self, z, mu_bar, sig_bar, S, S_inv, S_xz, z_hat, b_enforce_0_rpy, b_enforce_z, fixed_z, pd_counts=None):
+        k = S_xz @ S_inv
+        innovation = np.einsum('nij,nj->ni', k, z - z_hat)  # (see UKF.update_state)
+        mu_out = copy(mu_bar)
+        mu_out[:, 0:6] += innovation[:, 0:6]
+        mu_out[:, 6:10] = enforce_quat_format(quat_mul(axang_to_quat(innovation[:, 6:9]), mu_bar[:, 6:10]))
+        mu_out[:, 10:13] += innovation[:, 9:12]
+
+        for i, remove_ang in enumerate([remove_roll, remove_pitch, remove_yaw]):
+            b_enforce = b_enforce_0_rpy[:, i]
+            if np.any(b_enforce):
+                mu_out[b_enforce, 6:10] = remove_ang(mu_out[b_enforce, 6:10])
+        mu_out[b_enforce_z, 2] = fixed_z[b_enforce_z]
+
+        sigma_out = sig_bar - k @ S @ np.swapaxes(k, 1, 2)
+        sigma_out = enforce_pos_def_sym_mat_batch(sigma_out, counts=pd_counts) # project sigma_out to pos. def. cone to avoid numeric issues
+
+        return mu_out, sigma_out
+
+
+    def calc_cross_correlation(self, sps, mu_bar, z_hat, pred_meas, w_arr):
+        num_obj = sps.shape[0]
+
+        quat_ave = mu_bar[:, 6:10]
+        quat_ave_inv = quat_inv(quat_ave)
+        Wprime = np.zeros((num_obj, self.dim_sig, self.num_sps))
+
+        Wprime[:, self.idx_sigma_not_q, :] = sps[:, self.idx_mu_not_q, :] - mu_bar[:, self.idx_mu_not_q, None]
+        q = np.swapaxes(sps[:, 6:10, :], 1, 2).reshape(-1, 4)
+        q_diff = quat_mul(q, np.repeat(quat_ave_inv, self.num_sps, axis=0))  # (not out=q, q can be a view of sps)
+        axang_diff = quat_to_axang(q_diff).reshape(num_obj, self.num_sps, 3)
+        Wprime[:, 6:9, :] = np.swapaxes(axang_diff, 1, 2)
+
+        pred_dev = np.subtract(pred_meas, z_hat[:, :, None], order='C')  # (C order like UKF's, so matmul rounds the same)
+        sigma_xz = (w_arr[:, None, :] * Wprime) @ np.swapaxes(pred_dev, 1, 2)
+
+        return sigma_xz
+
+
+    def extract_mean_and_cov_from_obs_sigma_points(self, sps_meas, w0, wi, w_arr, R, pd_counts=None):
+        # calculate mean
+        z_hat = np.sum(sps_meas[:, :, 1:], axis=2)
+        z_hat *= wi[:, None]
+        z_hat += w0[:, None] * sps_meas[:, :, 0]
+
+        # calculate covariance
+        z_diff = sps_meas - z_hat[:, :, None]
+        S = (w_arr[:, None, :] * z_diff) @ np.swapaxes(z_diff, 1, 2)
+
+        S += R  # add measurement noise
+        S = enforce_pos_def_sym_mat_batch(S, counts=pd_counts) # project S to pos. def. cone to avoid numeric issues
+        S_inv = la.inv(S)
+        return z_hat, S, S_inv
+
+
+    def calc_sigma_points(self, mu, sigma, sig_pnt_multiplier, b_sig_pnts_from_cols, b_enforce_0_yaw):
+        num_obj = mu.shape[0]
+        sps = np.zeros((num_obj, self.dim_state, self.num_sps))
+        sps[:, :, 0] = mu
+        sigma_chol = la.cholesky(sigma)
+        sigma_sqrt = np.where(b_sig_pnts_from_cols[:, None, None], sigma_chol, np.swapaxes(sigma_chol, 1, 2))  # (see UKF.calc_sigma_points)
+        sig_step_p = sig_pnt_multiplier.reshape(-1, 1, 1) * sigma_sqrt
+        sig_step_m = -sig_step_p
+        sig_step_all = np.stack((sig_step_p, sig_step_m), 3).reshape(num_obj, self.dim_sig, -1)
+
+        sps[:, self.idx_mu_not_q, 1:] = mu[:, self.idx_mu_not_q, None] + sig_step_all[:, self.idx_sigma_not_q, :]
+        sig_step_all[b_enforce_0_yaw, 8, :] = 0
+
+        q_nom = np.repeat(mu[:, 6:10], self.num_sps - 1, axis=0)
+        q_perturb = axang_to_quat(np.swapaxes(sig_step_all[:, 6:9, :], 1, 2).reshape(-1, 3))
+        sps[:, 6:10, 1:] = np.swapaxes(quat_mul(q_perturb, q_nom).reshape(num_obj, -1, 4), 1, 2)
+        return sps
+
+
+    def propagate_dynamics(self, states, dt, b_person, b_enforce_0_rpy):
+        """
+        Estimate the next state vector for every object. Assumes no control input (velocities stay the same)
+        states are N x 13 x n, dt is N (one per object)
+        """
+        num_obj, _, num_sps = states.shape
+        next_states = copy(states)
+
+        # General point mass model
+        # update position
+        if np.any(b_person):
+            # People on on the ground - no z update, projected on heading vector
+            yaw_angs = quat_to_ang(np.swapaxes(states[b_person, 6:10, :], 1, 2).reshape(-1, 4))[:, 2].reshape(-1, num_sps)
+            heading_vecs = np.stack((np.cos(yaw_angs), np.sin(yaw_angs)), axis=1)
+            next_states[b_person, 0:2, :] += dt[b_person, None, None] * np.sum(heading_vecs * states[b_person, 3:5, :], axis=1, keepdims=True) * heading_vecs
+        b_not_person = np.logical_not(b_person)
+        next_states[b_not_person, 0:3, :] += dt[b_not_person, None, None] * states[b_not_person, 3:6, :]
+
+        # update orientation
+        quat = np.swapaxes(states[:, 6:10, :], 1, 2).reshape(-1, 4)  # current orientation
+        omegas = states[:, 10:13, :]  # angular velocity vector
+        om_norm = la.norm(omegas, axis=1)  # rate of change of all angles
+        om_norm[om_norm == 0] = 1
+        ang = om_norm * dt[:, None]  # change in angle in this small timestep
+        ax = omegas / om_norm[:, None, :]  # axis about angle change
+        quat_delta = axang_to_quat(np.swapaxes(ax * ang[:, None, :], 1, 2).reshape(-1, 3))
+        quat_new = quat_mul(quat_delta, quat).reshape(num_obj, num_sps, 4)
+
+        next_states[:, 6:10, :] = np.swapaxes(quat_new, 1, 2)
+
+        for i, remove_ang in enumerate([remove_roll, remove_pitch, remove_yaw]):
+            b_enforce = b_enforce_0_rpy[:, i]
+            if np.any(b_enforce):
+                next_states[b_enforce, 6:10, :] = np.swapaxes(remove_ang(quat_new[b_enforce]).reshape(-1, num_sps, 4), 1, 2)
+
+        return next_states
+
+
+    def extract_mean_and_cov_from_state_sigma_points(self, sps, w0, wi, w_arr, Q, pd_counts=None):
+        mu_bar = np.sum(sps[:, :, 1:], axis=2)
+        mu_bar *= wi[:, None]
+        mu_bar += w0[:, None] * sps[:, :, 0]
+        mu_bar[:, 6:10], ei_vec_set = average_quaternions_batch(np.swapaxes(sps[:, 6:10, :], 1, 2), w_arr)
+
+        Wprime = np.zeros((sps.shape[0], self.dim_sig, self.num_sps))
+        Wprime[:, self.idx_sigma_not_q, :] = sps[:, self.idx_mu_not_q, :] - mu_bar[:, self.idx_mu_not_q, None]  # still need to overwrite the quat parts of this
+        Wprime[:, 6:9, :] = ei_vec_set
+
+        sig_bar = (w_arr[:, None, :] * Wprime) @ np.swapaxes(Wprime, 1, 2)
+
+        sig_bar = enforce_pos_def_sym_mat_batch(sig_bar + Q, counts=pd_counts)  # add noise & project sig_bar to pos. def. cone to avoid numeric issues
+        return mu_bar, sig_bar
@@ -0,0 +1,93 @@
+####### DATA ASSOCIATION #######
+# Matching new measurements (e.g. detections) to tracked objects: the gated Mahalanobis cost of every
+# measurement / track pair in one vectorized pass, then the min total cost assignment (Hungarian algorithm).
+# IMPORTS
+# math
+import numpy as np
+import numpy.linalg as la
+from scipy.optimize import linear_sum_assignment
+
+
+def chol_inv_batch(S):
+    """
+    inverse of the lower cholesky factor of each k x m x m covariance in S (so d^2 = |L_inv @ diff|^2).
+    Covariances that are not positive definite get nans (any distance to them is nan, i.e. never inside a gate)
+    """
+    S = np.asarray(S)
+    L_inv = np.full(S.shape, np.nan)
+    try:
+        L_inv[:] = la.inv(la.cholesky(S))
+    except la.LinAlgError:  # factor them one at a time to find the bad one(s)
+        for i in range(S.shape[0]):
+            try:
+                L_inv[i] = la.inv(la.cholesky(S[i]))
+            except la.LinAlgError:
+                pass
+    return L_inv
+
+
+def mahalanobis_cost_matrix(meas, means, L_inv):
+    """
+    squared Mahalanobis distance of each of n measurements (n x m) to each of k tracks' predicted measurements
+    (means, k x m), w/ the inverse cholesky factors of the tracks' measurement covariances (L_inv, k x m x m,
+    see chol_inv_batch). Returns n x k
+    """
+    diff = np.asarray(meas)[:, None, :] - np.asarray(means)[None, :, :]
+    y = np.einsum('kij,nkj->nki', L_inv, diff)
+    return np.einsum('nki,nki->nk', y, y)
+
+
+def obs_pred_batch(ukfs):
+    """
+    stacked predicted measurements (k x m) & S_obs_chol_inv (k x m x m) of the ukfs, from the factors each filter
+    computes once per step (UKF.set_obs_pred) no matter how many times it is gated against. Each filter's obs_pred is
+    read once, so a step finishing meanwhile cannot mix two steps. Filters whose S_obs is not pos. def. get nans
+    (never inside a gate)
+    """
+    preds = [ukf.obs_pred for ukf in ukfs]
+    means = np.array([pred[0] for pred in preds])
+    L_inv = np.full((len(preds),) + preds[0][1].shape, np.nan)
+    for i, pred in enumerate(preds):
+        if pred[3] is not None:
+            L_inv[i] = pred[3]
+    return means, L_inv
+
+
+def mahalanobis_dist_sq(meas, ukfs):
+    """ squared Mahalanobis distance of each of n measurements (n x m) to each ukf's predicted measurement (mu_obs). Returns n x k """
+    if len(meas) == 0 or len(ukfs) == 0:
+        return np.zeros((len(meas), len(ukfs)))
+    return mahalanobis_cost_matrix(meas, *obs_pred_batch(ukfs))
+
+
+def assign(cost, gate):
+    """
+    min total cost assignment of rows (measurements) to columns (tracks). Pairs w/ cost >= gate (or nan) are
+    never matched. Returns (matches as a list of (row, col), unmatched rows, unmatched cols)
+    """
+    n, k = cost.shape
+    if n == 0 or k == 0:
+        return [], list(range(n)), list(range(k))
+    b_allowed = cost < gate  # (false for nan)
+    # disallowed pairs cost more than any set of allowed ones, so as many allowed pairs as possible are matched
+    big = 1 + np.sum(cost[b_allowed]) if np.any(b_allowed) else 1.
+    rows, cols = linear_sum_assignment(np.where(b_allowed, cost, big))
+    matches = [(r, c) for r, c in zip(rows, cols) if b_allowed[r, c]]
+    matched_rows = set(r for r, _ in matches)
+    matched_cols = set(c for _, c in matches)
+    return matches, [r for r in range(n) if r not in matched_rows], [c for c in range(k) if c not in matched_cols]
+
+
+def associate(meas, means, S, gate):
+    """
+    match measurements (n x m) to tracks w/ predicted measurements means (k x m) & measurement covariances S
+    (k x m x m), gating on the squared Mahalanobis distance. Returns (matches, unmatched measurements, unmatched tracks)
+    """
+    if len(meas) == 0 or len(means) == 0:
+        return [], list(range(len(meas))), list(range(len(means)))
+    return assign(mahalanobis_cost_matrix(meas, means, chol_inv_batch(S)), gate)
+
+
+def associate_ukfs(meas, ukfs, gate):
+    """ associate w/ the predicted measurements & cached innovation covariance factors of ukfs """
+    return assign(mahalanobis_dist_sq(meas, ukfs), gate)
@@ -0,0 +1,42 @@
+####### IMAGE UTILITIES #######
+# Undistorting images with lookup tables that are built once per camera (cv2.undistort rebuilds them every call),
+# optionally only in some regions of interest (rois) given as (row_min, row_max, col_min, col_max)
+# IMPORTS
+# math
+import numpy as np
+# opencv
+import cv2
+
+
+def init_undistort_maps(K, dist_coefs, new_camera_matrix, im_width, im_height):
+    """ lookup tables for undistort_image, in opencv's fixed point format (faster to remap with than float maps) """
+    return cv2.initUndistortRectifyMap(K, dist_coefs, None, new_camera_matrix, (im_width, im_height), cv2.CV_16SC2)
+
+
+def clip_roi(roi, im_width, im_height):
+    """ roi (row_min, row_max, col_min, col_max) as ints inside the image. Can be empty """
+    return (max(int(roi[0]), 0), min(int(roi[1]), im_height), max(int(roi[2]), 0), min(int(roi[3]), im_width))
+
+
+def undistort_image(image, maps, rois=None):
+    """
+    same result as cv2.undistort w/ the tables the maps were made with.
+    If rois is given only these regions are undistorted, the rest of the returned image is left distorted
+    """
+    map1, map2 = maps
+    if rois is None:
+        return cv2.remap(image, map1, map2, cv2.INTER_LINEAR)
+    image_out = np.copy(image)
+    for roi in rois:
+        r0, r1, c0, c1 = clip_roi(roi, map1.shape[1], map1.shape[0])
+        if r1 <= r0 or c1 <= c0:
+            continue
+        image_out[r0:r1, c0:c1] = cv2.remap(image, map1[r0:r1, c0:c1], map2[r0:r1, c0:c1], cv2.INTER_LINEAR)
+    return image_out
+
+
+def rois_contain(rois, inner_rois):
+    """ True if every region in inner_rois is inside one of the regions in rois (None means the whole image) """
+    if inner_rois is None:
+        return False
+    return all(any(r[0] <= ir[0] and ir[1] <= r[1] and r[2] <= ir[2] and ir[3] <= r[3] for r in rois) for ir in inner_rois)
@@ -0,0 +1,249 @@
+####### INSTRUMENTATION #######
+# Named latency spans & counters for the pipeline stages (capture -> undistort -> detect/track -> gating -> ukf -> publish).
+# Span durations go into fixed size log-bucketed (HDR style) histograms, so memory doesn't grow w/ run time & the
+# p50/p95/p99/max can be read at any point. Everything is a no-op until enable() is called.
+# usage:
+#   from utils_msl_raptor.instrumentation import instruments
+#   with instruments.span('undistort'):
+#       ...
+#   instruments.count('track_rejections')
+# IMPORTS
+# system
+import math
+import threading
+import time
+import json
+
+SPAN_PERCENTILES = (50, 95, 99)
+
+
+class LatencyHistogram:
+    """
+    Fixed memory histogram of durations [s]. Buckets are spaced by powers of 2, each split into sub_buckets linear
+    bins, so a value is known to within ~1/sub_buckets of itself (1.6% w/ 64) from min_value up to max_value.
+    Values outside the range go in the first / last bucket (the exact min & max are kept separately).
+    """
+
+    def __init__(self, min_value=1e-7, max_value=1e3, sub_buckets=64):
+        if not 0 < min_value < max_value:
+            raise RuntimeError("LatencyHistogram needs 0 < min_value < max_value (got {} & {})".format(min_value, max_value))
+        self.sub_buckets = sub_buckets
+        self.exp_min = math.frexp(min_value)[1]
+        self.num_buckets = (math.frexp(max_value)[1] - self.exp_min + 1) * sub_buckets
+        self.counts = [0] * self.num_buckets
+        self.reset()
+
+
+    def reset(self):
+        for i in range(self.num_buckets):
+            self.counts[i] = 0
+        self.count = 0
+        self.total = 0.
+        self.min = math.inf
+        self.max = 0.
+
+
+    def bucket_index(self, value):
+        if value <= 0:
+            return 0
+        mantissa, exp = math.frexp(value)  # value = mantissa * 2**exp, mantissa in [0.5, 1)
+        ind = (exp - self.exp_min) * self.sub_buckets + int((mantissa - 0.5) * 2 * self.sub_buckets)
+        return min(max(ind, 0), self.num_buckets - 1)
+
+
+    def bucket_value(self, ind):
+        """ middle of the bucket's range """
+        exp, sub = divmod(ind, self.sub_buckets)
+        return math.ldexp(0.5 + (sub + 0.5) / (2 * self.sub_buckets), exp + self.exp_min)
+
+
+    def record(self, value):
+        self.counts[self.bucket_index(value)] += 1
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+
+    def merge(self, other):
+        if other.num_buckets != self.num_buckets or other.exp_min != self.exp_min:
+            raise RuntimeError("Can only merge histograms w/ the same range & resolution")
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+
+    def percentile(self, p):
+        """ value below which p % of the recorded values are (None if nothing was recorded) """
+        if self.count == 0:
+            return None
+        rank = max(1, int(math.ceil(p / 100. * self.count)))
+        cum = 0
+        for ind, c in enumerate(self.counts):
+            cum += c
+            if cum >= rank:
+                return min(max(self.bucket_value(ind), self.min), self.max)
+        return self.max
+
+
+    def mean(self):
+        return self.total / self.count if self.count > 0 else None
+
+
+    def summary(self):
+        """ {'count', 'mean', 'p50', 'p95', 'p99', 'max'} w/ the times in seconds """
+        out = {'count': self.count, 'mean': self.mean()}
+        for p in SPAN_PERCENTILES:
+            out['p{}'.format(p)] = self.percentile(p)
+        out['max'] = self.max if self.count > 0 else None
+        return out
+
+
+class _Span:
+    __slots__ = ('instruments', 'name', 'tic')
+
+    def __init__(self, instruments, name):
+        self.instruments = instruments
+        self.name = name
+
+    def __enter__(self):
+        self.tic = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.instruments.record(self.name, time.perf_counter() - self.tic)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+
+class Instrumentation:
+    """
+    Registry of named span histograms & counters, safe to use from several threads. While disabled span() returns a
+    shared do-nothing context manager & record() / count() return right away, so the instrumented code pays for one
+    attribute lookup & call.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.histograms = {}  # key: span name, value: LatencyHistogram (in the order first recorded)
+        self.counters = {}
+        self.start_time = time.time()
+
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+
+    def span(self, name):
+        """ context manager recording the time spent in its block as the span name """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+
+    def record(self, name, duration):
+        """ add a duration [s] (e.g. the difference of two stamps) to the span name """
+        if not self.enabled:
+            return
+        with self.lock:
+            hist = self.histograms.get(name)
+            if hist is None:
+                hist = self.histograms[name] = LatencyHistogram()
+            hist.record(duration)
+
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+
+    def reset(self):
+        with self.lock:
+            for hist in self.histograms.values():
+                hist.reset()
+            for name in self.counters:
+                self.counters[name] = 0
+            self.start_time = time.time()
+
+
+    def snapshot(self):
+        """ {'time', 'duration', 'spans': {name: histogram summary}, 'counters': {name: count}} (times in seconds) """
+        with self.lock:
+            now = time.time()
+            return {'time': now, 'duration': now - self.start_time,
+                    'spans': {name: hist.summary() for name, hist in self.histograms.items()},
+                    'counters': dict(self.counters)}
+
+
+    def report_str(self, snapshot=None):
+        """ one line per span w/ its percentiles in ms, then the counters """
+        if snapshot is None:
+            snapshot = self.snapshot()
+        lines = []
+        for name, s in snapshot['spans'].items():
+            if s['count'] == 0:
+                continue
+            lines.append("{:<20s} n = {:<7d} mean = {:8.2f}  ".format(name, s['count'], 1000 * s['mean']) +
+                         "  ".join(["{} = {:8.2f}".format(k, 1000 * s[k]) for k in ['p{}'.format(p) for p in SPAN_PERCENTILES] + ['max']]) + "  [ms]")
+        if snapshot['counters']:
+            lines.append(", ".join(["{} = {}".format(name, c) for name, c in snapshot['counters'].items()]))
+        return "\n".join(lines)
+
+
+class StatsExporter:
+    """
+    Writes a snapshot of the instruments every period seconds: appended as one json line to file_path (if given) &
+    passed as a json string to publish_fn (if given, e.g. a ros publisher). maybe_export() is meant to be called
+    from a loop that already runs regularly (e.g. the main loop), so no extra thread is needed.
+    """
+
+    def __init__(self, instruments, period=5.0, file_path=None, publish_fn=None):
+        self.instruments = instruments
+        self.period = period
+        self.file_path = file_path
+        self.publish_fn = publish_fn
+        self.last_export_time = time.time()
+        self.num_exports = 0
+        if self.file_path:
+            open(self.file_path, 'w').close()  # (start w/ an empty file)
+
+
+    def maybe_export(self):
+        if not self.instruments.enabled or time.time() - self.last_export_time < self.period:
+            return False
+        self.export()
+        return True
+
+
+    def export(self):
+        self.last_export_time = time.time()
+        snapshot_str = json.dumps(self.instruments.snapshot())
+        if self.file_path:
+            with open(self.file_path, 'a') as f:
+                f.write(snapshot_str + '\n')
+        if self.publish_fn is not None:
+            self.publish_fn(snapshot_str)
+        self.num_exports += 1
+
+
+# shared by the whole process (like pd_repair_counts), so the stages don't need to pass it around
+instruments = Instrumentation()
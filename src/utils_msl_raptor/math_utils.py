@@ -8,101 +8,55 @@ import math
 import numpy as np
 import numpy.linalg as la
 import tf
-from scipy.spatial.transform import Rotation as R
-
-def enforce_quat_format(quat):
-    """
-    quat should have norm 1 and a positive first element (note orientation represented by q is same as -q)
-    input: nx4 array
-    """
-    quat = quat.reshape(-1,4)
-    unit_quat = quat / la.norm(quat,axis=1).reshape(-1,1)
-    s = np.sign(unit_quat[:,0])
-    # Not change the quaternion when the scalar is 0
-    s = ( s== 0) * 1 + s
-    unit_quat *= s.reshape(-1,1)
-    return unit_quat
+# quaternion kernels (numpy, [w, x, y, z] convention)
+try:
+    from utils_msl_raptor.quat_utils import enforce_quat_format, axang_to_quat, quat_to_axang, quat_inv, quat_mul, \
+                                            quat_to_ang, ang_to_quat, quat_to_rotm, rotm_to_quat, quat_slerp
+except ImportError:
+    from quat_utils import enforce_quat_format, axang_to_quat, quat_to_axang, quat_inv, quat_mul, \
+                           quat_to_ang, ang_to_quat, quat_to_rotm, rotm_to_quat, quat_slerp
 
 
-def axang_to_quat(axang):
+def quat_to_tf(quat):
     """ 
-    takes in an orientation in axis-angle form s.t. |axang| = ang, and 
-    axang/ang = unit vector about which the angle is rotated. Returns a quaternion
+    calculate the rotation matrix of a given quaternion (frames assumed to be consistant 
+    with the UKF state quaternion). First element of quat is the scalar.
     """
-    axang = axang.reshape(-1,3)
-    quat = np.roll(R.from_rotvec(axang).as_quat(),1,axis=1)
-    return enforce_quat_format(quat)
-
+    tf_out = np.eye(4)
+    tf_out[0:3, 0:3] = quat_to_rotm(quat)
+    return tf_out
 
-def quat_to_axang(quat):
-    """ 
-    takes in an orientation in axis-angle form s.t. |axang| = ang, and 
-    axang/ang = unit vector about which the angle is rotated. Returns a quaternion
-    """
-    return R.from_quat(np.roll(quat,3,axis=1)).as_rotvec()
 
+def poses_to_tfs(poses):
+    """ n x 7 array of poses [x,y,z,qw,qx,qy,qz] -> n x 4 x 4 transforms (tf_w_body for poses of bodies in the world) """
+    poses = np.reshape(np.asarray(poses, dtype=float), (-1, 7))
+    tfs = np.zeros((len(poses), 4, 4))
+    tfs[:, 0:3, 0:3] = quat_to_rotm(poses[:, 3:7])
+    tfs[:, 0:3, 3] = poses[:, 0:3]
+    tfs[:, 3, 3] = 1
+    return tfs
 
-def quat_inv(q):
-    """ technically this is the conjugate, for unit quats this is same as inverse """
-    q_inv = np.array(q, copy=True)
-    if q_inv[0] > 0:
-        q_inv[1:4] *= -1
-    else:
-        q_inv[0] *= -1
-    return q_inv
 
+STATE_POSE_INDS = [0, 1, 2, 6, 7, 8, 9]  # the [x,y,z,qw,qx,qy,qz] of a (ukf or logged) 13 element state
 
-def quat_mul(q, r):
-    """
-    multiply q by r. first element in quat is scalar value. Can be nx4 sized numpy arrays
-    """
-    q = q.reshape(-1,4)
-    r = r.reshape(-1,4)
-    vec = np.array([np.multiply(q[:,0],r[:,1]),np.multiply(q[:,0],r[:,2]),np.multiply(q[:,0],r[:,3])]).T + np.array([np.multiply(r[:,0],q[:,1]),np.multiply(r[:,0],q[:,2]),np.multiply(r[:,0],q[:,3])]).T + np.array([np.multiply(q[:,2],r[:,3])-np.multiply(q[:,3],r[:,2]),np.multiply(q[:,3],r[:,1])-np.multiply(q[:,1],r[:,3]),np.multiply(q[:,1],r[:,2])-np.multiply(q[:,2],r[:,1])] ).T
-    scalar = (np.multiply(q[:,0] ,r[:,0]) - np.sum(np.multiply(q[:,1:],r[:,1:]),axis=1)).reshape(-1,1)
-    qout = np.concatenate((scalar,vec),axis=1)
-    return enforce_quat_format(qout)
-
-def quat_to_ang(q, b_to_degrees=False):
-    """
-    Convert a quaternion to euler angles (ASSUMES 'XYZ')
-    """
-    unit_multiplier = 1
-    if b_to_degrees:
-        unit_multiplier = 180 / np.pi
-    return R.from_quat(np.roll(q,3,axis=1)).as_euler('XYZ') * unit_multiplier
 
-def ang_to_quat(angs):
-    """
-    Convert euler angles into a quaternion (ASSUMES 'XYZ')
-    """
-    return np.roll(R.from_euler('XYZ',angs).as_quat(),1,axis=1)
+def states_to_tfs(states):
+    """ returns a n x 4 x 4 stack of tf_w_quad given a n x 13 array of state vectors """
+    return poses_to_tfs(states[:, STATE_POSE_INDS])
 
 
-def quat_to_rotm(quat):
-    """ 
-    calculate the rotation matrix of a given quaternion (frames assumed to be consistant 
-    with the UKF state quaternion). First element of quat is the scalar.
+def interp_poses(poses0, poses1, alphas, out=None):
     """
-    return R.from_quat(np.roll(np.reshape(quat, (-1, 4)),3,axis=1)).as_dcm()
-
-
-def rotm_to_quat(rotm):
-    """ 
-    calculate the rotation matrix of a given quaternion (frames assumed to be consistant 
-    with the UKF state quaternion). First element of quat is the scalar.
-    """
-    return np.roll(R.from_dcm(rotm).as_quat(),1)
-
-
-def quat_to_tf(quat):
-    """ 
-    calculate the rotation matrix of a given quaternion (frames assumed to be consistant 
-    with the UKF state quaternion). First element of quat is the scalar.
+    poses ([x,y,z,qw,qx,qy,qz], n x 7) between poses0 (alpha = 0) & poses1 (alpha = 1): lerp for position, slerp
+    for orientation. alphas is a scalar or n array
     """
-    tf_out = np.eye(4)
-    tf_out[0:3, 0:3] = quat_to_rotm(quat)
-    return tf_out
+    poses0 = np.reshape(poses0, (-1, 7))
+    poses1 = np.reshape(poses1, (-1, 7))
+    alphas = np.reshape(alphas, (-1, 1))
+    out = np.empty((max(len(poses0), len(poses1), len(alphas)), 7)) if out is None else out
+    np.add(poses0[:, 0:3], alphas * (poses1[:, 0:3] - poses0[:, 0:3]), out=out[:, 0:3])
+    quat_slerp(poses0[:, 3:7], poses1[:, 3:7], alphas[:, 0], out=out[:, 3:7])
+    return out
     
 
 def average_quaternions(Q, w=None):
@@ -169,6 +123,31 @@ def average_quaternions(Q, w=None):
     return enforce_quat_format(q_mean), ei_vec_set
 
 
+def average_quaternions_batch(Q, w=None):
+    """
+    Batched version of average_quaternions. Q is a NxMx4 numpy array holding N independent sets of M quaternions (w,x,y,z)
+    and w is a NxM array of weights (one row per set). Returns the Nx4 average quaternions and the Nx3xM set of
+    differences from each quaternion to its set's mean (in ax-angle rep.)
+    """
+    N, M, _ = Q.shape
+    if w is None:
+        w = np.ones((N, M)) / M  # DEFAULT: equally weighted
+
+    A = np.einsum('nmi,nmo->nio', np.einsum('nm,nmi->nmi', w, Q), Q)  # (same operation order as average_quaternions)
+
+    # compute eigenvalues and -vectors, then keep the real part of the eigenvector with the largest eigenvalue
+    eigenValues, eigenVectors = la.eig(A)
+    q_mean = np.real(np.take_along_axis(eigenVectors, np.argmax(np.real(eigenValues), axis=1)[:, None, None], axis=2)[:, :, 0])
+    q_mean[q_mean[:, 0] < 0] *= -1
+
+    # inverse of each mean (see quat_inv)
+    q_mean_inv = np.where(q_mean[:, 0:1] > 0, q_mean * np.array([1, -1, -1, -1]), q_mean * np.array([-1, 1, 1, 1]))
+    ei_quat = quat_mul(Q.reshape(-1, 4), np.repeat(q_mean_inv, M, axis=0))
+    ei_vec_set = np.swapaxes(quat_to_axang(ei_quat).reshape(N, M, 3), 1, 2)
+
+    return enforce_quat_format(q_mean), ei_vec_set
+
+
 def inv_tf(tf_in):
     return tf.transformations.inverse_matrix(tf_in)
 
@@ -0,0 +1,159 @@
+####### PIPELINE UTILITIES #######
+# Bounded buffers & worker threads for running work (e.g. the image front end) as a pipeline of stages.
+# Each stage runs in its own thread, so the throughput is set by the slowest stage instead of the sum of all of them.
+# IMPORTS
+# system
+import threading
+import time
+import traceback
+from collections import deque
+
+# what a full buffer does with a new item
+DROP_OLDEST = 'drop_oldest'  # throw away the oldest item to make room (consumers always get the latest data)
+DROP_NEWEST = 'drop_newest'  # throw away the item being pushed
+BLOCK = 'block'  # the producer waits until there is room
+SPILL = 'spill'  # keep the item in an unbounded overflow list until there is room (nothing is lost, memory can grow)
+DROP_POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK, SPILL)
+
+
+class RingBuffer:
+    """
+    Fixed size, thread safe FIFO buffer. What happens when it is full is set by its drop policy.
+    pop() blocks until an item is available, the buffer is closed, or the timeout is reached.
+    """
+
+    def __init__(self, size, drop_policy=DROP_OLDEST, name='buffer'):
+        if size < 1:
+            raise RuntimeError("RingBuffer size must be at least 1 (got {})".format(size))
+        if drop_policy not in DROP_POLICIES:
+            raise RuntimeError("Unknown drop policy {} (options are {})".format(drop_policy, DROP_POLICIES))
+        self.name = name
+        self.size = size
+        self.drop_policy = drop_policy
+        self.items = [None] * size
+        self.head = 0  # index of the oldest item
+        self.count = 0
+        self.spill = deque()  # (SPILL) items pushed while full, oldest first
+        self.b_closed = False
+        self.cond = threading.Condition()
+        self.num_pushed = 0
+        self.num_dropped = 0
+        self.num_spilled = 0
+        self.max_depth = 0  # most items held at once (incl. spilled ones)
+
+
+    def __len__(self):
+        return self.count + len(self.spill)
+
+
+    def push(self, item, timeout=None):
+        """ add an item, returns False if it was dropped (or if the buffer is closed) """
+        with self.cond:
+            if self.b_closed:
+                return False
+            if self.count == self.size:
+                if self.drop_policy == SPILL:
+                    self.spill.append(item)
+                    self.num_spilled += 1
+                    self.num_pushed += 1
+                    self.max_depth = max(self.max_depth, self.count + len(self.spill))
+                    return True
+                if self.drop_policy == DROP_NEWEST:
+                    self.num_dropped += 1
+                    return False
+                elif self.drop_policy == DROP_OLDEST:
+                    self.items[self.head] = None
+                    self.head = (self.head + 1) % self.size
+                    self.count -= 1
+                    self.num_dropped += 1
+                elif not self.cond.wait_for(lambda: self.count < self.size or self.b_closed, timeout) or self.b_closed:
+                    self.num_dropped += 1
+                    return False
+            self.items[(self.head + self.count) % self.size] = item
+            self.count += 1
+            self.num_pushed += 1
+            self.max_depth = max(self.max_depth, self.count + len(self.spill))
+            self.cond.notify_all()
+            return True
+
+
+    def pop(self, timeout=None):
+        """ remove & return the oldest item. Returns None if the timeout is reached or the buffer is closed & empty """
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.count > 0 or self.b_closed, timeout) or self.count == 0:
+                return None
+            item = self.items[self.head]
+            self.items[self.head] = None
+            self.head = (self.head + 1) % self.size
+            self.count -= 1
+            if self.spill:  # (the spilled items are newer than all the others, so they go in at the back)
+                self.items[(self.head + self.count) % self.size] = self.spill.popleft()
+                self.count += 1
+            self.cond.notify_all()
+            return item
+
+
+    def close(self):
+        """ wake everything waiting on the buffer. Items left in it can still be popped """
+        with self.cond:
+            self.b_closed = True
+            self.cond.notify_all()
+
+
+    def stats_str(self):
+        if self.drop_policy == SPILL:
+            return "{}: {} in, {} spilled, max depth {} ({})".format(self.name, self.num_pushed, self.num_spilled, self.max_depth, self.drop_policy)
+        return "{}: {} in, {} dropped ({})".format(self.name, self.num_pushed, self.num_dropped, self.drop_policy)
+
+
+class PipelineStage(threading.Thread):
+    """
+    Worker thread that pops items from in_buf, runs process_fn on them, and pushes the results to out_buf
+    (if given). process_fn returns None to drop an item. Items with a "stamps" dict get the time they
+    started & finished this stage added as stamps[name + '_start'] and stamps[name + '_done'].
+    An exception in process_fn is printed & the item is dropped, the stage keeps running.
+    """
+
+    def __init__(self, name, process_fn, in_buf, out_buf=None):
+        super().__init__(name=name, daemon=True)
+        self.process_fn = process_fn
+        self.in_buf = in_buf
+        self.out_buf = out_buf
+        self.num_processed = 0
+        self.num_failed = 0
+        self.busy_time = 0.  # total time spent in process_fn [s]
+
+
+    def run(self):
+        while True:
+            item = self.in_buf.pop()
+            if item is None:  # closed
+                break
+            tic = time.time()
+            if hasattr(item, 'stamps'):
+                item.stamps[self.name + '_start'] = tic
+            try:
+                out = self.process_fn(item)
+            except Exception:
+                print("Exception in pipeline stage {}:".format(self.name))
+                traceback.print_exc()
+                out = None
+                self.num_failed += 1
+            toc = time.time()
+            self.busy_time += toc - tic
+            self.num_processed += 1
+            if out is None:
+                continue
+            if hasattr(out, 'stamps'):
+                out.stamps[self.name + '_done'] = toc
+            if self.out_buf is not None:
+                self.out_buf.push(out)
+
+
+    def stop(self):
+        self.in_buf.close()
+
+
+    def stats_str(self):
+        ave_time = self.busy_time / self.num_processed if self.num_processed > 0 else 0.
+        return "{}: {} processed, ave {:.1f} ms".format(self.name, self.num_processed, 1000 * ave_time)
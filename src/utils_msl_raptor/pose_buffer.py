@@ -0,0 +1,94 @@
+####### POSE BUFFER #######
+# Fixed size history of timestamped poses (e.g. the ego pose from mocap / the ekf) that can be looked up at any
+# time in its range, interpolating between the poses on either side (lerp for position, slerp for orientation).
+# IMPORTS
+# math
+import numpy as np
+# utils
+try:
+    from utils_msl_raptor.math_utils import interp_poses, poses_to_tfs
+except ImportError:
+    from math_utils import interp_poses, poses_to_tfs
+
+
+class PoseBuffer:
+    """
+    Ring buffer of the last size poses ([x, y, z, qw, qx, qy, qz]) & their times, in preallocated arrays so a push is
+    one row write. Poses must be added in time order (older poses are dropped) & by one thread (e.g. the pose
+    callback), any thread can look poses up. There is no lock: a push bumps num_started, writes its slot, then bumps
+    num_pushed. Lookups copy the ring & drop the slots the pushes started since may have overwritten (the ring is
+    only unrolled then). benchmarks/pose_buffer_benchmark.py compares it to the old list buffer
+    """
+
+    def __init__(self, size=50, name='poses'):
+        if size < 1:
+            raise RuntimeError("PoseBuffer size must be at least 1 (got {})".format(size))
+        self.name = name
+        self.size = size
+        self.times = np.zeros((size,))
+        self.poses = np.zeros((size, 7))
+        self.num_started = 0
+        self.num_pushed = 0  # push k is in slot k % size
+        self.last_time = None
+        self.num_out_of_order = 0
+
+
+    def __len__(self):
+        return min(self.num_pushed, self.size)
+
+
+    def push(self, time, pose):
+        """ add a pose ([x, y, z, qw, qx, qy, qz]) at time (seconds). Returns False if it is older than the newest pose """
+        if self.num_pushed > 0 and time <= self.last_time:
+            self.num_out_of_order += 1
+            return False
+        self.num_started += 1
+        ind = self.num_pushed % self.size
+        self.times[ind] = time
+        self.poses[ind] = pose
+        self.last_time = time
+        self.num_pushed += 1  # (publishes the pose to lookups)
+        return True
+
+
+    def snapshot(self):
+        """ (times, poses) of the buffer, oldest first, consistent even if pushes happen while copying """
+        while True:
+            num_pushed = self.num_pushed
+            times, poses = self.times.copy(), self.poses.copy()
+            first = max(0, self.num_started - self.size)  # oldest push not overwritten by the ones started so far
+            if first < num_pushed or num_pushed == 0:
+                break
+        if first == 0:  # (not wrapped yet, no unrolling needed)
+            return times[:num_pushed], poses[:num_pushed]
+        inds = np.arange(first, num_pushed) % self.size
+        return times[inds], poses[inds]
+
+
+    def get_poses(self, times):
+        """
+        poses ([x, y, z, qw, qx, qy, qz]) at the given time(s), interpolated between the nearest poses before & after.
+        Times outside the buffer get the first / last pose. Returns 7 or n x 7 (for an array of times)
+        """
+        b_single = np.ndim(times) == 0
+        times = np.reshape(times, (-1,)).astype(float)
+        if self.num_pushed == 0:
+            raise RuntimeError("No poses in buffer {}!".format(self.name))
+        buf_times, buf_poses = self.snapshot()
+        # index of the first pose after each time (w/ a single pose in the buffer this is 0 & before is the same pose)
+        idx = np.minimum(np.maximum(np.searchsorted(buf_times, times, side='right'), 1), len(buf_times) - 1)
+        inds_before = np.maximum(idx - 1, 0)
+        t_before, t_after = buf_times[inds_before], buf_times[idx]
+        before, after = buf_poses[inds_before], buf_poses[idx]
+        dt = t_after - t_before
+        alpha = np.zeros(len(times))
+        np.divide(times - t_before, dt, out=alpha, where=dt > 0)
+        poses = interp_poses(before, after, np.minimum(np.maximum(alpha, 0), 1))
+        return poses[0] if b_single else poses
+
+
+    def get_tfs(self, times):
+        """ same as get_poses, but as 4x4 (or n x 4 x 4) transforms (e.g. tf_w_ego if the poses are the ego's) """
+        b_single = np.ndim(times) == 0
+        tfs = poses_to_tfs(self.get_poses(np.reshape(times, (-1,))))
+        return tfs[0] if b_single else tfs
@@ -18,8 +18,10 @@ class PoseMetricTracker:
     """
     This class is to help unify how ssp and raptor judge the results. It can be incrementally updated with results at each iteration, 
     and at the end can calculate averages for the run. It calculates several metrics using the methodology from ssp's code.
+    b_running_stats: only keep the counts (of errors under the thresholds) & sums the final metrics need instead of every
+    error, so memory doesn't grow w/ the number of updates (the errs_* lists only hold the current update's errors)
     """
-    def __init__(self, px_thresh=5, prct_thresh=10, trans_thresh=0.05, ang_thresh=5, names=None, bb_3d_dict=None, eps=1e-5):
+    def __init__(self, px_thresh=5, prct_thresh=10, trans_thresh=0.05, ang_thresh=5, names=None, bb_3d_dict=None, eps=1e-5, b_running_stats=False):
 
         self.px_thresh        = px_thresh
         self.prct_thresh      = prct_thresh
@@ -28,6 +30,7 @@ class PoseMetricTracker:
         self.eps              = eps
         self.names            = names
         self.bb_3d_dict       = bb_3d_dict
+        self.b_running_stats  = b_running_stats
 
         # Init variables
         self.num_measurements    = defaultdict(int)
@@ -39,6 +42,7 @@ class PoseMetricTracker:
         self.errs_trans          = defaultdict(list)
         self.errs_angle          = defaultdict(list)
         self.errs_corner2D       = defaultdict(list)
+        self.running_stats       = defaultdict(lambda: defaultdict(float))  # (only used if b_running_stats)
 
         self.acc                = defaultdict(float)
         self.acc5cm5deg         = defaultdict(float)
@@ -182,6 +186,31 @@ class PoseMetricTracker:
         self.corner_3d_error(name, vertices, Rt_cam_ado_gt=Rt_cam_ado_gt, Rt_cam_ado_pr=Rt_cam_ado_pr)
         self.testing_error_pixel[name] += self.pixel_error(name, vertices, K, Rt_cam_ado_gt, Rt_cam_ado_pr, R_cam_ado_gt, t_cam_ado_gt, R_cam_ado_pr, t_cam_ado_pr)
         self.num_measurements[name]    += 1
+        if self.b_running_stats:
+            self.fold_into_running_stats(name)
+
+
+    def fold_into_running_stats(self, name):
+        """ adds the errors in the errs_* lists to the running counts & sums, then empties the lists """
+        errs_2d       = np.array(self.errs_2d[name])
+        errs_3d       = np.array(self.errs_3d[name])
+        errs_trans    = np.array(self.errs_trans[name])
+        errs_angle    = np.array(self.errs_angle[name])
+        errs_corner2D = np.array(self.errs_corner2D[name])
+        stats = self.running_stats[name]
+        stats['num_2d']        += len(errs_2d)
+        stats['num_3d']        += len(errs_3d)
+        stats['num_trans']     += len(errs_trans)
+        stats['num_corner2D']  += len(errs_corner2D)
+        stats['acc']           += np.sum(errs_2d <= self.px_thresh)
+        stats['acc5cm5deg']    += np.sum((errs_trans <= self.trans_thresh) & (errs_angle <= self.ang_thresh))
+        stats['acc3d10']       += np.sum(errs_3d <= self.bb_3d_dict[name][-1] * self.prct_thresh/100.)
+        stats['corner_acc']    += np.sum(errs_corner2D <= self.px_thresh)
+        stats['sum_2d']        += np.sum(errs_2d)
+        stats['sum_3d']        += np.sum(errs_3d)
+        stats['sum_corner2D']  += np.sum(errs_corner2D)
+        for errs in (self.errs_2d, self.errs_3d, self.errs_trans, self.errs_angle, self.errs_corner2D):
+            del errs[name][:]
 
 
     def calc_final_metrics(self):
@@ -190,6 +219,17 @@ class PoseMetricTracker:
         for name in self.names:
             if self.num_measurements[name] == 0:
                 continue
+            if self.b_running_stats:
+                self.fold_into_running_stats(name)  # (in case any of the error fns were called on their own)
+                stats = self.running_stats[name]
+                self.acc[name]          = stats['acc'] * 100. / (stats['num_2d'] + self.eps)
+                self.acc5cm5deg[name]   = stats['acc5cm5deg'] * 100. / (stats['num_trans'] + self.eps)
+                self.acc3d10[name]      = stats['acc3d10'] * 100. / (stats['num_3d'] + self.eps)
+                self.corner_acc[name]   = stats['corner_acc'] * 100. / (stats['num_corner2D'] + self.eps)
+                self.mean_err_2d[name]  = stats['sum_2d'] / stats['num_2d']
+                self.mean_err_3d[name]  = stats['sum_3d'] / stats['num_3d']
+                self.mean_corner_err_2d[name] = stats['sum_corner2D'] / stats['num_corner2D']
+                continue
             self.acc[name]          = len(np.where(np.array(self.errs_2d[name]) <= self.px_thresh)[0]) * 100. / (len(self.errs_2d[name]) + self.eps)
             self.acc5cm5deg[name]   = len(np.where((np.array(self.errs_trans[name]) <= self.trans_thresh) & (np.array(self.errs_angle[name]) <= self.ang_thresh))[0]) * 100. / (len(self.errs_trans[name]) + self.eps)
             self.acc3d10[name]      = len(np.where(np.array(self.errs_3d[name]) <= self.bb_3d_dict[name][-1] * self.prct_thresh/100.)[0]) * 100. / (len(self.errs_3d[name]) + self.eps)
@@ -0,0 +1,219 @@
+####### QUATERNION UTILITIES #######
+# Vectorized quaternion kernels written directly in numpy (no scipy Rotation objects).
+# Convention: quaternions are [w, x, y, z] (scalar first). Functions take n x 4 arrays (a single 4 element quat is
+# treated as 1 x 4) and return n x ... arrays, matching the functions they replace in math_utils.
+# Most take an optional out= buffer the result is written into (and returned) to avoid allocating a new array.
+# IMPORTS
+# math
+import numpy as np
+
+
+def _output(out, shape):
+    return np.empty(shape) if out is None else out
+
+
+def _row_dot(a, b):
+    """
+    dot product of each row of a & b (n x k). einsum's rounding depends on the memory layout, so both are made C
+    ordered first (no copy if they already are) & a row's result is the same from a view, a copy or a bigger batch
+    """
+    return np.einsum('ij,ij->i', np.ascontiguousarray(a), np.ascontiguousarray(b))
+
+
+def enforce_quat_format(quat, out=None):
+    """
+    quat should have norm 1 and a positive first element (note orientation represented by q is same as -q)
+    input: nx4 array
+    """
+    quat = quat.reshape(-1, 4)
+    out = _output(out, quat.shape)
+    scale = 1 / np.sqrt(_row_dot(quat, quat))
+    scale[quat[:, 0] < 0] *= -1  # (dont change the quaternion when the scalar is 0)
+    np.multiply(quat, scale[:, None], out=out)
+    return out
+
+
+def quat_inv(q, out=None):
+    """ technically this is the conjugate, for unit quats this is same as inverse. q can be 4 or nx4 """
+    q = np.asarray(q)
+    out = _output(out, q.shape)
+    qs = q.reshape(-1, 4)
+    out_s = out.reshape(-1, 4)
+    b_pos = qs[:, 0] > 0  # keep the scalar positive when possible
+    out_s[:, 0] = np.where(b_pos, qs[:, 0], -qs[:, 0])
+    np.multiply(qs[:, 1:4], np.where(b_pos, -1., 1.)[:, None], out=out_s[:, 1:4])
+    return out
+
+
+# quat_mul(q, r) = L(q) @ r, with L(q) = q[_MUL_IDX] * _MUL_SIGN
+_MUL_IDX = np.array([[0, 1, 2, 3], [1, 0, 3, 2], [2, 3, 0, 1], [3, 2, 1, 0]])
+_MUL_SIGN = np.array([[1., -1., -1., -1.], [1., 1., -1., 1.], [1., 1., 1., -1.], [1., -1., 1., 1.]])
+
+
+def quat_mul(q, r, out=None):
+    """
+    multiply q by r. first element in quat is scalar value. Can be nx4 sized numpy arrays (or 4 / 1x4 to broadcast)
+    """
+    q_left = q.reshape(-1, 4)[:, _MUL_IDX] * _MUL_SIGN
+    q_left *= r.reshape(-1, 1, 4)
+    qout = np.sum(q_left, axis=2)  # (not matmul, its rounding for stacks of 4x4s depends on the memory alignment)
+    return enforce_quat_format(qout, out=qout if out is None else out)
+
+
+def axang_to_quat(axang, out=None):
+    """
+    takes in an orientation in axis-angle form s.t. |axang| = ang, and
+    axang/ang = unit vector about which the angle is rotated. Returns a quaternion
+    """
+    axang = axang.reshape(-1, 3)
+    out = _output(out, (axang.shape[0], 4))
+    ang = np.sqrt(_row_dot(axang, axang))
+    half_ang = ang / 2
+    out[:, 0] = np.cos(half_ang)
+    # sin(ang/2) / ang, with the taylor series for small angles
+    half_ang2 = half_ang * half_ang
+    scale = 0.5 - half_ang2 / 12 + half_ang2 * half_ang2 / 240
+    np.divide(np.sin(half_ang), ang, out=scale, where=ang > 1e-3)
+    np.multiply(axang, scale[:, None], out=out[:, 1:4])
+    return enforce_quat_format(out, out=out)
+
+
+def quat_to_axang(quat, out=None):
+    """
+    takes in a quaternion and returns the orientation in axis-angle form s.t. |axang| = ang, and
+    axang/ang = unit vector about which the angle is rotated
+    """
+    quat = quat.reshape(-1, 4)
+    w = np.abs(quat[:, 0])  # flip to the rotation angle in [0, pi] (q & -q are the same rotation)
+    vec_norm2 = _row_dot(quat[:, 1:4], quat[:, 1:4])
+    vec_norm = np.sqrt(vec_norm2)
+    ang = 2 * np.arctan2(vec_norm, w)
+    # scale = ang / sin(ang/2) on the normalized quat. Use the taylor series for small angles
+    ang2 = ang * ang
+    scale = (2 + ang2 / 12 + 7 * ang2 * ang2 / 2880) / np.sqrt(vec_norm2 + w * w)
+    np.divide(ang, vec_norm, out=scale, where=ang > 1e-3)
+    scale[quat[:, 0] < 0] *= -1
+    return np.multiply(quat[:, 1:4], scale[:, None], out=out)
+
+
+# rotation matrix (flattened) = I + (2 / |q|^2) * (q q^T flattened) @ _ROTM_FROM_QQ
+_EYE_FLAT = np.eye(3).reshape(9)
+_ROTM_FROM_QQ = np.zeros((16, 9))
+for _k, _terms in enumerate([[], [(1, 2, 1), (0, 3, -1)], [(1, 3, 1), (0, 2, 1)],
+                             [(1, 2, 1), (0, 3, 1)], [], [(2, 3, 1), (0, 1, -1)],
+                             [(1, 3, 1), (0, 2, -1)], [(2, 3, 1), (0, 1, 1)], []]):
+    for _i, _j, _sign in _terms:
+        _ROTM_FROM_QQ[4 * _i + _j, _k] = _sign
+for _k, (_i, _j) in zip([0, 4, 8], [(2, 3), (1, 3), (1, 2)]):
+    _ROTM_FROM_QQ[[5 * _i, 5 * _j], _k] = -1  # diagonal: 1 - 2(yy + zz) etc.
+
+
+def quat_to_rotm(quat, out=None):
+    """
+    calculate the rotation matrix of a given quaternion (frames assumed to be consistant
+    with the UKF state quaternion). First element of quat is the scalar. Returns n x 3 x 3
+    """
+    quat = np.reshape(quat, (-1, 4))
+    qq = quat[:, :, None] * quat[:, None, :]
+    qq *= (2 / _row_dot(quat, quat))[:, None, None]
+    if out is None:
+        out = np.empty((quat.shape[0], 3, 3))
+    out_flat = out.reshape(-1, 9)
+    np.matmul(qq.reshape(-1, 16), _ROTM_FROM_QQ, out=out_flat)
+    out_flat += _EYE_FLAT
+    return out
+
+
+# rotation matrix -> the 4 candidate (unnormalized) quaternions [w, x, y, z], one per largest of (m00, m11, m22, trace)
+# (rotm flattened) @ _QUAT_FROM_ROTM + _QUAT_FROM_ROTM_CONST. Same method as scipy's Rotation.from_matrix
+_QUAT_FROM_ROTM = np.zeros((9, 4, 4))
+_QUAT_FROM_ROTM_CONST = np.zeros((4, 4))
+for _c in range(3):
+    _i, _j, _k = _c, (_c + 1) % 3, (_c + 2) % 3
+    _QUAT_FROM_ROTM[[0, 4, 8], _c, _i + 1] = -1  # 1 - trace + 2 m_ii
+    _QUAT_FROM_ROTM[4 * _i, _c, _i + 1] = 1
+    _QUAT_FROM_ROTM[[3 * _j + _i, 3 * _i + _j], _c, _j + 1] = 1  # m_ji + m_ij
+    _QUAT_FROM_ROTM[[3 * _k + _i, 3 * _i + _k], _c, _k + 1] = 1  # m_ki + m_ik
+    _QUAT_FROM_ROTM[3 * _k + _j, _c, 0] = 1  # m_kj - m_jk
+    _QUAT_FROM_ROTM[3 * _j + _k, _c, 0] = -1
+    _QUAT_FROM_ROTM_CONST[_c, _i + 1] = 1
+_QUAT_FROM_ROTM[[0, 4, 8], 3, 0] = 1  # 1 + trace
+_QUAT_FROM_ROTM[[7, 2, 3], 3, [1, 2, 3]] = 1  # m21 - m12, m02 - m20, m10 - m01
+_QUAT_FROM_ROTM[[5, 6, 1], 3, [1, 2, 3]] = -1
+_QUAT_FROM_ROTM_CONST[3, 0] = 1
+_QUAT_FROM_ROTM = _QUAT_FROM_ROTM.reshape(9, 16)
+
+
+def rotm_to_quat(rotm, out=None):
+    """
+    calculate the quaternion of a given rotation matrix (3 x 3 or n x 3 x 3, returns 4 or n x 4).
+    Same method (& sign of the output) as scipy's Rotation.from_matrix
+    """
+    rotm = np.asarray(rotm)
+    b_single = rotm.ndim == 2
+    rotm = rotm.reshape(-1, 9)
+    choice = np.argmax(rotm[:, [0, 4, 8, 0]] + [0, 0, 0, 1] * (rotm[:, 4] + rotm[:, 8])[:, None], axis=1)
+    cands = (rotm @ _QUAT_FROM_ROTM).reshape(-1, 4, 4) + _QUAT_FROM_ROTM_CONST
+    quat = cands[np.arange(rotm.shape[0]), choice]
+    quat /= np.sqrt(_row_dot(quat, quat))[:, None]
+    if b_single:
+        quat = quat[0]
+    if out is None:
+        return quat
+    out[:] = quat
+    return out
+
+
+def quat_to_ang(q, b_to_degrees=False, out=None):
+    """
+    Convert a quaternion to euler angles (ASSUMES 'XYZ', i.e. intrinsic rotations about x, then y, then z)
+    """
+    rotm = quat_to_rotm(q)
+    out = _output(out, (rotm.shape[0], 3))
+    r = np.ascontiguousarray(np.moveaxis(rotm, 0, -1))  # 3 x 3 x n (arctan2 of 2 strided inputs rounds differently depending on their length)
+    out[:, 1] = np.arcsin(np.clip(r[0, 2], -1, 1))
+    b_lock = np.abs(np.abs(r[0, 2]) - 1) < 1e-7  # gimbal lock, put all of the rotation on the first angle
+    out[:, 0] = np.where(b_lock, np.arctan2(r[2, 1], r[1, 1]), np.arctan2(-r[1, 2], r[2, 2]))
+    out[:, 2] = np.where(b_lock, 0, np.arctan2(-r[0, 1], r[0, 0]))
+    if b_to_degrees:
+        out *= 180 / np.pi
+    return out
+
+
+def ang_to_quat(angs, out=None):
+    """
+    Convert euler angles into a quaternion (ASSUMES 'XYZ', i.e. intrinsic rotations about x, then y, then z)
+    """
+    angs = np.reshape(angs, (-1, 3))
+    out = _output(out, (angs.shape[0], 4))
+    c = np.cos(angs / 2)
+    s = np.sin(angs / 2)
+    # q_x * q_y * q_z for the 3 single axis rotations
+    out[:, 0] = c[:, 0]*c[:, 1]*c[:, 2] - s[:, 0]*s[:, 1]*s[:, 2]
+    out[:, 1] = s[:, 0]*c[:, 1]*c[:, 2] + c[:, 0]*s[:, 1]*s[:, 2]
+    out[:, 2] = c[:, 0]*s[:, 1]*c[:, 2] - s[:, 0]*c[:, 1]*s[:, 2]
+    out[:, 3] = c[:, 0]*c[:, 1]*s[:, 2] + s[:, 0]*s[:, 1]*c[:, 2]
+    return out
+
+
+def quat_slerp(q0, q1, alpha, out=None):
+    """
+    spherical linear interpolation from q0 (alpha = 0) to q1 (alpha = 1) along the shorter arc.
+    q0 & q1 are nx4 (or 4 / 1x4 to broadcast), alpha is a scalar or n array
+    """
+    q0 = np.reshape(q0, (-1, 4))
+    q1 = np.reshape(q1, (-1, 4))
+    n = max(q0.shape[0], q1.shape[0], np.size(alpha))
+    alpha = np.broadcast_to(np.asarray(alpha, dtype=float).reshape(-1), (n,))  # (w0 & w1 are written into below)
+    dot = _row_dot(q0, q1)
+    ang = np.arccos(np.minimum(np.abs(dot), 1))
+    sin_ang = np.sin(ang)
+    b_big = sin_ang > 1e-6  # otherwise (nearly) the same orientation, lerp is fine & avoids dividing by 0
+    w0 = 1 - alpha
+    w1 = np.array(alpha)
+    np.divide(np.sin(w0 * ang), sin_ang, out=w0, where=b_big)
+    np.divide(np.sin(w1 * ang), sin_ang, out=w1, where=b_big)
+    w1 *= np.copysign(1, dot)  # q & -q are the same orientation, go the short way
+    qout = w0[:, None] * q0
+    qout += w1[:, None] * q1
+    return enforce_quat_format(qout, out=qout if out is None else out)
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 # IMPORTS
 # system
-import sys, time
+import sys, time, json, hashlib
 from copy import copy
 from collections import defaultdict
 import pdb
@@ -10,6 +10,206 @@ import numpy as np
 from scipy.spatial.transform import Rotation as R
 # ros
 from ssp_utils import *
+from pipeline_utils import RingBuffer, PipelineStage, BLOCK, DROP_OLDEST, SPILL
+
+LOG_FORMATS = ('txt', 'bin')
+ASYNC_OVERFLOW_POLICIES = (BLOCK, DROP_OLDEST, SPILL)  # what the async writer's queue does when full (see pipeline_utils)
+BIN_LOG_EXT = '.rlog'
+BIN_LOG_MAGIC = b'RAPTORLOG1\n'
+BIN_LOG_HEADER_SIZE = 4096  # [bytes] magic + json schema, space padded so the records start at a fixed offset
+BIN_LOG_DTYPE = np.dtype('<f8')
+
+
+class BinLogWriter:
+    """
+    Append only binary log: a fixed size header w/ the schema (the save_elms of the log's mode) followed by fixed
+    length float64 records, one per row. Rows are gathered in an in-memory chunk & written chunk_rows at a time (&
+    on close), so a crash loses at most the rows of the current chunk. Read back w/ read_bin_log (memory mapped).
+    """
+    def __init__(self, fn, mode, save_elms, chunk_rows=256):
+        self.fn = fn
+        self.row_len = int(sum([count for (_, _, count) in save_elms]))
+        header = BIN_LOG_MAGIC + json.dumps({'mode': mode, 'dtype': BIN_LOG_DTYPE.str, 'row_len': self.row_len,
+                                             'columns': [list(el) for el in save_elms]}).encode() + b'\n'
+        if len(header) > BIN_LOG_HEADER_SIZE:
+            raise RuntimeError("Schema of {} too long for a binary log header ({} bytes)".format(fn, len(header)))
+        self.fh = open(fn, 'wb')
+        self.fh.write(header.ljust(BIN_LOG_HEADER_SIZE, b' '))
+        self.chunk = np.empty((chunk_rows, self.row_len), dtype=BIN_LOG_DTYPE)
+        self.num_in_chunk = 0
+        self.num_rows = 0
+
+
+    def append(self, row):
+        self.chunk[self.num_in_chunk] = row
+        self.num_in_chunk += 1
+        self.num_rows += 1
+        if self.num_in_chunk == len(self.chunk):
+            self.flush()
+
+
+    def append_rows(self, rows):
+        """ append a (num rows x row_len) array at once (bypasses the chunk) """
+        self.flush()
+        self.fh.write(np.ascontiguousarray(rows, dtype=BIN_LOG_DTYPE).tobytes())
+        self.num_rows += len(rows)
+
+
+    def flush(self):
+        if self.num_in_chunk > 0:
+            self.fh.write(self.chunk[:self.num_in_chunk].tobytes())
+            self.num_in_chunk = 0
+        self.fh.flush()
+
+
+    def close(self):
+        if not self.fh.closed:
+            self.flush()
+            self.fh.close()
+
+
+def read_bin_log_header(fn):
+    """ schema dict of a binary log: mode, dtype, row_len & columns (the save_elms it was written w/) """
+    with open(fn, 'rb') as f:
+        header = f.read(BIN_LOG_HEADER_SIZE)
+    if not header.startswith(BIN_LOG_MAGIC):
+        raise RuntimeError("{} is not a binary raptor log".format(fn))
+    return json.loads(header[len(BIN_LOG_MAGIC):].decode())
+
+
+def read_bin_log(fn, mmap_mode='r'):
+    """
+    Returns (schema, data) w/ data a memory mapped (num rows x row_len) array, so only what is used of it gets read
+    from disk (mmap_mode 'c' makes it copy on write instead of read only). A partially written last record (e.g.
+    after a crash) is ignored.
+    """
+    schema = read_bin_log_header(fn)
+    dtype = np.dtype(schema['dtype'])
+    num_rows = (os.path.getsize(fn) - BIN_LOG_HEADER_SIZE) // (schema['row_len'] * dtype.itemsize)
+    if num_rows <= 0:
+        return schema, np.zeros((0, schema['row_len']), dtype=dtype)
+    return schema, np.memmap(fn, dtype=dtype, mode=mmap_mode, offset=BIN_LOG_HEADER_SIZE, shape=(num_rows, schema['row_len']))
+
+
+def b_text_log_empty(fn):
+    """ True if a text log has no rows (only its header, or nothing at all) """
+    with open(fn) as f:
+        return all(line.startswith('#') or not line.strip() for line in f)  # (stops at the first row)
+
+
+def read_text_log(fn, save_elms):
+    """ (num rows x row_len) array of a text log, w/ 0 rows if it is empty """
+    row_len = int(sum([count for (_, _, count) in save_elms]))
+    if b_text_log_empty(fn):
+        return np.zeros((0, row_len))
+    return np.loadtxt(fn, ndmin=2).reshape(-1, row_len)
+
+
+def text_log_sidecar(fn, save_elms, sidecar_dir, mode='text'):
+    """
+    Binary copy of a text log in sidecar_dir (nothing is written next to the log), made the first time it is needed
+    (& again if the text log changed after), so later reads memory map it instead of parsing the text. Returns its
+    path, or None if the log is empty or the copy can't be written
+    """
+    if b_text_log_empty(fn):
+        return None
+    abs_fn = os.path.abspath(fn)  # (the path's hash keeps logs of the same name in different dirs apart)
+    sidecar_fn = os.path.join(sidecar_dir, "{}_{}{}".format(os.path.basename(fn), hashlib.md5(abs_fn.encode()).hexdigest()[:8], BIN_LOG_EXT))
+    if os.path.isfile(sidecar_fn) and os.path.getmtime(sidecar_fn) >= os.path.getmtime(fn):
+        return sidecar_fn
+    data = read_text_log(fn, save_elms)
+    tmp_fn = sidecar_fn + '.tmp'
+    try:
+        os.makedirs(sidecar_dir, exist_ok=True)
+        writer = BinLogWriter(tmp_fn, mode, save_elms)
+        writer.append_rows(data)
+        writer.close()
+        os.replace(tmp_fn, sidecar_fn)  # (so a reader never sees half a sidecar)
+    except OSError as e:
+        print("WARNING: could not write the sidecar of {} ({})".format(fn, e))
+        return None
+    return sidecar_fn
+
+
+class LogView:
+    """
+    Lazy, column selective access to one est / gt / err / ssp log (text or binary). The rows are a memory mapped
+    array (of the binary log, or of the sidecar of a text log, see text_log_sidecar) & get() returns views of it,
+    so only the columns & rows that are used get read from disk. Text logs are parsed whole unless a sidecar_dir is
+    given. save_elms is needed for text logs (binary logs have theirs in the header). Rows are in time order, so time
+    ranges are found w/ a binary search.
+    """
+    def __init__(self, fn, save_elms=None, mode='text', sidecar_dir=None):
+        self.fn = fn
+        if fn.endswith(BIN_LOG_EXT):
+            schema, self.data = read_bin_log(fn, mmap_mode='c')
+            save_elms = schema['columns']
+        else:
+            if save_elms is None:
+                raise RuntimeError("The columns (save_elms) of text log {} are needed to read it".format(fn))
+            sidecar_fn = text_log_sidecar(fn, save_elms, sidecar_dir, mode) if sidecar_dir is not None else None
+            if sidecar_fn is not None:
+                _, self.data = read_bin_log(sidecar_fn, mmap_mode='c')
+            else:
+                self.data = read_text_log(fn, save_elms)
+        self.columns = {}  # key: dict key string, value: slice of its values in a row
+        ind = 0
+        for (header_str, dict_str, count) in save_elms:
+            self.columns[dict_str] = slice(ind, ind + count)
+            ind += count
+        if ind != self.data.shape[1]:
+            raise RuntimeError("{} has {} values per row, its columns need {}".format(fn, self.data.shape[1], ind))
+
+
+    def __len__(self):
+        return len(self.data)
+
+
+    def keys(self):
+        return self.columns.keys()
+
+
+    def row_range(self, t_start=None, t_end=None):
+        """ slice of the rows w/ t_start <= time <= t_end (None for no bound) """
+        times = self.data[:, 0]
+        start = 0 if t_start is None else int(np.searchsorted(times, t_start, side='left'))
+        end = len(times) if t_end is None else int(np.searchsorted(times, t_end, side='right'))
+        return slice(start, end)
+
+
+    def get(self, key, t_start=None, t_end=None):
+        """ (num rows x count) view of a column's values """
+        rows = slice(None) if t_start is None and t_end is None else self.row_range(t_start, t_end)
+        return self.data[rows, self.columns[key]]
+
+
+    def __getitem__(self, key):
+        return self.get(key)
+
+
+    def as_dict(self, keys=None, t_range=None):
+        """
+        {key: view} of the given keys (default all) in the (t_start, t_end) t_range. Like np.loadtxt of the whole log
+        a single row gives 1D values
+        """
+        rows = slice(None) if t_range is None else self.row_range(*t_range)
+        data = self.data[rows]
+        if len(data) == 1:
+            return {key: data[0, self.columns[key]] for key in (self.columns if keys is None else keys)}
+        return {key: data[:, self.columns[key]] for key in (self.columns if keys is None else keys)}
+
+
+def bin_log_to_text(fn, out_fn=None, chunk_rows=10000):
+    """ write a binary log as the text log RaptorLogger would have written (default: same name w/ .log). Returns out_fn """
+    if out_fn is None:
+        out_fn = fn[:-len(BIN_LOG_EXT)] + '.log' if fn.endswith(BIN_LOG_EXT) else fn + '.log'
+    schema, data = read_bin_log(fn)
+    with open(out_fn, 'w') as f:
+        np.savetxt(f, X=[], header=", ".join([col[0] for col in schema['columns']]))
+        for i in range(0, len(data), chunk_rows):
+            np.savetxt(f, X=data[i:i + chunk_rows], fmt='%.6f')
+    return out_fn
+
 
 class RaptorLogger:
     """
@@ -19,12 +219,30 @@ class RaptorLogger:
     * to write, the user will pass in an object name and a dict with keys corresponding to the second element of each tuple in save_elms
     * to read the user gives the object name, and a dict is passed back
     * params are treated slightly differently, with their own read/write functions
+    * log_format 'bin' writes the est/gt/err logs as binary .rlog files (see BinLogWriter) instead of text. Reading
+      picks the format of the files found (params are always text)
+    * b_async: rows are queued (up to queue_size) & written by a background thread, so the caller never waits on
+      the disk. overflow_policy is what a full queue does: block the caller, drop the oldest row or spill to an
+      unbounded in-memory list. close_files writes everything still queued
+    * sidecar_dir: reading a text log keeps a binary copy of it there, so reading it again skips the text parsing
+      (see text_log_sidecar). None (default) writes nothing when reading
     """
-    def __init__(self, mode="write", names=None, base_path="./", b_ssp=False):
+    def __init__(self, mode="write", names=None, base_path="./", b_ssp=False, log_format='txt', b_async=False, queue_size=1000, overflow_policy=BLOCK, sidecar_dir=None):
 
+        if log_format not in LOG_FORMATS:
+            raise RuntimeError("Unrecognized log format {} (options are {})".format(log_format, LOG_FORMATS))
+        if overflow_policy not in ASYNC_OVERFLOW_POLICIES:
+            raise RuntimeError("Unrecognized overflow policy {} (options are {})".format(overflow_policy, ASYNC_OVERFLOW_POLICIES))
         self.names = names
         self.base_path = base_path
         self.b_ssp = b_ssp
+        self.log_format = log_format
+        self.b_async = b_async and mode == "write"
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        self.sidecar_dir = sidecar_dir
+        self.write_queue = None
+        self.writer = None
         self.save_elms = {}
         
         self.log_data = defaultdict(dict)
@@ -95,12 +313,22 @@ class RaptorLogger:
         for m in self.modes:
             for n in self.names:
                 # Create logs
+                if self.log_format == 'bin':
+                    fn = self.base_path + '_' + n + '_'+ m + BIN_LOG_EXT
+                    self.create_file_dir(fn)
+                    self.fh[m][n] = BinLogWriter(fn, m, self.save_elms[m])
+                    continue
                 fn = self.base_path + '_' + n + '_'+ m + '.log'
                 self.create_file_dir(fn)
                 self.fh[m][n] = open(fn,'w+')  # doing this here makes it appendable
                 save_el_shape = (len(self.save_elms[m]), len(self.save_elms[m][0]))
                 data_header = ", ".join(np.reshape([*zip(self.save_elms[m])], save_el_shape)[:,0].tolist())
                 np.savetxt(self.fh[m][n], X=[], header=data_header)  # write header
+
+        if self.b_async:
+            self.write_queue = RingBuffer(self.queue_size, self.overflow_policy, name='log queue')
+            self.writer = PipelineStage('log_writer', self.write_row, self.write_queue)
+            self.writer.start()
         
 
     def init_read(self):
@@ -114,6 +342,8 @@ class RaptorLogger:
                 return
             for n in self.names:
                 self.fn[m][n] = self.base_path + '_' + n + '_'+ m + '.log'
+                if not os.path.isfile(self.fn[m][n]) and os.path.isfile(self.base_path + '_' + n + '_'+ m + BIN_LOG_EXT):
+                    self.fn[m][n] = self.base_path + '_' + n + '_'+ m + BIN_LOG_EXT
 
 
     def write_params(self, param_data, mode='prms'):
@@ -184,8 +414,7 @@ class RaptorLogger:
         """ mode can be est, gt, ssp"""
         if not self.b_ssp and not mode in self.modes:
             raise RuntimeError("Mode {} not recognized. Available modes are {}".format(mode, self.modes))
-        save_el_shape = (len(self.save_elms[mode]), len(self.save_elms[mode][0]))
-        num_to_write = np.sum(np.reshape([*zip(self.save_elms[mode])], save_el_shape)[:,2].astype(int)) 
+        num_to_write = sum([count for (_, _, count) in self.save_elms[mode]])
         out = np.ones((1, num_to_write)) * 1e10
         ind = 0
         for i, (header_str, dict_str, count) in enumerate(self.save_elms[mode]):
@@ -197,49 +426,68 @@ class RaptorLogger:
                     pdb.set_trace()
             ind += count
         out[out>1e5] = np.nan
-        np.savetxt(self.fh[mode][name], X=out, fmt='%.6f')  # write to file
+        if self.b_async:
+            self.write_queue.push((mode, name, out))  # (out is a copy, so data can be changed once this returns)
+        else:
+            self.write_row((mode, name, out))
 
 
-    def read_logs(self, name):
+    def write_row(self, item):
+        mode, name, out = item
+        if self.log_format == 'bin':
+            self.fh[mode][name].append(out[0])
+        else:
+            np.savetxt(self.fh[mode][name], X=out, fmt='%.6f')  # write to file
+
+
+    def open_log(self, name, log_type):
+        """ LogView of an object's log, to read only some of its columns / rows """
+        return LogView(self.fn[log_type][name], self.save_elms[log_type], log_type, self.sidecar_dir)
+
+
+    def read_logs(self, name, keys=None, t_range=None):
         """
         Return a dict with keys being log type (est /gt /prms). Each of these is a dict with the various types of values in the log
+        keys: only read these values (default all), t_range: only the rows in (t_start, t_end)
+        The values are views of the memory mapped logs (see LogView), so only what is used is read from disk
         """
         for log_type in self.fn:
             if not log_type in self.save_elms:
                 print("Warning: we are are missing the log file for {}".format(log_type))
                 continue
-            ind = 0
-            data = np.loadtxt(self.fn[log_type][name])
-            for i, (header_str, dict_str, count) in enumerate(self.save_elms[log_type]):
-                if len(data.shape) > 1:
-                    self.log_data[log_type][dict_str] = data[:, ind:(ind + count)]
-                else:
-                    self.log_data[log_type][dict_str] = data[ind:(ind + count)]
-                ind += count
+            log_view = self.open_log(name, log_type)
+            self.log_data[log_type] = log_view.as_dict([k for k in keys if k in log_view.columns] if keys is not None else None, t_range)
                 
         return self.log_data
 
 
-    def read_err_logs(self, log_path):
+    def read_err_logs(self, log_path, keys=None, t_range=None):
         """
         Return a dict with keys being error type
+        keys: only read these errors (default all), t_range: only the rows in (t_start, t_end)
         """
-        err_log_dict = {}
-        ind = 0
-        f = open(log_path)
-        header_str = f.readline()
-        data = np.loadtxt(f)
-        for i, (header_str, dict_str, count) in enumerate(self.save_elms["err"]):
-            if len(data.shape) > 1:
-                err_log_dict[dict_str] = data[:, ind:(ind + count)]
-            else:
-                err_log_dict[dict_str] = data[ind:(ind + count)]
-            ind += count
-                
-        return err_log_dict
-        
+        return LogView(log_path, self.save_elms["err"], 'err', self.sidecar_dir).as_dict(keys, t_range)
+
+
+    def writer_stats(self):
+        """ async writer metrics: current & max queue depth, rows written, dropped (drop_oldest) & spilled (spill) """
+        if self.write_queue is None:
+            return None
+        return {'queue_depth': len(self.write_queue), 'max_queue_depth': self.write_queue.max_depth, 'written': self.writer.num_processed,
+                'dropped': self.write_queue.num_dropped, 'spilled': self.write_queue.num_spilled, 'failed': self.writer.num_failed}
+
+
+    def writer_stats_str(self):
+        stats = self.writer_stats()
+        if stats is None:
+            return "synchronous logging"
+        return "{} ({}, queue size {})".format(", ".join(["{} = {}".format(k, v) for k, v in stats.items()]), self.overflow_policy, self.queue_size)
+
 
     def close_files(self):
+        if self.writer is not None and self.writer.is_alive():  # write what is still queued first
+            self.writer.stop()
+            self.writer.join()
         for fh_key in self.fh:
             if fh_key == 'prms':
                 self.fh[fh_key].close()
@@ -252,3 +500,11 @@ class RaptorLogger:
         path = "/".join(fn_with_dir.split("/")[:-1])
         if not os.path.exists( path ):
             os.makedirs( path )
+
+
+if __name__ == '__main__':
+    # convert binary logs to the text format: python raptor_logger.py <log.rlog> [<log.rlog> ...]
+    if len(sys.argv) < 2:
+        raise RuntimeError("Incorrect arguments! needs <binary log> [<binary log> ...]")
+    for bin_fn in sys.argv[1:]:
+        print("wrote {}".format(bin_log_to_text(bin_fn)))
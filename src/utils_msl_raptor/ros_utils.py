@@ -93,6 +93,28 @@ def find_closest_by_time(time_to_match, time_list, message_list=None):
        return message_list[pos - 1], pos - 1
 
 
+def find_closest_inds_by_time(times_to_match, time_list):
+    """
+    Vectorized find_closest_by_time: index of the closest time in the sorted time_list for each of times_to_match (ties
+    go to the earlier one, same as find_closest_by_time) w/ one np.searchsorted call. Returns an int array shaped like times_to_match
+    """
+    time_list = np.reshape(np.asarray(time_list, dtype=float), (-1,))
+    if len(time_list) == 0:
+        raise RuntimeError("missing time info!")
+    times_to_match = np.asarray(times_to_match, dtype=float)
+    if len(time_list) == 1:
+        return np.zeros(times_to_match.shape, dtype=int)
+    pos = np.clip(np.searchsorted(time_list, times_to_match, side='left'), 1, len(time_list) - 1)
+    before = time_list[pos - 1]
+    after = time_list[pos]
+    return np.where(after - times_to_match < times_to_match - before, pos, pos - 1)
+
+
+def pose_msgs_to_array(poses):
+    """ list of ROS pose messages -> n x 7 array of [x,y,z,qw,qx,qy,qz] """
+    return np.array([pose_msg_to_array(pose) for pose in poses], dtype=float).reshape((-1, 7))
+
+
 def update_running_average(ave_info, new_el):
     """
     ave_info: [running mean, # of elements so far (not counting new one)]
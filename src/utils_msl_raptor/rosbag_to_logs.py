@@ -2,6 +2,8 @@
 # IMPORTS
 # system
 import sys, os, time
+import heapq
+from bisect import bisect_left
 from copy import copy
 from collections import defaultdict
 import yaml
@@ -39,7 +41,20 @@ class rosbags_to_logs:
     The code currently also runs the quantitative metric analysis in the processes, but this is optional and will be done 
     again in the result_analyser. 
     """
-    def __init__(self, rb_name=None, data_source='raptor', ego_quad_ns="/quad7", ego_yaml="quad7", ado_yaml="all_obj", b_save_3dbb_imgs=False):
+    def __init__(self, rb_name=None, data_source='raptor', ego_quad_ns="/quad7", ego_yaml="quad7", ado_yaml="all_obj", b_save_3dbb_imgs=False,
+                 bag=None, log_out_dir=None, b_show_plots=None, log_format='txt', b_async_log=False, b_streaming=False, stream_window=1.0):
+        """
+        bag: an already open bag (or anything w/ the same read_messages) to use instead of opening rb_name
+        log_out_dir: where the logs are written (default /mounted_folder/<data_source>_logs)
+        b_show_plots: plot the errors over time at the end (& wait for enter to close them), keeps every error until then
+            (default: only when not b_streaming)
+        log_format: 'txt' or 'bin' (binary .rlog files, see raptor_logger.BinLogWriter)
+        b_async_log: write the logs from a background thread (see RaptorLogger's b_async)
+        b_streaming: convert the bag in one pass in stamp order instead of reading all of it first (see stream_rb_to_log),
+            memory doesn't grow w/ the bag length (the metrics are kept as running stats, see PoseMetricTracker)
+        stream_window: [s] how long after its stamp an estimate is logged when streaming (i.e. how late in the bag its
+            ground truth / ego poses can be)
+        """
         # Parse rb_name
         us_split = rb_name.split("_")
         if rb_name[-4:] == '.bag' or "_".join(us_split[0:3]) == 'msl_raptor_output':
@@ -59,13 +74,19 @@ class rosbags_to_logs:
             raise RuntimeError("We do not recognize bag file! {} not understood".format(rb_name))
         
         self.rosbag_in_dir = "/mounted_folder/raptor_processed_bags"
-        self.log_out_dir = "/mounted_folder/" + data_source.lower() + "_logs"
+        self.log_out_dir = "/mounted_folder/" + data_source.lower() + "_logs" if log_out_dir is None else log_out_dir
         makedirs(self.log_out_dir)
+        self.b_show_plots = not b_streaming if b_show_plots is None else b_show_plots
+        self.b_streaming = b_streaming
+        self.stream_window = stream_window
 
-        try:
-            self.bag = rosbag.Bag(self.rosbag_in_dir + '/' + self.rb_name, 'r')
-        except Exception as e:
-            raise RuntimeError("Unable to Process Rosbag!!\n{}".format(e))
+        if bag is not None:
+            self.bag = bag
+        else:
+            try:
+                self.bag = rosbag.Bag(self.rosbag_in_dir + '/' + self.rb_name, 'r')
+            except Exception as e:
+                raise RuntimeError("Unable to Process Rosbag!!\n{}".format(e))
 
         self.bags_and_cut_times = {"msl_raptor_output_from_bag_rosbag_for_post_process_2019-12-18-02-10-28.bag" : 1576663867,
                                    "msl_raptor_output_from_bag_rosbag_for_post_process_TX2_2019-12-18-02-10-28.bag" : 1576663867}
@@ -118,6 +139,7 @@ class rosbags_to_logs:
         self.t0 = -1
         self.tf = -1
         self.t_est = set()
+        self.t_est_heap = []  # (streaming) the pending estimate stamps, earliest first
         self.t_gt = defaultdict(list)
 
         self.ego_gt_time_pose = []
@@ -139,6 +161,12 @@ class rosbags_to_logs:
         self.abb_list = defaultdict(list)
         self.abb_time_list = defaultdict(list)
 
+        self.t_img_to_t_est_dict = {}
+        self.add_errs = []  # (only kept if b_show_plots)
+        self.R_errs = []
+        self.t_errs = []
+        self.tms = []
+
         self.K = None
         self.dist_coefs = None
         self.new_camera_matrix = None
@@ -153,15 +181,23 @@ class rosbags_to_logs:
             # bb_3d, obj_width, obj_height, classes_names, classes_ids, objects_names_per_class, connected_inds = \
             self.info_for_gt_overlay = get_object_sizes_from_yaml(objects_sizes_yaml, objects_used_path_and_file, classes_names_file, category_params)  # Parse objects used and associated configurations
 
-        self.process_rb()
+        if self.b_streaming:
+            self.find_ado_names()  # (the logger needs them before any rows are written)
+        else:
+            self.process_rb()
         
         base_path = self.log_out_dir + "/log_" + self.rb_name[:-4].split("_")[-1] 
-        self.logger = RaptorLogger(mode="write", names=self.ado_names, base_path=base_path)
+        self.logger = RaptorLogger(mode="write", names=self.ado_names, base_path=base_path, log_format=log_format, b_async=b_async_log)
 
-        self.raptor_metrics = PoseMetricTracker(px_thresh=5, prct_thresh=10, trans_thresh=0.05, ang_thresh=5, names=self.ado_names, bb_3d_dict=self.bb_3d_dict_all)
+        self.raptor_metrics = PoseMetricTracker(px_thresh=5, prct_thresh=10, trans_thresh=0.05, ang_thresh=5, names=self.ado_names, bb_3d_dict=self.bb_3d_dict_all, b_running_stats=self.b_streaming)
         
-        self.convert_rosbag_info_to_log()
+        if self.b_streaming:
+            self.stream_rb_to_log()
+        else:
+            self.convert_rosbag_info_to_log()
         self.logger.close_files()
+        if b_async_log:
+            print("log writer: {}".format(self.logger.writer_stats_str()))
 
 
     def find_closest_pose_est_by_class_and_time(self, tf_w_ado_gt_dict, candidate_poses, candidate_object_names, close_cutoff=0.5):
@@ -194,7 +230,46 @@ class rosbags_to_logs:
 
 
     def convert_rosbag_info_to_log(self):
-        # Write params to log file ########
+        self.write_params_to_log()
+
+        print("Post-processing data now")
+        self.sort_ado_names_by_class()
+
+        self.t_img_to_t_est_dict = {}
+        aligned = self.align_to_estimates(self.t_est)
+        for i, t_est in enumerate(self.t_est):
+            if t_est < 0:
+                continue
+            self.log_estimates_at_time(i, t_est, self.ado_est_pose_BY_TIME_BY_CLASS[t_est], aligned, i)
+        self.finish_log()
+
+
+    def align_to_estimates(self, t_ests):
+        """
+        finds the closest (in time) ego poses, ado gt poses & boxes for all the estimate stamps t_ests at once. Returns a dict w/
+        tf_w_ego_gt, tf_w_ego_est, tf_w_cam & tf_cam_w (n x 4 x 4), t_gt & tf_w_ado_gt (dicts by ado name of n & n x 4 x 4)
+        and abb_ind (dict by name of n indices into abb_list[name])
+        """
+        aligned = {'t_gt': {}, 'tf_w_ado_gt': {}, 'abb_ind': {}}
+        inds = find_closest_inds_by_time(t_ests, self.ego_gt_time_pose)
+        aligned['tf_w_ego_gt'] = poses_to_tfs(pose_msgs_to_array([self.ego_gt_pose[ind] for ind in inds]))
+        inds = find_closest_inds_by_time(t_ests, self.ego_est_time_pose)
+        aligned['tf_w_ego_est'] = poses_to_tfs(pose_msgs_to_array([self.ego_est_pose[ind] for ind in inds]))
+        aligned['tf_w_cam'] = aligned['tf_w_ego_gt'] @ inv_tf(self.tf_cam_ego)
+        aligned['tf_cam_w'] = la.inv(aligned['tf_w_cam'])
+        for name in self.ado_names:
+            if len(self.t_gt[name]) == 0:
+                continue  # (only an error if an estimate of its class needs it)
+            inds = find_closest_inds_by_time(t_ests, self.t_gt[name])
+            aligned['t_gt'][name] = np.asarray(self.t_gt[name])[inds]
+            aligned['tf_w_ado_gt'][name] = poses_to_tfs(pose_msgs_to_array([self.ado_gt_pose[name][ind] for ind in inds]))
+        for name, abb_times in self.abb_time_list.items():
+            if len(abb_times) > 0:
+                aligned['abb_ind'][name] = find_closest_inds_by_time(t_ests, abb_times)
+        return aligned
+
+
+    def write_params_to_log(self):
         param_data = {}
         if self.new_camera_matrix is not None:
             param_data['K'] = np.array([self.new_camera_matrix[0, 0], self.new_camera_matrix[1, 1], self.new_camera_matrix[0, 2], self.new_camera_matrix[1, 2]])
@@ -206,243 +281,243 @@ class rosbags_to_logs:
         param_data['3d_bb_dims'] = bb_dim_arr
         param_data['tf_cam_ego'] = np.reshape(self.tf_cam_ego, (16,))
         self.logger.write_params(param_data)
-        ###################################
 
-        print("Post-processing data now")
+
+    def sort_ado_names_by_class(self):
         # loop over all the actually seen ado objects, and sort them by class. this way we know the max number of candidates for coorespondences
         for ado_name in self.ado_names:
             class_str = self.ado_name_to_class[ado_name]
             self.class_str_to_name_dict[class_str].append(ado_name)
 
-        t_img_to_t_est_dict = {}
-        add_errs = []
-        R_errs = []
-        t_errs = []
-        tms = []
-        for i, t_est in enumerate(self.t_est):
-            if t_est < 0:
-                continue
-
-            # find corresponding ego pose 
-            t_gt, gt_ind = find_closest_by_time(t_est, self.ego_gt_time_pose)
-            tf_w_ego_gt = pose_to_tf(self.ego_gt_pose[gt_ind])
-            t_est2, est_ind = find_closest_by_time(t_est, self.ego_est_time_pose)
-            tf_w_ego_est = pose_to_tf(self.ego_est_pose[est_ind])
-            # print("t_gt - t_est = {.3f} s, t_est2 - t_est = {.3f} s".format(t_gt - t_est, t_est2 - t_est))
-            tf_w_cam = tf_w_ego_gt @ inv_tf(self.tf_cam_ego)
-            tf_cam_w = inv_tf(tf_w_cam)
-            # pdb.set_trace()
-
-
-            corespondences = []
-            for class_name_seen in self.ado_est_pose_BY_TIME_BY_CLASS[t_est].keys():
-                ado_name_candidates = self.class_str_to_name_dict[class_name_seen]
-                total_num_of_this_classs = len(ado_name_candidates)
-                num_seen_of_this_class = len(self.ado_est_pose_BY_TIME_BY_CLASS[t_est][class_name_seen])
-
-                cost_mat = 1e5*np.ones((num_seen_of_this_class, total_num_of_this_classs))
-
-                # get each tf_w_ado_est that we have this round (can be less than total number we have)
-                ado_est_data_list = []
-                ado_gt_data_list = []
-                for hun_row, (tf_w_ado_est_ros_format, bb_proj, connected_inds, bb_proj_gt) in enumerate(self.ado_est_pose_BY_TIME_BY_CLASS[t_est][class_name_seen]): # ado_pose, bb_proj, connected_inds
-                    tf_w_ado_est = pose_to_tf(tf_w_ado_est_ros_format)
-                    ado_est_data_list.append((tf_w_ado_est, bb_proj, connected_inds, bb_proj_gt))
-
-                    # get tf_w_ado_gt for each candidate
-                    for hun_col, ado_name_cand in enumerate(ado_name_candidates):
-                        t_gt, gt_ind = find_closest_by_time(t_est, self.t_gt[ado_name_cand])
-                        tf_w_ado_gt = pose_to_tf(self.ado_gt_pose[ado_name_cand][gt_ind])
-                        ado_gt_data_list.append((tf_w_ado_gt, t_gt, ado_name_cand))
-                        cost_mat[hun_row, hun_col] = la.norm(tf_w_ado_gt[0:3, 3] - tf_w_ado_est[0:3, 3])
-                        try:
-                            assert(abs(t_gt - t_est) < 0.1) # make sure there are no surprises
-                        except:
-                            print("FAILED ASSERTION: assert(abs(t_gt - t_est) < 0.1) ...  abs(t_gt - t_est) = {}".format(abs(t_gt - t_est)))
-                            pdb.set_trace()
-                            raise RuntimeError("FAILED ASSERTION!!!")
-                # now we have a cost matrix with the rows being the ado objects we have seen this round (but only know the classes of) and the columns being the ground truth ado ojbects (we know the full names in ) ado_name_candidates list
-                row_inds, col_inds = scipy_hung_alg(cost_mat)
-
-                # use our results to build tuples
-                for (ado_seen_idx, ado_gt_idx) in zip(row_inds, col_inds):
-                    tf_w_ado_est, bb_proj, connected_inds, bb_proj_gt = ado_est_data_list[ado_seen_idx]
-                    tf_w_ado_gt, t_gt, ado_name = ado_gt_data_list[ado_gt_idx]
 
-                    corespondences.append((tf_w_ado_est, tf_w_ado_gt, ado_name, class_name_seen, t_gt, bb_proj, connected_inds, bb_proj_gt))
-                    
-                    # print('error (trans dist) for {} after hung alg = {}'.format(ado_name, cost_mat[ado_seen_idx, ado_gt_idx]))
-            ################ END HUNG ALG ##############################
-            
-            if len(corespondences) == 0:
-                continue
-            R_deltaz = np.array([[ np.cos(np.pi),-np.sin(np.pi), 0.              ],
-                                [ np.sin(np.pi), np.cos(np.pi), 0.              ],
-                                [ 0.             , 0.             , 1.              ]])
-
-
-
-            for tf_w_ado_est, tf_w_ado_gt, name, class_str, t_gt, bb_proj, connected_inds, bb_proj_gt in corespondences:
-                # if self.rb_name == "msl_raptor_output_from_bag_rosbag_for_post_process_2019-12-18-02-10-28.bag" and t_gt > 31:
-                #     continue
-
-                # if self.rb_name == "msl_raptor_output_from_bag_scene_2.bag" and t_gt > 2.3 and t_gt < 18:
-                #     """ FIX ERROR IN GROUNT TRUTH!!!! """
-                #     continue
-                #     tf_w_ado_gt[0:3, 0:3] = R_deltaz @ tf_w_ado_gt[0:3, 0:3]
-                # if self.rb_name == "msl_raptor_output_from_bag_scene_4.bag" and t_gt > 4.35 and t_gt < 7.7:
-                #     """ FIX ERROR IN GROUNT TRUTH!!!! """
-                #     continue
-
-
-                log_data = {}
-                box_length, box_width, box_height, diam = self.bb_3d_dict_all[name]
-                vertices = np.array([[ box_length/2, box_width/2, box_height/2, 1.],
-                                     [ box_length/2, box_width/2,-box_height/2, 1.],
-                                     [ box_length/2,-box_width/2,-box_height/2, 1.],
-                                     [ box_length/2,-box_width/2, box_height/2, 1.],
-                                     [-box_length/2,-box_width/2, box_height/2, 1.],
-                                     [-box_length/2,-box_width/2,-box_height/2, 1.],
-                                     [-box_length/2, box_width/2,-box_height/2, 1.],
-                                     [-box_length/2, box_width/2, box_height/2, 1.]]).T
+    def log_estimates_at_time(self, i, t_est, ado_ests_by_class, aligned, j=0, t0=0.):
+        """
+        matches the estimates stamped t_est (ado_ests_by_class, key: class_str) to the ground truth objects of their class,
+        updates the metrics & writes the log rows (& the image w/ the boxes if b_save_3dbb_imgs)
+        i: index of the estimate (for the image file name)
+        aligned, j: the output of align_to_estimates & t_est's index in the stamps it was given
+        t0: subtracted from the times written to the logs (if the stamps aren't already relative)
+        """
+        # corresponding ego pose 
+        tf_w_ego_gt = aligned['tf_w_ego_gt'][j]
+        tf_w_ego_est = aligned['tf_w_ego_est'][j]
+        tf_w_cam = aligned['tf_w_cam'][j]
+        tf_cam_w = aligned['tf_cam_w'][j]
+        # pdb.set_trace()
+
+
+        corespondences = []
+        for class_name_seen in ado_ests_by_class.keys():
+            ado_name_candidates = self.class_str_to_name_dict[class_name_seen]
+            total_num_of_this_classs = len(ado_name_candidates)
+            num_seen_of_this_class = len(ado_ests_by_class[class_name_seen])
+
+            cost_mat = 1e5*np.ones((num_seen_of_this_class, total_num_of_this_classs))
+
+            # get each tf_w_ado_est that we have this round (can be less than total number we have)
+            ado_est_data_list = []
+            ado_gt_data_list = []
+            for hun_row, (tf_w_ado_est_ros_format, bb_proj, connected_inds, bb_proj_gt) in enumerate(ado_ests_by_class[class_name_seen]): # ado_pose, bb_proj, connected_inds
+                tf_w_ado_est = pose_to_tf(tf_w_ado_est_ros_format)
+                ado_est_data_list.append((tf_w_ado_est, bb_proj, connected_inds, bb_proj_gt))
+
+                # get tf_w_ado_gt for each candidate
+                for hun_col, ado_name_cand in enumerate(ado_name_candidates):
+                    if ado_name_cand not in aligned['t_gt']:
+                        raise RuntimeError("No ground truth poses for {}!".format(ado_name_cand))
+                    t_gt = aligned['t_gt'][ado_name_cand][j]
+                    tf_w_ado_gt = aligned['tf_w_ado_gt'][ado_name_cand][j]
+                    ado_gt_data_list.append((tf_w_ado_gt, t_gt, ado_name_cand))
+                    cost_mat[hun_row, hun_col] = la.norm(tf_w_ado_gt[0:3, 3] - tf_w_ado_est[0:3, 3])
+                    try:
+                        assert(abs(t_gt - t_est) < 0.1) # make sure there are no surprises
+                    except:
+                        print("FAILED ASSERTION: assert(abs(t_gt - t_est) < 0.1) ...  abs(t_gt - t_est) = {}".format(abs(t_gt - t_est)))
+                        pdb.set_trace()
+                        raise RuntimeError("FAILED ASSERTION!!!")
+            # now we have a cost matrix with the rows being the ado objects we have seen this round (but only know the classes of) and the columns being the ground truth ado ojbects (we know the full names in ) ado_name_candidates list
+            row_inds, col_inds = scipy_hung_alg(cost_mat)
+
+            # use our results to build tuples
+            for (ado_seen_idx, ado_gt_idx) in zip(row_inds, col_inds):
+                tf_w_ado_est, bb_proj, connected_inds, bb_proj_gt = ado_est_data_list[ado_seen_idx]
+                tf_w_ado_gt, t_gt, ado_name = ado_gt_data_list[ado_gt_idx]
+
+                corespondences.append((tf_w_ado_est, tf_w_ado_gt, ado_name, class_name_seen, t_gt, bb_proj, connected_inds, bb_proj_gt))
                 
-                # if gt_ind > len(self.ego_gt_pose):
-                #     break # this can happen at the end of a bag
-                # pose_msg, _ = find_closest_by_time(t_est, self.ego_est_time_pose, message_list=self.ego_est_pose)
-                # tf_w_ego_est = pose_to_tf(pose_msg)
+                # print('error (trans dist) for {} after hung alg = {}'.format(ado_name, cost_mat[ado_seen_idx, ado_gt_idx]))
+        ################ END HUNG ALG ##############################
+        
+        if len(corespondences) == 0:
+            return
+        R_deltaz = np.array([[ np.cos(np.pi),-np.sin(np.pi), 0.              ],
+                            [ np.sin(np.pi), np.cos(np.pi), 0.              ],
+                            [ 0.             , 0.             , 1.              ]])
+
+
+
+        for tf_w_ado_est, tf_w_ado_gt, name, class_str, t_gt, bb_proj, connected_inds, bb_proj_gt in corespondences:
+            # if self.rb_name == "msl_raptor_output_from_bag_rosbag_for_post_process_2019-12-18-02-10-28.bag" and t_gt > 31:
+            #     continue
+
+            # if self.rb_name == "msl_raptor_output_from_bag_scene_2.bag" and t_gt > 2.3 and t_gt < 18:
+            #     """ FIX ERROR IN GROUNT TRUTH!!!! """
+            #     continue
+            #     tf_w_ado_gt[0:3, 0:3] = R_deltaz @ tf_w_ado_gt[0:3, 0:3]
+            # if self.rb_name == "msl_raptor_output_from_bag_scene_4.bag" and t_gt > 4.35 and t_gt < 7.7:
+            #     """ FIX ERROR IN GROUNT TRUTH!!!! """
+            #     continue
+
+
+            log_data = {}
+            box_length, box_width, box_height, diam = self.bb_3d_dict_all[name]
+            vertices = np.array([[ box_length/2, box_width/2, box_height/2, 1.],
+                                 [ box_length/2, box_width/2,-box_height/2, 1.],
+                                 [ box_length/2,-box_width/2,-box_height/2, 1.],
+                                 [ box_length/2,-box_width/2, box_height/2, 1.],
+                                 [-box_length/2,-box_width/2, box_height/2, 1.],
+                                 [-box_length/2,-box_width/2,-box_height/2, 1.],
+                                 [-box_length/2, box_width/2,-box_height/2, 1.],
+                                 [-box_length/2, box_width/2, box_height/2, 1.]]).T
+            
+            # if gt_ind > len(self.ego_gt_pose):
+            #     break # this can happen at the end of a bag
+            # pose_msg, _ = find_closest_by_time(t_est, self.ego_est_time_pose, message_list=self.ego_est_pose)
+            # tf_w_ego_est = pose_to_tf(pose_msg)
 
+            
+            tf_cam_ado_est = tf_cam_w @ tf_w_ado_est
+            tf_cam_ado_gt = tf_cam_w @ tf_w_ado_gt
+
+            R_cam_ado_pr = tf_cam_ado_est[0:3, 0:3]
+            t_cam_ado_pr = tf_cam_ado_est[0:3, 3].reshape((3, 1))
+            tf_cam_ado_gt = tf_cam_w @ tf_w_ado_gt
+            R_cam_ado_gt = tf_cam_ado_gt[0:3, 0:3]
+            t_cam_ado_gt = tf_cam_ado_gt[0:3, 3].reshape((3, 1))
+            
+            ######################################################
+            
+            self.raptor_metrics.update_all_metrics(name=name, vertices=vertices, tf_w_cam=tf_w_cam, R_cam_ado_gt=R_cam_ado_gt, t_cam_ado_gt=t_cam_ado_gt, R_cam_ado_pr=R_cam_ado_pr, t_cam_ado_pr=t_cam_ado_pr, K=self.new_camera_matrix)
+
+            # Write data to log file #############################
+            log_data['time'] = t_est - t0
+            log_data['state_est'] = tf_to_state_vec(tf_w_ado_est)
+            log_data['state_gt'] = tf_to_state_vec(tf_w_ado_gt)
+            log_data['ego_state_est'] = tf_to_state_vec(tf_w_ego_est)
+            log_data['ego_state_gt'] = tf_to_state_vec(tf_w_ego_gt)
+            corners3D_pr = (tf_w_ado_est @ vertices)[0:3,:]
+            corners3D_gt = (tf_w_ado_gt @ vertices)[0:3,:]
+            log_data['corners_3d_est'] = np.reshape(corners3D_pr, (corners3D_pr.size,))
+            log_data['corners_3d_gt'] = np.reshape(corners3D_gt, (corners3D_gt.size,))
+            log_data['proj_corners_est'] = np.reshape(self.raptor_metrics.proj_2d_pr[name].T, (self.raptor_metrics.proj_2d_pr[name].size,))
+            log_data['proj_corners_gt'] = np.reshape(self.raptor_metrics.proj_2d_gt[name].T, (self.raptor_metrics.proj_2d_gt[name].size,))
+
+            log_data['x_err'] = tf_w_ado_est[0, 3] - tf_w_ado_gt[0, 3]
+            log_data['y_err'] = tf_w_ado_est[1, 3] - tf_w_ado_gt[1, 3]
+            log_data['z_err'] = tf_w_ado_est[2, 3] - tf_w_ado_gt[2, 3]
+            log_data['ang_err'] = calcAngularDistance(tf_w_ado_est[0:3, 0:3], tf_w_ado_gt[0:3, 0:3])
+            log_data['pix_err'] = np.mean(la.norm(self.raptor_metrics.proj_2d_pr[name] - self.raptor_metrics.proj_2d_gt[name], axis=0))
+            log_data['add_err'] = np.mean(la.norm(corners3D_pr - corners3D_gt, axis=0))
+            log_data['measurement_dist'] = la.norm(tf_w_ego_gt[0:3, 3] - tf_w_ado_gt[0:3, 3])
+            if self.b_show_plots:
+                self.add_errs.append(log_data['add_err'])
+                self.R_errs.append(log_data['ang_err'])
+                self.t_errs.append(la.norm(tf_w_ado_est[0:3, 3] - tf_w_ado_gt[0:3, 3]))
+                self.tms.append(t_gt - t0)
+
+            if name in aligned['abb_ind']:
+                abb, im_seg_mode = self.abb_list[name][aligned['abb_ind'][name][j]]
+                log_data['abb'] = abb
+                log_data['im_seg_mode'] = im_seg_mode
+            self.logger.write_data_to_log(log_data, name, mode='est')
+            self.logger.write_data_to_log(log_data, name, mode='gt')
+            self.logger.write_data_to_log(log_data, name, mode='err')
+            ######################################################
+            # draw on image (3d bb estimate)
+            if self.b_save_3dbb_imgs:
+                if t_est in self.processed_image_dict:
+                    image, _, __ = self.processed_image_dict[t_est]
+                else:
+                    img_msg, img_pos = find_closest_by_time(t_est, self.img_time_buffer, message_list=self.img_msg_buffer)
+                    img_time = self.img_time_buffer[img_pos]
+                    self.t_img_to_t_est_dict[img_time] = t_est
+                    image = self.bridge.imgmsg_to_cv2(img_msg, desired_encoding="bgr8")
+                    image = cv2.undistort(image, self.K, self.dist_coefs, None, self.new_camera_matrix)
                 
-                tf_cam_ado_est = tf_cam_w @ tf_w_ado_est
-                tf_cam_ado_gt = tf_cam_w @ tf_w_ado_gt
-
-                R_cam_ado_pr = tf_cam_ado_est[0:3, 0:3]
-                t_cam_ado_pr = tf_cam_ado_est[0:3, 3].reshape((3, 1))
-                tf_cam_ado_gt = tf_cam_w @ tf_w_ado_gt
-                R_cam_ado_gt = tf_cam_ado_gt[0:3, 0:3]
-                t_cam_ado_gt = tf_cam_ado_gt[0:3, 3].reshape((3, 1))
-                
-                ######################################################
                 
-                self.raptor_metrics.update_all_metrics(name=name, vertices=vertices, tf_w_cam=tf_w_cam, R_cam_ado_gt=R_cam_ado_gt, t_cam_ado_gt=t_cam_ado_gt, R_cam_ado_pr=R_cam_ado_pr, t_cam_ado_pr=t_cam_ado_pr, K=self.new_camera_matrix)
-
-                # Write data to log file #############################
-                log_data['time'] = t_est
-                log_data['state_est'] = tf_to_state_vec(tf_w_ado_est)
-                log_data['state_gt'] = tf_to_state_vec(tf_w_ado_gt)
-                log_data['ego_state_est'] = tf_to_state_vec(tf_w_ego_est)
-                log_data['ego_state_gt'] = tf_to_state_vec(tf_w_ego_gt)
-                corners3D_pr = (tf_w_ado_est @ vertices)[0:3,:]
-                corners3D_gt = (tf_w_ado_gt @ vertices)[0:3,:]
-                log_data['corners_3d_est'] = np.reshape(corners3D_pr, (corners3D_pr.size,))
-                log_data['corners_3d_gt'] = np.reshape(corners3D_gt, (corners3D_gt.size,))
-                log_data['proj_corners_est'] = np.reshape(self.raptor_metrics.proj_2d_pr[name].T, (self.raptor_metrics.proj_2d_pr[name].size,))
-                log_data['proj_corners_gt'] = np.reshape(self.raptor_metrics.proj_2d_gt[name].T, (self.raptor_metrics.proj_2d_gt[name].size,))
-
-                log_data['x_err'] = tf_w_ado_est[0, 3] - tf_w_ado_gt[0, 3]
-                log_data['y_err'] = tf_w_ado_est[1, 3] - tf_w_ado_gt[1, 3]
-                log_data['z_err'] = tf_w_ado_est[2, 3] - tf_w_ado_gt[2, 3]
-                log_data['ang_err'] = calcAngularDistance(tf_w_ado_est[0:3, 0:3], tf_w_ado_gt[0:3, 0:3])
-                log_data['pix_err'] = np.mean(la.norm(self.raptor_metrics.proj_2d_pr[name] - self.raptor_metrics.proj_2d_gt[name], axis=0))
-                log_data['add_err'] = np.mean(la.norm(corners3D_pr - corners3D_gt, axis=0))
-                log_data['measurement_dist'] = la.norm(tf_w_ego_gt[0:3, 3] - tf_w_ado_gt[0:3, 3])
-                add_errs.append(log_data['add_err'])
-                R_errs.append(log_data['ang_err'])
-                t_errs.append(la.norm(tf_w_ado_est[0:3, 3] - tf_w_ado_gt[0:3, 3]))
-                tms.append(t_gt)
-
-                if len(self.abb_time_list[name]) > 0:
-                    (abb, im_seg_mode), _ = find_closest_by_time(t_est, self.abb_time_list[name], message_list=self.abb_list[name])
-                    log_data['abb'] = abb
-                    log_data['im_seg_mode'] = im_seg_mode
-                self.logger.write_data_to_log(log_data, name, mode='est')
-                self.logger.write_data_to_log(log_data, name, mode='gt')
-                self.logger.write_data_to_log(log_data, name, mode='err')
-                ######################################################
-                # draw on image (3d bb estimate)
-                if self.b_save_3dbb_imgs:
+                if self.b_save_3dbb_imgs and len(bb_proj) > 0:
+                    image_to_draw_on = image
+                    ###### COLOR LEGEND ##################################
+                    # black/white is gt, "darker" colors are calculated locally
+                    # "light" color - this is msl-raptor's estimate as calculated in real time (in msl-raptor code)
+                    # "darker" color - this is the estimate calculated locally
+                    # black - this is the gt calculated locally
+                    # white - this is the gt calculated in msl raptor
+                    color_est_raptor = self.ado_name_to_color[name]
+                    color_est_local  = (self.ado_name_to_color[name][0] // 2, self.ado_name_to_color[name][1] // 2, self.ado_name_to_color[name][2] // 2)
+                    color_gt_local   = (0, 0, 0)  # black
+                    color_gt_raptor  = (255, 255, 2550)  # white 
+                    b_draw_est_raptor = False
+                    b_draw_est_local  = False
+                    b_draw_gt_raptor  = False
+                    b_draw_gt_local   = True
+
+                    # draw the gt verts if this is enabled
+                    if self.b_plot_gt_overlay:
+                        if b_draw_gt_raptor and len(bb_proj_gt) > 0:
+                            # if sent over, plot the gt projection as calculated by msl raptor
+                            image_to_draw_on = draw_2d_proj_of_3D_bounding_box(image_to_draw_on, bb_proj_gt, color_pr=color_gt_raptor, linewidth=self.bb_linewidth, b_verts_only=False, inds_to_connect=connected_inds)
+
+                        # plot the verts as calculated here
+                        bb_3d, _, _, _, _, _, connected_inds_gt_list = self.info_for_gt_overlay # bb_3d, obj_width, obj_height, classes_names, classes_ids, objects_names_per_class, connected_inds
+                        if not class_str in bb_3d:
+                            print("WARNING - HAVENT TESTED THIS YET AND I THINK IT IS OUTDATED")
+                            bb_proj_gt_calc_local = np.fliplr(pose_to_3d_bb_proj(tf_w_ado_gt, tf_w_ego_gt, vertices, self.camera)) # fliplr is needed because of x /y  <===> column / row
+                            pdb.set_trace()
+                        else:
+                            bb_proj_gt_calc_local = np.fliplr(pose_to_3d_bb_proj(tf_w_ado_gt, tf_w_ego_gt, bb_3d[class_str], self.camera) ) # fliplr is needed because of x /y  <===> column / row
+                            bb_proj_est_calc_local = np.fliplr(pose_to_3d_bb_proj(tf_w_ado_est, tf_w_ego_est, bb_3d[class_str], self.camera) )
+                        if b_draw_gt_local:
+                            image_to_draw_on = draw_2d_proj_of_3D_bounding_box(image_to_draw_on, bb_proj_gt_calc_local, color_pr=color_gt_local, linewidth=self.bb_linewidth, b_verts_only=False, inds_to_connect=connected_inds)
+                        if b_draw_est_local:
+                            image_to_draw_on = draw_2d_proj_of_3D_bounding_box(image_to_draw_on, bb_proj_est_calc_local, color_pr=color_est_local, linewidth=self.bb_linewidth, b_verts_only=False, inds_to_connect=connected_inds)
+
+
+                    # now draw our estimated verts - as calculated by msl raptor
                     if t_est in self.processed_image_dict:
-                        image, _, __ = self.processed_image_dict[t_est]
+                        if b_draw_est_raptor:
+                            image_to_draw_on = draw_2d_proj_of_3D_bounding_box(image_to_draw_on, bb_proj, color_pr=color_est_raptor, linewidth=self.bb_linewidth, b_verts_only=False, inds_to_connect=connected_inds)
+                        self.processed_image_dict[t_est][0] = image_to_draw_on
+                        self.processed_image_dict[t_est][1].append(bb_proj)
+                        self.processed_image_dict[t_est][2].append(name)
                     else:
-                        img_msg, img_pos = find_closest_by_time(t_est, self.img_time_buffer, message_list=self.img_msg_buffer)
-                        img_time = self.img_time_buffer[img_pos]
-                        t_img_to_t_est_dict[img_time] = t_est
-                        image = self.bridge.imgmsg_to_cv2(img_msg, desired_encoding="bgr8")
-                        image = cv2.undistort(image, self.K, self.dist_coefs, None, self.new_camera_matrix)
-                    
-                    
-                    if self.b_save_3dbb_imgs and len(bb_proj) > 0:
-                        image_to_draw_on = image
-                        ###### COLOR LEGEND ##################################
-                        # black/white is gt, "darker" colors are calculated locally
-                        # "light" color - this is msl-raptor's estimate as calculated in real time (in msl-raptor code)
-                        # "darker" color - this is the estimate calculated locally
-                        # black - this is the gt calculated locally
-                        # white - this is the gt calculated in msl raptor
-                        color_est_raptor = self.ado_name_to_color[name]
-                        color_est_local  = (self.ado_name_to_color[name][0] // 2, self.ado_name_to_color[name][1] // 2, self.ado_name_to_color[name][2] // 2)
-                        color_gt_local   = (0, 0, 0)  # black
-                        color_gt_raptor  = (255, 255, 2550)  # white 
-                        b_draw_est_raptor = False
-                        b_draw_est_local  = False
-                        b_draw_gt_raptor  = False
-                        b_draw_gt_local   = True
-
-                        # draw the gt verts if this is enabled
-                        if self.b_plot_gt_overlay:
-                            if b_draw_gt_raptor and len(bb_proj_gt) > 0:
-                                # if sent over, plot the gt projection as calculated by msl raptor
-                                image_to_draw_on = draw_2d_proj_of_3D_bounding_box(image_to_draw_on, bb_proj_gt, color_pr=color_gt_raptor, linewidth=self.bb_linewidth, b_verts_only=False, inds_to_connect=connected_inds)
-
-                            # plot the verts as calculated here
-                            bb_3d, _, _, _, _, _, connected_inds_gt_list = self.info_for_gt_overlay # bb_3d, obj_width, obj_height, classes_names, classes_ids, objects_names_per_class, connected_inds
-                            if not class_str in bb_3d:
-                                print("WARNING - HAVENT TESTED THIS YET AND I THINK IT IS OUTDATED")
-                                bb_proj_gt_calc_local = np.fliplr(pose_to_3d_bb_proj(tf_w_ado_gt, tf_w_ego_gt, vertices, self.camera)) # fliplr is needed because of x /y  <===> column / row
-                                pdb.set_trace()
-                            else:
-                                bb_proj_gt_calc_local = np.fliplr(pose_to_3d_bb_proj(tf_w_ado_gt, tf_w_ego_gt, bb_3d[class_str], self.camera) ) # fliplr is needed because of x /y  <===> column / row
-                                bb_proj_est_calc_local = np.fliplr(pose_to_3d_bb_proj(tf_w_ado_est, tf_w_ego_est, bb_3d[class_str], self.camera) )
-                            if b_draw_gt_local:
-                                image_to_draw_on = draw_2d_proj_of_3D_bounding_box(image_to_draw_on, bb_proj_gt_calc_local, color_pr=color_gt_local, linewidth=self.bb_linewidth, b_verts_only=False, inds_to_connect=connected_inds)
-                            if b_draw_est_local:
-                                image_to_draw_on = draw_2d_proj_of_3D_bounding_box(image_to_draw_on, bb_proj_est_calc_local, color_pr=color_est_local, linewidth=self.bb_linewidth, b_verts_only=False, inds_to_connect=connected_inds)
-
-
-                        # now draw our estimated verts - as calculated by msl raptor
-                        if t_est in self.processed_image_dict:
-                            if b_draw_est_raptor:
-                                image_to_draw_on = draw_2d_proj_of_3D_bounding_box(image_to_draw_on, bb_proj, color_pr=color_est_raptor, linewidth=self.bb_linewidth, b_verts_only=False, inds_to_connect=connected_inds)
-                            self.processed_image_dict[t_est][0] = image_to_draw_on
-                            self.processed_image_dict[t_est][1].append(bb_proj)
-                            self.processed_image_dict[t_est][2].append(name)
-                        else:
-                            if b_draw_est_raptor:
-                                image_to_draw_on = draw_2d_proj_of_3D_bounding_box(image_to_draw_on, bb_proj, color_pr=color_est_raptor, linewidth=self.bb_linewidth, b_verts_only=False, inds_to_connect=connected_inds)
-                            self.processed_image_dict[t_est] = [image_to_draw_on, [bb_proj], [name]]
-
-
-                        # if name=="swell_bottle":
-                        #     if i == 0:
-                                # pdb.set_trace()
-                                # print("tf_w_ado_gt:\n{}".format(tf_w_ado_gt))
-                            # print("tf_w_ego_gt:\n{}".format(tf_w_ego_gt))
-                            # print("tf_w_ego_est:\n{}".format(tf_w_ego_est))
-                            # t_err_ego = la.norm(tf_w_ego_gt[0:3, 3] - tf_w_ego_est[0:3, 3])
-                            # R_err_ego = calcAngularDistance(tf_w_ego_gt[0:3, 0:3], tf_w_ego_est[0:3, 0:3]) # in degrees
-                            # # print("ego err: trans = {:.2f} mm, rot = {:.3f} deg".format(t_err_ego*1000, R_err_ego))
-                            # print("tf_w_ado_est:\n{}".format(tf_w_ado_est))
-                            # print("tf_w_ado_gt:\n{}".format(tf_w_ado_gt))
+                        if b_draw_est_raptor:
+                            image_to_draw_on = draw_2d_proj_of_3D_bounding_box(image_to_draw_on, bb_proj, color_pr=color_est_raptor, linewidth=self.bb_linewidth, b_verts_only=False, inds_to_connect=connected_inds)
+                        self.processed_image_dict[t_est] = [image_to_draw_on, [bb_proj], [name]]
+
+
+                    # if name=="swell_bottle":
+                    #     if i == 0:
                             # pdb.set_trace()
-                            # if i == 3:
-                            #     pdb.set_trace()
-            # save the image
+                            # print("tf_w_ado_gt:\n{}".format(tf_w_ado_gt))
+                        # print("tf_w_ego_gt:\n{}".format(tf_w_ego_gt))
+                        # print("tf_w_ego_est:\n{}".format(tf_w_ego_est))
+                        # t_err_ego = la.norm(tf_w_ego_gt[0:3, 3] - tf_w_ego_est[0:3, 3])
+                        # R_err_ego = calcAngularDistance(tf_w_ego_gt[0:3, 0:3], tf_w_ego_est[0:3, 0:3]) # in degrees
+                        # # print("ego err: trans = {:.2f} mm, rot = {:.3f} deg".format(t_err_ego*1000, R_err_ego))
+                        # print("tf_w_ado_est:\n{}".format(tf_w_ado_est))
+                        # print("tf_w_ado_gt:\n{}".format(tf_w_ado_gt))
+                        # pdb.set_trace()
+                        # if i == 3:
+                        #     pdb.set_trace()
+        # save the image
+        if self.b_save_3dbb_imgs:
             fn_str = "mslraptor_{:d}".format(i)
             cv2.imwrite("/mounted_folder/raptor_processed_bags/output_imgs/" + fn_str + ".jpg", image_to_draw_on)
-            # pdb.set_trace()
+        # pdb.set_trace()
 
-                    ######################################################
-            
 
+    def finish_log(self):
         if self.raptor_metrics is not None:
             self.raptor_metrics.calc_final_metrics()
             self.raptor_metrics.print_final_metrics()
@@ -482,14 +557,16 @@ class rosbags_to_logs:
         #             cv2.imwrite("/mounted_folder/raptor_processed_bags/output_imgs/" + fn_str + ".jpg", image)
         
         print("done processing rosbag into logs!")
+        if not self.b_show_plots:
+            return
         plt.figure(0)
-        plt.plot(tms, add_errs, 'b.')
+        plt.plot(self.tms, self.add_errs, 'b.')
         plt.gca().set_title("ADD")
         plt.figure(1)
-        plt.plot(tms, t_errs, 'r.')
+        plt.plot(self.tms, self.t_errs, 'r.')
         plt.gca().set_title("Trans Err")
         plt.figure(2)
-        plt.plot(tms, R_errs, 'm.')
+        plt.plot(self.tms, self.R_errs, 'm.')
         plt.gca().set_title("Rotation Err")
         plt.show(block=False)
         input("\nPress enter to close program\n")
@@ -501,23 +578,7 @@ class rosbags_to_logs:
         """
         print("Processing {}".format(self.rb_name))
         for i, (topic, msg, t) in enumerate(self.bag.read_messages()):
-            t_split = topic.split("/")
-            if topic in self.topic_func_dict:
-                self.topic_func_dict[topic](msg, t=t.to_sec())
-            elif t_split[-1] == 'msl_raptor_state': # estimate
-                self.parse_ado_est_msg(msg)
-            elif t_split[1] in self.ado_names_all and t_split[-1] == 'pose' and t_split[-2] == 'vision_pose': # ground truth from a quad (mavros) / nocs
-                name = t_split[1]
-                if name == self.ego_quad_ns.split('/')[-1] or name == "quad7quad7":
-                    continue
-                self.ado_names.add(name)
-                self.parse_ado_gt_msg(msg, name=name, t=t.to_sec())
-            elif (t_split[1] == 'vrpn_client_node' and t_split[-1] == 'pose'): # ground truth from optitrack default 
-                name = t_split[2]
-                if name == self.ego_quad_ns.split('/')[-1] or name == "quad7quad7":
-                    continue
-                self.ado_names.add(name)
-                self.parse_ado_gt_msg(msg, name=name, t=t.to_sec())
+            self.parse_message(topic, msg, t)
 
         self.t_est = np.sort(list(self.t_est))
         self.t0 = np.min(self.t_est)
@@ -530,12 +591,124 @@ class rosbags_to_logs:
             self.t_gt[n] = np.asarray(self.t_gt[n]) - self.t0
             self.ado_name_to_color[n] = self.color_list[i]
         self.img_time_buffer = np.asarray(self.img_time_buffer) - self.t0
+        for n in self.abb_time_list:
+            self.abb_time_list[n] = np.asarray(self.abb_time_list[n]) - self.t0
         # self.detect_time[n] = np.asarray(self.detect_time) - self.t0
         # self.detect_times[n] = np.asarray(self.detect_times) - self.t0
         self.ego_est_time_pose = np.asarray(self.ego_est_time_pose) - self.t0
         self.ego_gt_time_pose = np.asarray(self.ego_gt_time_pose) - self.t0
 
 
+    def parse_message(self, topic, msg, t):
+        """ hands the message to the parse fn for its topic """
+        if topic in self.topic_func_dict:
+            self.topic_func_dict[topic](msg, t=t.to_sec())
+        elif topic.split("/")[-1] == 'msl_raptor_state': # estimate
+            self.parse_ado_est_msg(msg)
+        else:
+            name = self.ado_gt_topic_to_name(topic)
+            if name is not None:
+                self.ado_names.add(name)
+                self.parse_ado_gt_msg(msg, name=name, t=t.to_sec())
+
+
+    def ado_gt_topic_to_name(self, topic):
+        """ name of the ado object whose ground truth pose is on topic (None if it isn't an ado gt topic) """
+        t_split = topic.split("/")
+        if t_split[1] in self.ado_names_all and t_split[-1] == 'pose' and t_split[-2] == 'vision_pose': # ground truth from a quad (mavros) / nocs
+            name = t_split[1]
+        elif (t_split[1] == 'vrpn_client_node' and t_split[-1] == 'pose'): # ground truth from optitrack default 
+            name = t_split[2]
+        else:
+            return None
+        if name == self.ego_quad_ns.split('/')[-1] or name == "quad7quad7":
+            return None
+        return name
+
+
+    def find_ado_names(self):
+        """ fills ado_names from the bag's topics (w/o reading the messages) """
+        for topic in self.bag.get_type_and_topic_info().topics:
+            name = self.ado_gt_topic_to_name(topic)
+            if name is not None:
+                self.ado_names.add(name)
+
+
+    def stream_rb_to_log(self):
+        """
+        Single pass version of process_rb + convert_rosbag_info_to_log. Walks the bag in order & logs the estimates once
+        the bag is at least stream_window past their stamps, so their closest gt / ego poses have been read. They are
+        logged in batches (once the earliest pending one is 2 * stream_window old) to align them w/ one
+        align_to_estimates call. Only the poses, boxes & images from stream_window before the last logged estimate on are
+        kept. Estimates stamped before one that was already logged are dropped. Times are relative to the first estimate
+        (as in process_rb).
+        """
+        print("Processing {} (streaming)".format(self.rb_name))
+        for i, n in enumerate(self.ado_names):
+            self.ado_name_to_color[n] = self.color_list[i]
+        self.sort_ado_names_by_class()
+        topics = None
+        if not self.b_save_3dbb_imgs:  # (no need to deserialize the images)
+            topics = [topic for topic in self.bag.get_type_and_topic_info().topics if topic != self.camera_topic]
+
+        self.tf = -np.inf  # stamp of the last logged estimate
+        self.num_logged = 0
+        self.num_late = 0
+        for topic, msg, t in self.bag.read_messages(topics=topics):
+            self.parse_message(topic, msg, t)
+            t_bag = t.to_sec()
+            if len(self.t_est_heap) > 0 and self.t_est_heap[0] < t_bag - 2 * self.stream_window:
+                self.log_pending_estimates(t_bag - self.stream_window)
+        # end of the bag, nothing else is coming
+        self.log_pending_estimates(np.inf)
+
+        if self.num_late > 0:
+            print("WARNING: dropped {} estimates stamped before an already logged one (more than {} s late)".format(self.num_late, self.stream_window))
+        if self.K is None:
+            raise RuntimeError("No camera info in {}!".format(self.rb_name))
+        self.write_params_to_log()  # (now that the camera info has been read)
+        self.finish_log()
+
+
+    def log_pending_estimates(self, t_log):
+        """ logs the pending estimates stamped before t_log & trims the buffers (drops the ones stamped before an already logged estimate) """
+        t_ests = []
+        ado_ests = []
+        while len(self.t_est_heap) > 0 and self.t_est_heap[0] < t_log:
+            t_est = heapq.heappop(self.t_est_heap)
+            self.t_est.discard(t_est)
+            ado_ests_by_class = self.ado_est_pose_BY_TIME_BY_CLASS.pop(t_est)
+            if t_est <= self.tf:
+                self.num_late += 1
+                continue
+            t_ests.append(t_est)
+            ado_ests.append(ado_ests_by_class)
+        if len(t_ests) == 0:
+            return
+        if self.num_logged == 0:
+            self.t0 = t_ests[0]
+        aligned = self.align_to_estimates(t_ests)
+        for j, (t_est, ado_ests_by_class) in enumerate(zip(t_ests, ado_ests)):
+            self.log_estimates_at_time(self.num_logged, t_est, ado_ests_by_class, aligned, j=j, t0=self.t0)
+            if self.b_save_3dbb_imgs:
+                self.processed_image_dict.pop(t_est, None)
+            self.num_logged += 1
+        self.tf = t_ests[-1]
+        self.trim_stream_buffers(self.tf - self.stream_window)
+
+
+    def trim_stream_buffers(self, t_keep):
+        """ drops the buffered messages stamped before t_keep, except the last one (it can still be the closest) """
+        buffers = [(self.ego_gt_time_pose, self.ego_gt_pose), (self.ego_est_time_pose, self.ego_est_pose), (self.img_time_buffer, self.img_msg_buffer)]
+        buffers += [(self.t_gt[n], self.ado_gt_pose[n]) for n in self.t_gt]
+        buffers += [(self.abb_time_list[n], self.abb_list[n]) for n in self.abb_time_list]
+        for times, msgs in buffers:
+            num_old = bisect_left(times, t_keep) - 1
+            if num_old > 0:
+                del times[:num_old]
+                del msgs[:num_old]
+
+
     def read_yaml(self, ego_yaml="quad7", ado_yaml="all_obs"):
         yaml_path="/root/msl_raptor_ws/src/msl_raptor/params/"
         with open(yaml_path + ego_yaml + '.yaml', 'r') as stream:
@@ -660,6 +833,8 @@ class rosbags_to_logs:
             else:
                 self.ado_est_pose_BY_TIME_BY_CLASS[t_est][to.class_str] = [(pose, proj_3d_bb, connected_inds, proj_3d_bb_gt)]
 
+        if self.b_streaming and t_est not in self.t_est:
+            heapq.heappush(self.t_est_heap, t_est)
         self.t_est.add(t_est)
 
 
@@ -732,19 +907,30 @@ class camera_slim: # THIS IS A SLIMMED DOWN VERSION OF THE CLASS FROM RAPTOR. We
         rc = np.array([rc[1], rc[0]]) / rc[2]
         return rc
 
+    def pnts3d_to_pix(self, pnts_c):
+        """
+        vectorized version of pnt3d_to_pix
+        input: assumes pnts in camera frame, shape (..., 3) or (..., 4)
+        output: (..., 2) array of [row, col] i.e. the projections of xyz onto camera plane
+        """
+        rc = pnts_c[..., 0:3] @ self.new_camera_matrix.T
+        return rc[..., 1::-1] / rc[..., 2:3]
+
 
 if __name__ == '__main__':
     try:
-        if len(sys.argv) == 6:
+        if len(sys.argv) in (6, 7, 8):
             my_rb_name = sys.argv[1]
             my_data_source = sys.argv[2]
             my_ego_yaml = sys.argv[3]
             my_ado_yaml = sys.argv[4]
             my_b_save_3dbb_imgs = bool(sys.argv[5])
+            my_log_format = sys.argv[6] if len(sys.argv) >= 7 else 'txt'
+            my_b_streaming = len(sys.argv) == 8 and sys.argv[7].lower() in ('1', 'true', 'stream')
         else:
-            raise RuntimeError("Incorrect arguments! needs <rosbag_name> <data_source> <ego_yaml> <ado_yaml> <b_save_3dbb_imgs> (leave off .bag and .yaml extensions)")
+            raise RuntimeError("Incorrect arguments! needs <rosbag_name> <data_source> <ego_yaml> <ado_yaml> <b_save_3dbb_imgs> [<log_format (txt|bin)> [<b_streaming>]] (leave off .bag and .yaml extensions)")
         np.set_printoptions(linewidth=160, suppress=True)  # format numpy so printing matrices is more clear
-        program = rosbags_to_logs(rb_name=my_rb_name, data_source=my_data_source, ego_yaml=my_ego_yaml, ado_yaml=my_ado_yaml, b_save_3dbb_imgs=my_b_save_3dbb_imgs)
+        program = rosbags_to_logs(rb_name=my_rb_name, data_source=my_data_source, ego_yaml=my_ego_yaml, ado_yaml=my_ado_yaml, b_save_3dbb_imgs=my_b_save_3dbb_imgs, log_format=my_log_format, b_streaming=my_b_streaming)
         
     except:
         import traceback
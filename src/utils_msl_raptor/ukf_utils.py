@@ -23,15 +23,115 @@ def state_to_tf(state):
     return tf_w_quad
 
 
-def enforce_pos_def_sym_mat(sigma):
-    return nearestPD(sigma)
-    # sigma_out = (sigma + sigma.T) / 2
-    # eig_vals, eig_vecs = la.eig(sigma_out)
-    # eig_val_mat = np.diag(np.real(eig_vals))
-    # eig_vec_mat = np.real(eig_vecs)
-    # eig_val_mat[eig_val_mat < 0] = 0.000001
-    # sigma_out = eig_vec_mat @ eig_val_mat @ eig_vec_mat.T
-    # return sigma_out + 1e-10 * np.eye(sigma_out.shape[0])  # the small addition is for numeric stability
+# which of the tiers of enforce_pos_def_sym_mat were needed (summed over all calls). Anything beyond 'cholesky'
+# means the matrix was not numerically pos. def., and 'higham' being used often is a sign of an unhealthy filter
+PD_REPAIR_TIERS = ('cholesky', 'eig_clip', 'higham')
+pd_repair_counts = dict.fromkeys(PD_REPAIR_TIERS, 0)
+
+
+def enforce_pos_def_sym_mat(sigma, counts=None):
+    """
+    Project sigma to the symmetric pos. def. cone, using the cheapest method that works:
+        1) symmetrize & check with cholesky (nothing else to do for a healthy filter)
+        2) clip the eigenvalues to a small positive value
+        3) Higham's iterative method (nearestPD)
+    The tier used is recorded in pd_repair_counts and in the (optional) counts dict
+    """
+    sigma_out = (sigma + sigma.T) / 2
+    if isPD(sigma_out):
+        tier = 'cholesky'
+    else:
+        sigma_out = clip_eigenvalues(sigma_out)
+        if isPD(sigma_out):
+            tier = 'eig_clip'
+        else:
+            sigma_out = nearestPD(sigma)
+            tier = 'higham'
+    pd_repair_counts[tier] += 1
+    if counts is not None:
+        counts[tier] += 1
+    return sigma_out
+
+
+def enforce_pos_def_sym_mat_batch(sigmas, counts=None):
+    """
+    Vectorized enforce_pos_def_sym_mat for a N x d x d stack.
+    counts (optional) is a list of N dicts (one per matrix) to record which tier was used
+    """
+    sigmas_out = (sigmas + np.swapaxes(sigmas, 1, 2)) / 2
+    tiers = np.zeros(sigmas.shape[0], dtype=int)  # index into PD_REPAIR_TIERS
+    try:
+        la.cholesky(sigmas_out)  # fails if any of the matrices are not pos. def.
+    except la.LinAlgError:
+        bad_inds = np.flatnonzero([not isPD(sigma) for sigma in sigmas_out])
+        sigmas_out[bad_inds] = clip_eigenvalues(sigmas_out[bad_inds])
+        tiers[bad_inds] = 1
+        for n in bad_inds:
+            if not isPD(sigmas_out[n]):
+                sigmas_out[n] = nearestPD(sigmas[n])
+                tiers[n] = 2
+
+    for tier_ind, tier in enumerate(PD_REPAIR_TIERS):
+        pd_repair_counts[tier] += int(np.sum(tiers == tier_ind))
+    if counts is not None:
+        for n, tier_ind in enumerate(tiers):
+            counts[n][PD_REPAIR_TIERS[tier_ind]] += 1
+    return sigmas_out
+
+
+def clip_eigenvalues(sigma, min_eig_ratio=1e-9):
+    """
+    returns the symmetric matrix sigma with all eigenvalues raised to at least min_eig_ratio * (largest eigenvalue)
+    (works on a single d x d matrix or a N x d x d stack)
+    """
+    eig_vals, eig_vecs = la.eigh(sigma)
+    eig_floor = np.maximum(min_eig_ratio * np.max(np.abs(eig_vals), axis=-1, keepdims=True), np.finfo(float).tiny)
+    eig_vals = np.maximum(eig_vals, eig_floor)
+    return (eig_vecs * eig_vals[..., None, :]) @ np.swapaxes(eig_vecs, -1, -2)
+
+
+def chol_rank1_update(L, x, sign=1):
+    """
+    Rank 1 update (sign=1) or downdate (sign=-1) of a lower triangular cholesky factor, i.e. returns L_out with
+    L_out @ L_out.T = L @ L.T + sign * x x^T without re-factorizing. Raises la.LinAlgError if a downdate
+    would make the matrix not pos. def.
+    """
+    L = np.array(L, dtype=float)
+    x = np.array(x, dtype=float)
+    for k in range(L.shape[0]):
+        r_sq = L[k, k]**2 + sign * x[k]**2
+        if r_sq <= 0:
+            raise la.LinAlgError("cholesky downdate failed, result is not positive definite")
+        r = np.sqrt(r_sq)
+        c = r / L[k, k]
+        s = x[k] / L[k, k]
+        L[k, k] = r
+        L[k+1:, k] = (L[k+1:, k] + sign * s * x[k+1:]) / c
+        x[k+1:] = c * x[k+1:] - s * L[k+1:, k]
+    return L
+
+
+def psd_sqrt(M):
+    """ A with A @ A.T = M for a symmetric pos. semi-definite M (unlike cholesky this works with zero variances) """
+    eig_vals, eig_vecs = la.eigh(M)
+    return eig_vecs * np.sqrt(np.maximum(eig_vals, 0))
+
+
+def cov_sqrt_from_deviations(devs, weights, noise_sqrt):
+    """
+    Lower triangular L with L @ L.T = (weights * devs) @ devs.T + noise_sqrt @ noise_sqrt.T, computed with a QR
+    decomposition (+ a rank 1 downdate if the first weight is negative) instead of forming the covariance.
+    devs is d x n (one deviation per sigma point), noise_sqrt is any d x d square root of the additive noise
+    """
+    b_neg = weights < 0
+    if np.any(b_neg[1:]):
+        raise RuntimeError("only the first sigma point weight can be negative")
+    A = np.concatenate((np.sqrt(np.abs(weights[~b_neg])) * devs[:, ~b_neg], noise_sqrt), axis=1)
+    R = la.qr(A.T, mode='r')
+    L = (np.sign(np.diag(R))[:, None] * R).T  # make the diagonal positive so this matches la.cholesky
+    if b_neg[0]:
+        L = chol_rank1_update(L, np.sqrt(-weights[0]) * devs[:, 0], sign=-1)
+    return L
 
 
 ######################################################################################################
@@ -94,47 +194,36 @@ def bb_corners_to_angled_bb(points, output_coord_type='xy'):
     box corners and returns it as center, size and angle.
     points = [x1,y1;x2,y2;x3,y3;x4,y4] (N x 2 matrix)
     """
-    sortind_x = np.argsort(points[:, 0], axis=0)  # sort points by x coordinate
+    return bb_corners_to_angled_bb_batch(np.reshape(points, (1, 4, 2)), output_coord_type=output_coord_type)[0]
+
+
+def bb_corners_to_angled_bb_batch(points, output_coord_type='xy'):
+    """
+    Vectorized version of bb_corners_to_angled_bb.
+    points is a B x 4 x 2 array of box corners, output is B x 5 (center, size and angle of each box)
+    """
+    points_sorted = np.take_along_axis(points, np.argsort(points[:, :, 0], axis=1)[:, :, None], axis=1)  # sort points by x coordinate
 
     # of the points furthest to the left, which is lower and which is higher? (bottom left / top left)
-    if points[sortind_x[0], 1] > points[sortind_x[1], 1]:
-        bl_x = points[sortind_x[0], 0]
-        bl_y = points[sortind_x[0], 1]
-        tl_x = points[sortind_x[1], 0]
-        tl_y = points[sortind_x[1], 1]
-    else:
-        bl_x = points[sortind_x[1], 0]
-        bl_y = points[sortind_x[1], 1]
-        tl_x = points[sortind_x[0], 0]
-        tl_y = points[sortind_x[0], 1]
+    b_first_lower = (points_sorted[:, 0, 1] > points_sorted[:, 1, 1])[:, None]
+    bl = np.where(b_first_lower, points_sorted[:, 0, :], points_sorted[:, 1, :])
+    tl = np.where(b_first_lower, points_sorted[:, 1, :], points_sorted[:, 0, :])
 
     # of the points furthest to the right, which is lower and which is higher? (bottom right / top right)
-    if points[sortind_x[2], 1] > points[sortind_x[3], 1]:
-        br_x = points[sortind_x[2], 0]
-        br_y = points[sortind_x[2], 1]
-        tr_x = points[sortind_x[3], 0]
-        tr_y = points[sortind_x[3], 1]
-    else:
-        br_x = points[sortind_x[3], 0]
-        br_y = points[sortind_x[3], 1]
-        tr_x = points[sortind_x[2], 0]
-        tr_y = points[sortind_x[2], 1]
-
-    # print(bl_x)
-    # print(bl_y)
-    # print(br_x)
-    # print(br_y)
-    if np.abs(br_x - bl_x) < 0.00001:
+    b_first_lower = (points_sorted[:, 2, 1] > points_sorted[:, 3, 1])[:, None]
+    br = np.where(b_first_lower, points_sorted[:, 2, :], points_sorted[:, 3, :])
+    tr = np.where(b_first_lower, points_sorted[:, 3, :], points_sorted[:, 2, :])
+
+    if np.any(np.abs(br[:, 0] - bl[:, 0]) < 0.00001):
         print("error")
-    angle = -np.arctan((bl_y - br_y) / (bl_x - br_x))
-    x_center = np.mean([br_x, bl_x, tl_x, tr_x])
-    y_center = np.mean([br_y, bl_y, tl_y, tr_y])
-    width = la.norm([br_x - bl_x, br_y - bl_y])
-    height = la.norm([br_x - tr_x, br_y - tr_y])
-    output = np.array([x_center, y_center, width, height, angle])
+    angle = -np.arctan((bl[:, 1] - br[:, 1]) / (bl[:, 0] - br[:, 0]))
+    center = (br + bl + tl + tr) / 4
+    width = la.norm(br - bl, axis=1)
+    height = la.norm(br - tr, axis=1)
     if output_coord_type.lower() == 'rc':
         # r is y, col is x
-        output = np.array([y_center, x_center, width, height, angle])
+        center = center[:, ::-1]
+    output = np.column_stack((center, width, height, angle))
 
     return output
 
@@ -202,14 +291,21 @@ def pose_to_3d_bb_proj(tf_w_ado, tf_w_ego, vertices_ado, camera):
     """
     vertices_ado (ado frame) is a N x 4 where the 4 [x, y, z, 1; ...] matrix
     """
-    N = vertices_ado.shape[0]
     tf_cam_ado = camera.tf_cam_ego @ inv_tf(tf_w_ego) @ tf_w_ado
-    vertices_cam = tf_cam_ado @ vertices_ado.T
-    projected_vertices = np.zeros((N, 2))
-    for i, bb_vert in enumerate(vertices_cam.T):
-        projected_vertices[i, :] = camera.pnt3d_to_pix(bb_vert)
+    vertices_cam = vertices_ado @ tf_cam_ado.T
+    return camera.pnts3d_to_pix(vertices_cam)
+
+
+def pose_to_3d_bb_proj_batch(tf_w_ados, tf_w_ego, vertices_ado, camera):
+    """
+    Vectorized version of pose_to_3d_bb_proj for a B x 4 x 4 stack of ado poses (all seen from the same ego pose).
+    vertices_ado (ado frame) is either a V x 4 matrix shared by all poses or a B x V x 4 array (one set per pose)
+    returns a B x V x 2 array of [row, col] projections
+    """
+    tf_cam_ados = (camera.tf_cam_ego @ inv_tf(tf_w_ego)) @ tf_w_ados
+    vertices_cam = np.einsum('...ij,...vj->...vi', tf_cam_ados, vertices_ado)
+    return camera.pnts3d_to_pix(vertices_cam)
 
-    return projected_vertices
 
 def load_category_params():
     params = {}
@@ -225,25 +321,39 @@ def load_category_params():
 
     return params
 
+def min_area_rect_corners_batch(pnts):
+    """
+    pnts is a B x V x 2 array of [x,y] points, returns a B x 4 x 2 array of the corners of each set's minimum area
+    rectangle (cv2.boxPoints(cv2.minAreaRect(...)) per set)
+    """
+    pnts = np.asarray(pnts, dtype=np.float32)
+    return np.array([cv2.boxPoints(cv2.minAreaRect(p)) for p in pnts], dtype=float).reshape((pnts.shape[0], 4, 2))
+
+
 def verts_to_angled_bb(verts, measurement=None):
     """
     verts should be [[x,y],[x,y]...]
     """
+    return verts_to_angled_bb_batch(np.expand_dims(verts, axis=0), measurement)[0]
+
+
+def verts_to_angled_bb_batch(verts, measurement=None):
+    """
+    Vectorized version of verts_to_angled_bb. verts is a B x V x 2 array of B sets of [x,y] points.
+    measurement (optional) is either a single angled bb used for all B sets, or a B x 5 array (one per set)
+    returns a B x 5 array of angled bounding boxes
+    """
     # construct sensor output
-    # minAreaRect sometimes flips the w/h and angle from how we want the output to be
-    # to fix this, we can use boxPoints to get the x,y of the bb rect, and use our function
-    # to get the output in the form we want 
-    rect = cv2.minAreaRect(verts.astype('float32'))  # apparently float64s cause this function to fail
-    box = cv2.boxPoints(rect)
-    output = bb_corners_to_angled_bb(box, output_coord_type='xy')
+    # the min area rect's w/h and angle can be flipped from how we want the output to be
+    # to fix this, we use the corners of the rect and our function to get the output in the form we want 
+    boxes = min_area_rect_corners_batch(verts)
+    output = bb_corners_to_angled_bb_batch(boxes, output_coord_type='xy')
     if measurement is not None:
+        meas_ang = np.reshape(measurement, (-1, 5))[:, -1]
         ang_thesh = np.deg2rad(20)  # angle threshold for considering alternative box rotation
-        alt_ang = -np.sign(output[-1]) * (np.pi/2 - np.abs(output[-1]))  # negative complement of angle
-        
-        if (abs(alt_ang - measurement[-1]) < abs(output[-1] - measurement[-1])) and np.abs((np.abs(measurement[-1] - output[-1]) - np.pi/2)) < ang_thesh:
-            output[-1] = alt_ang 
-            w = output[2]
-            h = output[3]
-            output[2] = h
-            output[3] = w
+        alt_ang = -np.sign(output[:, -1]) * (np.pi/2 - np.abs(output[:, -1]))  # negative complement of angle
+
+        b_use_alt = (np.abs(alt_ang - meas_ang) < np.abs(output[:, -1] - meas_ang)) & (np.abs((np.abs(meas_ang - output[:, -1]) - np.pi/2)) < ang_thesh)
+        output[b_use_alt, -1] = alt_ang[b_use_alt]
+        output[b_use_alt, 2:4] = output[b_use_alt, 3:1:-1]
     return output
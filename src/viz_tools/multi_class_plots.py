@@ -92,8 +92,11 @@ class MultiObjectPlotGenerator:
             sub_dir = self.base_dir + cl
             err_logs_list = glob.glob(sub_dir + "/*_err.log")
             err_logs_list.extend(glob.glob(sub_dir + "/*_ssperr.log"))
+            # binary logs, unless they were also converted to text
+            err_logs_list.extend([fn for fn in glob.glob(sub_dir + "/*_err" + BIN_LOG_EXT) + glob.glob(sub_dir + "/*_ssperr" + BIN_LOG_EXT)
+                                  if not os.path.isfile(fn[:-len(BIN_LOG_EXT)] + '.log')])
             for log_path in err_logs_list:
-                logs = logger.read_err_logs(log_path=log_path)
+                logs = logger.read_err_logs(log_path=log_path, keys=['x_err', 'y_err', 'z_err', 'ang_err', 'measurement_dist'])  # (only the columns plotted are read)
                 if b_capitalize_names:
                     err_log_dict[cl.upper()].append(logs)
                 else:
@@ -30,7 +30,8 @@ from pose_metrics import *
 
 class ResultAnalyser:
 
-    def __init__(self, log_identifier, source='raptor', ego_quad_ns="/quad7", ado_quad_ns="/quad4", b_ssp=False):
+    def __init__(self, log_identifier, source='raptor', ego_quad_ns="/quad7", ado_quad_ns="/quad4", b_ssp=False, t_range=None):
+        """ t_range: only analyse the part of the logs in (t_start, t_end) [s] (either can be None) """
         us_split = log_identifier.split("_")
         if log_identifier[-4:] == '.bag' or ("_".join(us_split[0:3]) == 'msl_raptor_output' or "_".join(us_split[0:4]) == 'rosbag_for_post_process'):
             # This means id is the source rosbag name for the log files
@@ -115,13 +116,13 @@ class ResultAnalyser:
         self.raptor_metrics = PoseMetricTracker()
         #################################
 
-        self.extract_logs()
+        self.extract_logs(t_range=t_range)
         self.raptor_metrics = PoseMetricTracker(px_thresh=5, prct_thresh=10, trans_thresh=0.05, ang_thresh=5, names=self.ado_names, bb_3d_dict=self.bb_3d_dict_all)
         self.quant_eval()
         self.do_plot()
 
 
-    def extract_logs(self):
+    def extract_logs(self, t_range=None):
         # read the data
         
         # extract params
@@ -134,7 +135,7 @@ class ResultAnalyser:
         self.bb_3d_dict_all = self.prm_data['3d_bb_dims'] 
 
         for name in self.ado_names:
-            log_data = self.logger.read_logs(name=name)
+            log_data = self.logger.read_logs(name=name, t_range=t_range)
             # extract est
             if 'est' in log_data:
                 if len(log_data['est']['time']) == 0:
@@ -154,16 +155,8 @@ class ResultAnalyser:
                 
                 self.ego_est_time_pose[name] = self.est_data[name]['time']  # use same times
                 
-                n = len(ado_state_est_mat)
-                self.ado_est_pose[name] = np.concatenate((quat_to_rotm(ado_state_est_mat[:, 6:10]), 
-                                                        np.expand_dims(ado_state_est_mat[:, 0:3], axis=2)), axis=2)
-                self.ado_est_pose[name] = np.concatenate((self.ado_est_pose[name], np.reshape([0,0,0,1]*n, (n,1,4))), axis=1)
-
-                ego_state_est_mat = self.est_data[name]['ego_state_est']
-                n = len(ego_state_est_mat)
-                self.ego_est_pose[name] = np.concatenate((quat_to_rotm(ego_state_est_mat[:, 6:10]),  
-                                                        np.expand_dims(ego_state_est_mat[:, 0:3], axis=2)), axis=2)
-                self.ego_est_pose[name] = np.concatenate((self.ego_est_pose[name], np.reshape([0,0,0,1]*n, (n,1,4))), axis=1)
+                self.ado_est_pose[name] = states_to_tfs(ado_state_est_mat)
+                self.ego_est_pose[name] = states_to_tfs(self.est_data[name]['ego_state_est'])
 
 
             # extract gt
@@ -181,37 +174,21 @@ class ResultAnalyser:
                 
                 self.ego_gt_time_pose[name] = self.gt_data[name]['time']  # use same times
                 
-                n = len(ado_state_gt_mat)
-                self.ado_gt_pose[name] = np.concatenate((quat_to_rotm(ado_state_gt_mat[:, 6:10]), 
-                                                        np.expand_dims(ado_state_gt_mat[:, 0:3], axis=2)), axis=2)
-                self.ado_gt_pose[name] = list(np.concatenate((self.ado_gt_pose[name], np.reshape([0,0,0,1]*n, (n,1,4))), axis=1))
-
-                ego_state_gt_mat = self.gt_data[name]['ego_state_gt']
-                n = len(ego_state_gt_mat)
-                self.ego_gt_pose[name] = np.concatenate((quat_to_rotm(ego_state_gt_mat[:, 6:10]), 
-                                                        np.expand_dims(ego_state_gt_mat[:, 0:3], axis=2)), axis=2)
-                self.ego_gt_pose[name] = list(np.concatenate((self.ego_gt_pose[name], np.reshape([0,0,0,1]*n, (n,1,4))), axis=1))
+                self.ado_gt_pose[name] = states_to_tfs(ado_state_gt_mat)
+                self.ego_gt_pose[name] = states_to_tfs(self.gt_data[name]['ego_state_gt'])
 
 
                 self.ego_est_time_pose[name] = self.est_data[name]['time']  # use same times
                 
-                n = len(ado_state_est_mat)
-                self.ado_est_pose[name] = np.concatenate((quat_to_rotm(ado_state_est_mat[:, 6:10]), 
-                                                        np.expand_dims(ado_state_est_mat[:, 0:3], axis=2)), axis=2)
-                self.ado_est_pose[name] = np.concatenate((self.ado_est_pose[name], np.reshape([0,0,0,1]*n, (n,1,4))), axis=1)
-
-                ego_state_est_mat = self.est_data[name]['ego_state_est']
-                n = len(ego_state_est_mat)
-                self.ego_est_pose[name] = np.concatenate((quat_to_rotm(ego_state_est_mat[:, 6:10]),  
-                                                        np.expand_dims(ego_state_est_mat[:, 0:3], axis=2)), axis=2)
-                self.ego_est_pose[name] = np.concatenate((self.ego_est_pose[name], np.reshape([0,0,0,1]*n, (n,1,4))), axis=1)
+                self.ado_est_pose[name] = states_to_tfs(ado_state_est_mat)
+                self.ego_est_pose[name] = states_to_tfs(self.est_data[name]['ego_state_est'])
 
             
         # extract ssp
         if self.logger_ssp is not None:
             name = 'quad4'
 
-            self.ssp_data[name] = self.logger_ssp.read_logs(name=name)['ssp']
+            self.ssp_data[name] = self.logger_ssp.read_logs(name=name, t_range=t_range)['ssp']
             self.t_ssp[name] = self.ssp_data[name]['time']
             ssp_ado_state_est_mat = self.ssp_data[name]['state_est']
             self.x_ssp[name] = ssp_ado_state_est_mat[:, 0]
@@ -222,10 +199,7 @@ class ResultAnalyser:
             self.pitch_ssp[name] = rpy_mat[:, 1]
             self.yaw_ssp[name] = rpy_mat[:, 2]
             
-            n = len(ssp_ado_state_est_mat)
-            self.ssp_ado_est_pose[name] = np.concatenate((quat_to_rotm(ssp_ado_state_est_mat[:, 6:10]), 
-                                                        np.expand_dims(ssp_ado_state_est_mat[:, 0:3], axis=2)), axis=2)
-            self.ssp_ado_est_pose[name] = list(np.concatenate((self.ssp_ado_est_pose[name], np.reshape([0,0,0,1]*n, (n,1,4))), axis=1))
+            self.ssp_ado_est_pose[name] = states_to_tfs(ssp_ado_state_est_mat)
 
 
     def quant_eval(self):
@@ -237,41 +211,31 @@ class ResultAnalyser:
             print("Post-processing {} data now ({} itrs)".format(name, N))
             corners2D_gt = None
 
-            ###################################
+            # closest ego / ado gt pose for all the estimates at once (the gt logs have the est times, but the t_range can differ)
+            t_est = np.reshape(self.t_est[name], (-1,))
+            tf_w_ego_gt = self.ego_gt_pose[name][find_closest_inds_by_time(t_est, self.ego_gt_time_pose[name])]
+            tf_w_ado_gt = self.ado_gt_pose[name][find_closest_inds_by_time(t_est, self.t_gt[name])]
+            tf_w_cam = tf_w_ego_gt @ inv_tf(self.tf_cam_ego)
+            tf_cam_w = la.inv(tf_w_cam)
+            tf_cam_ado_est = tf_cam_w @ self.ado_est_pose[name]
+            tf_cam_ado_gt = tf_cam_w @ tf_w_ado_gt
+
+            box_length, box_width, box_height, diam = self.bb_3d_dict_all[name]
+            vertices = np.array([[ box_length/2, box_width/2, box_height/2, 1.],
+                                [ box_length/2, box_width/2,-box_height/2, 1.],
+                                [ box_length/2,-box_width/2,-box_height/2, 1.],
+                                [ box_length/2,-box_width/2, box_height/2, 1.],
+                                [-box_length/2,-box_width/2, box_height/2, 1.],
+                                [-box_length/2,-box_width/2,-box_height/2, 1.],
+                                [-box_length/2, box_width/2,-box_height/2, 1.],
+                                [-box_length/2, box_width/2, box_height/2, 1.]]).T
 
             for i in range(N):
-                # extract data in form needed for ssp analysis
-                t_est = self.t_est[name][i]
-                tf_w_ado_est = self.ado_est_pose[name][i]
-
-                tf_w_ego_gt, _ = find_closest_by_time(t_est, self.ego_gt_time_pose[name], message_list=self.ego_gt_pose[name])
-
-                tf_w_ego_est, _ = find_closest_by_time(t_est, self.ego_est_time_pose[name], message_list=self.ego_est_pose[name])
-
-                tf_w_ado_gt, _ = find_closest_by_time(t_est, self.t_gt[name], message_list=self.ado_gt_pose[name])
-
-                tf_w_cam = tf_w_ego_gt @ inv_tf(self.tf_cam_ego)
-                tf_cam_w = inv_tf(tf_w_cam)
-                tf_cam_ado_est = tf_cam_w @ tf_w_ado_est
-                tf_cam_ado_gt = tf_cam_w @ tf_w_ado_gt
-
-                R_cam_ado_pr = tf_cam_ado_est[0:3, 0:3]
-                t_cam_ado_pr = tf_cam_ado_est[0:3, 3].reshape((3, 1))
-                tf_cam_ado_gt = tf_cam_w @ tf_w_ado_gt
-                R_cam_ado_gt = tf_cam_ado_gt[0:3, 0:3]
-                t_cam_ado_gt = tf_cam_ado_gt[0:3, 3].reshape((3, 1))
-
-                box_length, box_width, box_height, diam = self.bb_3d_dict_all[name]
-                vertices = np.array([[ box_length/2, box_width/2, box_height/2, 1.],
-                                    [ box_length/2, box_width/2,-box_height/2, 1.],
-                                    [ box_length/2,-box_width/2,-box_height/2, 1.],
-                                    [ box_length/2,-box_width/2, box_height/2, 1.],
-                                    [-box_length/2,-box_width/2, box_height/2, 1.],
-                                    [-box_length/2,-box_width/2,-box_height/2, 1.],
-                                    [-box_length/2, box_width/2,-box_height/2, 1.],
-                                    [-box_length/2, box_width/2, box_height/2, 1.]]).T
-                
-                self.raptor_metrics.update_all_metrics(name=name, vertices=vertices, tf_w_cam=tf_w_cam, R_cam_ado_gt=R_cam_ado_gt, t_cam_ado_gt=t_cam_ado_gt, R_cam_ado_pr=R_cam_ado_pr, t_cam_ado_pr=t_cam_ado_pr, K=self.new_camera_matrix)
+                R_cam_ado_pr = tf_cam_ado_est[i, 0:3, 0:3]
+                t_cam_ado_pr = tf_cam_ado_est[i, 0:3, 3].reshape((3, 1))
+                R_cam_ado_gt = tf_cam_ado_gt[i, 0:3, 0:3]
+                t_cam_ado_gt = tf_cam_ado_gt[i, 0:3, 3].reshape((3, 1))
+                self.raptor_metrics.update_all_metrics(name=name, vertices=vertices, tf_w_cam=tf_w_cam[i], R_cam_ado_gt=R_cam_ado_gt, t_cam_ado_gt=t_cam_ado_gt, R_cam_ado_pr=R_cam_ado_pr, t_cam_ado_pr=t_cam_ado_pr, K=self.new_camera_matrix)
                 ######################################################
 
         self.raptor_metrics.calc_final_metrics()